@@ -3,7 +3,12 @@ A simple GUI for generating a .json file describing a perovskite
 Written by T. Jesper Jacobsson 2024 10
 The background is described in the paper ...
 """
+import logging
 import os
+import queue
+import sys
+import threading
+import time
 
 import customtkinter as ctk
 import tkinter as tk
@@ -11,21 +16,19 @@ from tkinter import ttk
 
 from perovskite_to_json import PerovskiteToJson
 from Utilities import default_values
+from Utilities import reference_data
 from Utilities.CTkScrollableDropdown import *
 from Utilities.filepaths import config
 
+logger = logging.getLogger(__name__)
+
 # Initialize the customtkinter theme
 ctk.set_appearance_mode("dark")
 ctk.set_default_color_theme("dark-blue")
 new_font = ('TkDefaultFont', 15)
 
-# Read in list of ions there is data for
-a_ions_from_database = default_values.get_a_ions()
-b_ions_from_database = default_values.get_b_ions()
-x_ions_from_database = default_values.get_x_ions()
-
-# Read in additives there is data for
-additives_from_database = default_values.get_additives()
+# The lists of ions and additives there is data for are read in a background thread when the App starts,
+# see App.load_dropdown_values
 
 class CompoundData(ctk.CTkFrame):
     def __init__(self, master, row, type="", values=[]):
@@ -81,6 +84,12 @@ class GetAdditivesData(ctk.CTkFrame):
             input_field = self.input_fields.pop()
             input_field.frame.destroy()
 
+    def set_values(self, values):
+        "Update the values in the dropdown menus"
+        self.values = values
+        for element in self.input_fields:
+            element.set_values(values)
+
     def get(self):
         additives = []
         concentration = []
@@ -160,6 +169,12 @@ class GetIonsData(ctk.CTkFrame):
             input_field = self.input_fields.pop()
             input_field.frame.destroy()
 
+    def set_values(self, values):
+        "Update the values in the dropdown menus"
+        self.values = values
+        for element in self.input_fields:
+            element.set_values(values)
+
     def get(self):
         ions = []
         coefficients = []
@@ -268,11 +283,16 @@ class IonData(ctk.CTkFrame):
         self.abbreviation = ctk.CTkComboBox(self.frame, font=new_font, variable="")
         self.abbreviation.grid(row=0, column=1, padx=10, pady=(10, 0), sticky="w")
         values = [""] + self.values
-        CTkScrollableDropdown(self.abbreviation, values=values, justify="left", button_color="transparent", autocomplete=True) 
+        self.dropdown = CTkScrollableDropdown(self.abbreviation, values=values, justify="left", button_color="transparent", autocomplete=True, virtual=True) 
 
         self.coefficient = ctk.CTkEntry(self.frame, placeholder_text="Coefficient", font=new_font)
         self.coefficient.grid(row=0, column=2, padx=10, pady=(10, 0), sticky="w")
 
+    def set_values(self, values):
+        "Update the values in the dropdown menu"
+        self.values = values
+        self.dropdown.configure(values=[""] + self.values)
+
 class AdditiveData(ctk.CTkFrame):
     def __init__(self, master, row, values):
     # def __init__(self, master, row, values, functions, conc_metrics):
@@ -288,7 +308,7 @@ class AdditiveData(ctk.CTkFrame):
         self.abbreviation = ctk.CTkComboBox(self.frame, font=new_font, variable="")
         self.abbreviation.grid(row=0, column=1, padx=10, pady=(10, 0), sticky="w")
         values = [""] + self.values
-        CTkScrollableDropdown(self.abbreviation, values=values, justify="left", button_color="transparent", autocomplete=True) 
+        self.dropdown = CTkScrollableDropdown(self.abbreviation, values=values, justify="left", button_color="transparent", autocomplete=True, virtual=True) 
 
         self.mass_fractions = ctk.CTkEntry(self.frame, placeholder_text="Mass fraction", font=new_font)
         self.mass_fractions.grid(row=0, column=2, padx=10, pady=(10, 0), sticky="w")
@@ -296,6 +316,11 @@ class AdditiveData(ctk.CTkFrame):
         self.concentration = ctk.CTkEntry(self.frame, placeholder_text=f"Cons. [/cm³]", font=new_font)
         self.concentration.grid(row=0, column=3, padx=10, pady=(10, 0), sticky="w")
 
+    def set_values(self, values):
+        "Update the values in the dropdown menu"
+        self.values = values
+        self.dropdown.configure(values=[""] + self.values)
+
 class SaveFolder(ctk.CTkFrame):
     def __init__(self, master, button_text, text, command):
         super().__init__(master) 
@@ -342,6 +367,14 @@ class StandardCombobox(ctk.CTkFrame):
 class App(ctk.CTk):
     def __init__(self):
         super().__init__()
+        self.start_time = time.perf_counter()
+
+        # Dropdown values from the last session are shown until the values are read in from the reference data
+        cached_dropdown_values = default_values.load_cached_dropdown_values()
+        if cached_dropdown_values is None:
+            self.dropdown_values = {"a_ions": [], "b_ions": [], "x_ions": [], "additives": []}
+        else:
+            self.dropdown_values = cached_dropdown_values
 
         self.title("Perovskite description to JSON")
         self.geometry("850x1200")
@@ -379,6 +412,12 @@ class App(ctk.CTk):
         self.json_button = StandardButton(self.content_frame, text="Generate JSON file", command=self.generate_json)
         self.json_button.grid(row=0, column=0, padx=10, pady=(10, 0), sticky="nsw") 
 
+        # Status of the json generation, shown next to the button
+        self.progressbar = ctk.CTkProgressBar(self.json_button, width=120, mode="indeterminate")
+        self.status = ctk.CTkLabel(self.json_button, text="", font=new_font)
+        self.status.grid(row=0, column=2, padx=10, pady=(5, 5), sticky="w")
+        self.generating = False
+
         # Clear user input button
         self.clear_button = StandardButton(self.content_frame, text="Clear user input", command=self.clear_user_input)
         self.clear_button.grid(row=1, column=0, padx=10, pady=(10, 0), sticky="nsw")        
@@ -410,30 +449,75 @@ class App(ctk.CTk):
         self.bandgap.grid(row=7, column=0, padx=10, pady=(10, 0), sticky="nsw")
 
         # A-ions
-        self.A_ions = GetIonsData(self.content_frame, title="A-ions", values=a_ions_from_database)
+        self.A_ions = GetIonsData(self.content_frame, title="A-ions", values=self.dropdown_values["a_ions"])
         self.A_ions.grid(row=8, column=0, padx=10, pady=(10, 0), sticky="nsw")
 
         # B-ions
-        self.B_ions = GetIonsData(self.content_frame, title="B-ions", values=b_ions_from_database)
+        self.B_ions = GetIonsData(self.content_frame, title="B-ions", values=self.dropdown_values["b_ions"])
         self.B_ions.grid(row=9, column=0, padx=10, pady=(10, 0), sticky="nsw")
         
         # X-ions
-        self.X_ions = GetIonsData(self.content_frame, title="X-ions", values=x_ions_from_database)
+        self.X_ions = GetIonsData(self.content_frame, title="X-ions", values=self.dropdown_values["x_ions"])
         self.X_ions.grid(row=10, column=0, padx=10, pady=(10, 0), sticky="nsw")        
 
         # Additives
         self.additives = GetAdditivesData(self.content_frame, title="Additives", 
-                                        values=additives_from_database)
+                                        values=self.dropdown_values["additives"])
         self.additives.grid(row=11, column=0, padx=10, pady=(10, 0), sticky="nsw") 
 
         # Impurities
         self.impurities = GetAdditivesData(self.content_frame, title="Impurities", 
-                                        values=additives_from_database)
+                                        values=self.dropdown_values["additives"])
         self.impurities.grid(row=12, column=0, padx=10, pady=(10, 0), sticky="nsw") 
 
+        logger.debug(f"Window created after {1000 * (time.perf_counter() - self.start_time):.1f} ms "
+                     f"({'with' if cached_dropdown_values is not None else 'without'} cached dropdown values)")
+
+        # Read in the dropdown values in a background thread
+        self.load_dropdown_values()
+
     def _on_mouse_wheel(self, event):
         self.canvas.yview_scroll(int(-1 * (event.delta / 120)), "units")
 
+    def load_dropdown_values(self):
+        """Read in the lists of ions and additives there is data for in a background thread.
+        The results are passed back to the main loop through a queue, as tkinter should only be used from the main thread"""
+        self.dropdown_queue = queue.Queue()
+
+        def worker():
+            try:
+                dropdown_values = default_values.get_dropdown_values()
+                default_values.save_cached_dropdown_values(dropdown_values)
+                # Read in the reference data used when generating json files, so that the first click is fast 
+                reference_data.get_reference_tables(origin=config["origin"])
+                self.dropdown_queue.put(dropdown_values)
+            except Exception as error:
+                self.dropdown_queue.put(error)
+
+        threading.Thread(target=worker, daemon=True).start()
+        self.after(50, self.update_dropdown_values)
+
+    def update_dropdown_values(self):
+        "Update the dropdown menus when the background thread is done"
+        try:
+            dropdown_values = self.dropdown_queue.get_nowait()
+        except queue.Empty:
+            self.after(50, self.update_dropdown_values)
+            return
+
+        if isinstance(dropdown_values, Exception):
+            logger.error(f"Could not read in the dropdown values: {dropdown_values}")
+            return
+
+        if dropdown_values != self.dropdown_values:
+            self.dropdown_values = dropdown_values
+            self.A_ions.set_values(dropdown_values["a_ions"])
+            self.B_ions.set_values(dropdown_values["b_ions"])
+            self.X_ions.set_values(dropdown_values["x_ions"])
+            self.additives.set_values(dropdown_values["additives"])
+            self.impurities.set_values(dropdown_values["additives"])
+        logger.debug(f"Dropdown values loaded after {1000 * (time.perf_counter() - self.start_time):.1f} ms")
+
     def clear_user_input(self):
         "Clear user input"
         self.composition_estimate.clear()
@@ -447,7 +531,13 @@ class App(ctk.CTk):
         self.impurities.clear()
 
     def generate_json(self):
-        "Put user data together in a json file"
+        """Put user data together in a json file.
+        The user input is collected here, and the json file is generated and saved in a background thread
+        so that the window stays responsive"""
+        # Only one json file is generated at a time
+        if self.generating:
+            return
+
         # File path to save the data
         save_path = self.generate_save_path()
         
@@ -470,7 +560,7 @@ class App(ctk.CTk):
         impurities, impurities_concentrations, impurities_mass_fractions = self.impurities.get() 
 
         # Generate and save the perovskite object as json
-        perovskite = PerovskiteToJson(
+        arguments = dict(
             composition_estimate=composition_estimate,
             sample_type=sample_type,
             dimensionality=dimensionality, 
@@ -487,9 +577,51 @@ class App(ctk.CTk):
             impurities_abbreviations = impurities,
             impurities_concentrations = impurities_concentrations,
             impurities_mass_fractions = impurities_mass_fractions,         
-            path_to_reference_data='local', 
+            path_to_reference_data=config["origin"], 
             save_path=save_path,
             save=True)
+        
+        # Show that the generation has started and block new clicks until it is done
+        self.generating = True
+        self.json_button.button.configure(state="disabled")
+        self.status.configure(text="Generating JSON file...")
+        self.progressbar.grid(row=0, column=1, padx=10, pady=(5, 5), sticky="w")
+        self.progressbar.start()
+        self.generate_start_time = time.perf_counter()
+
+        # The reference data is shared between all PerovskiteToJson objects in the process, 
+        # so it is only read from file the first time
+        self.generate_queue = queue.Queue()
+
+        def worker():
+            try:
+                PerovskiteToJson(**arguments)
+                self.generate_queue.put(None)
+            except Exception as error:
+                self.generate_queue.put(error)
+
+        threading.Thread(target=worker, daemon=True).start()
+        self.after(20, lambda: self.generate_json_done(save_path))
+
+    def generate_json_done(self, save_path):
+        "Report the result when the background thread is done"
+        try:
+            error = self.generate_queue.get_nowait()
+        except queue.Empty:
+            self.after(20, lambda: self.generate_json_done(save_path))
+            return
+
+        self.progressbar.stop()
+        self.progressbar.grid_remove()
+        self.json_button.button.configure(state="normal")
+        self.generating = False
+
+        if error is None:
+            self.status.configure(text=f"Saved {os.path.basename(save_path)}")
+            logger.debug(f"{save_path} generated in {1000 * (time.perf_counter() - self.generate_start_time):.1f} ms")
+        else:
+            self.status.configure(text=f"Failed: {error}")
+            logger.error(f"Could not generate {save_path}: {error}")
 
     def generate_save_path(self):
         "Generate the compleat file path to where to save the data"
@@ -512,5 +644,7 @@ class App(ctk.CTk):
         self.save_folder.update_textbox(text=self.folder_selected)
 
 if __name__ == "__main__":
+    # Debug information, e.g. the startup time, is logged when the GUI is started with --debug
+    logging.basicConfig(level=logging.DEBUG if "--debug" in sys.argv else logging.WARNING)
     app = App()
     app.mainloop()
\ No newline at end of file
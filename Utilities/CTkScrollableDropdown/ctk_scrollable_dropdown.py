@@ -6,7 +6,8 @@ Author: Akash Bora
 import customtkinter
 import sys
 import time
-import difflib
+
+from .search_index import SearchIndex
 
 class CTkScrollableDropdown(customtkinter.CTkToplevel):
     
@@ -15,7 +16,7 @@ class CTkScrollableDropdown(customtkinter.CTkToplevel):
                  scrollbar=True, scrollbar_button_hover_color=None, frame_border_width=2, values=[],
                  command=None, image_values=[], alpha: float = 0.97, frame_corner_radius=20, double_click=False,
                  resize=True, frame_border_color=None, text_color=None, autocomplete=False, 
-                 hover_color=None, **button_kwargs):
+                 hover_color=None, filter_delay: int = 100, virtual=False, **button_kwargs):
         
         super().__init__(takefocus=1)
         
@@ -66,15 +67,34 @@ class CTkScrollableDropdown(customtkinter.CTkToplevel):
             self.scroll_button_color = self.fg_color
             self.scroll_hover_color = self.fg_color
             
-        self.frame = customtkinter.CTkScrollableFrame(self, bg_color=self.transparent_color, fg_color=self.fg_color,
-                                        scrollbar_button_hover_color=self.scroll_hover_color,
-                                        corner_radius=self.corner, border_width=frame_border_width,
-                                        scrollbar_button_color=self.scroll_button_color,
-                                        border_color=self.frame_border_color)
-        self.frame._scrollbar.grid_configure(padx=3)
-        self.frame.pack(expand=True, fill="both")
-        self.dummy_entry = customtkinter.CTkEntry(self.frame, fg_color="transparent", border_width=0, height=1, width=1)
-        self.no_match = customtkinter.CTkLabel(self.frame, text="No Match")
+        # In virtual mode, only the rows that fit in the dropdown are made as buttons,
+        # and the buttons are reused for other values when scrolling
+        self.virtual = virtual
+        if self.virtual:
+            self.frame = customtkinter.CTkFrame(self, bg_color=self.transparent_color, fg_color=self.fg_color,
+                                                corner_radius=self.corner, border_width=frame_border_width,
+                                                border_color=self.frame_border_color)
+            self.frame.pack(expand=True, fill="both")
+            self.scrollbar = customtkinter.CTkScrollbar(self.frame, command=self._scroll_rows,
+                                                        button_color=self.scroll_button_color,
+                                                        button_hover_color=self.scroll_hover_color)
+            self.scrollbar.pack(side="right", fill="y", padx=3, pady=max(self.corner // 2, frame_border_width))
+            self.button_frame = customtkinter.CTkFrame(self.frame, fg_color="transparent", corner_radius=0)
+            self.button_frame.pack(side="left", expand=True, fill="both",
+                                   padx=(max(self.corner // 2, frame_border_width), 0), pady=max(self.corner // 2, frame_border_width))
+            for widget in (self.frame, self.button_frame):
+                self._bind_mouse_wheel(widget)
+        else:
+            self.frame = customtkinter.CTkScrollableFrame(self, bg_color=self.transparent_color, fg_color=self.fg_color,
+                                            scrollbar_button_hover_color=self.scroll_hover_color,
+                                            corner_radius=self.corner, border_width=frame_border_width,
+                                            scrollbar_button_color=self.scroll_button_color,
+                                            border_color=self.frame_border_color)
+            self.frame._scrollbar.grid_configure(padx=3)
+            self.frame.pack(expand=True, fill="both")
+            self.button_frame = self.frame
+        self.dummy_entry = customtkinter.CTkEntry(self.button_frame, fg_color="transparent", border_width=0, height=1, width=1)
+        self.no_match = customtkinter.CTkLabel(self.button_frame, text="No Match")
         self.height = height
         self.height_new = height
         self.width = width
@@ -84,6 +104,8 @@ class CTkScrollableDropdown(customtkinter.CTkToplevel):
         self.autocomplete = autocomplete
         self.var_update = customtkinter.StringVar()
         self.appear = False
+        self.filter_delay = filter_delay
+        self._filter_job = None
         
         if justify.lower()=="left":
             self.justify = "w"
@@ -94,6 +116,7 @@ class CTkScrollableDropdown(customtkinter.CTkToplevel):
             
         self.button_height = button_height
         self.values = values
+        self.search_index = SearchIndex(self.values)
         self.button_num = len(self.values)
         self.image_values = None if len(image_values)!=len(self.values) else image_values
         
@@ -144,6 +167,15 @@ class CTkScrollableDropdown(customtkinter.CTkToplevel):
         self.hide = True
 
     def _update(self, a, b, c):
+        # Filter when the user pauses typing, not on every key stroke
+        if self._filter_job is not None:
+            self.after_cancel(self._filter_job)
+        self._filter_job = self.after(self.filter_delay, self._filter)
+
+    def _filter(self):
+        self._filter_job = None
+        if not self.winfo_exists():
+            return
         self.live_update(self.attach._entry.get())
         
     def bind_autocomplete(self, ):
@@ -178,6 +210,9 @@ class CTkScrollableDropdown(customtkinter.CTkToplevel):
             time.sleep(1/100)
             
     def _init_buttons(self, **button_kwargs):
+        if self.virtual:
+            self._init_rows(**button_kwargs)
+            return
         self.i = 0
         self.widgets = {}
         for row in self.values:
@@ -192,7 +227,106 @@ class CTkScrollableDropdown(customtkinter.CTkToplevel):
             self.widgets[self.i].pack(fill="x", pady=2, padx=(self.padding, 0))
             self.i+=1
  
+        self.visible = list(self.widgets.keys())
         self.hide = False
+
+    def _init_rows(self, **button_kwargs):
+        # Pool of buttons for the rows that fit in the dropdown, plus one for a partly visible row
+        self.i = len(self.values)
+        self.widgets = {}
+        self.row_kwargs = button_kwargs
+        self.row_values = []
+        self.n_packed = 0
+        self.first_row = 0
+        self.visible = list(range(len(self.values)))
+        self._resize_rows(self.height)
+        self.hide = False
+
+    def _resize_rows(self, height):
+        # Add or remove buttons in the pool so that it fills a dropdown of the given height
+        n_rows = max(1, height // (self.button_height + 4) + 1)
+        if n_rows == len(self.widgets):
+            return
+        for row in range(len(self.widgets), n_rows):
+            self.widgets[row] = customtkinter.CTkButton(self.button_frame,
+                                                        text="",
+                                                        height=self.button_height,
+                                                        fg_color=self.button_color,
+                                                        text_color=self.text_color,
+                                                        anchor=self.justify, **self.row_kwargs)
+            self._bind_mouse_wheel(self.widgets[row])
+        for row in range(n_rows, len(self.widgets)):
+            self.widgets.pop(row).destroy()
+        self.row_values = (self.row_values + [None] * n_rows)[:n_rows]
+        self.n_packed = min(self.n_packed, n_rows)
+        self._render_rows()
+
+    def _bind_mouse_wheel(self, widget):
+        widget.bind("<MouseWheel>", self._on_mouse_wheel, add="+")
+        widget.bind("<Button-4>", self._on_mouse_wheel, add="+")
+        widget.bind("<Button-5>", self._on_mouse_wheel, add="+")
+
+    def _on_mouse_wheel(self, event):
+        if getattr(event, "num", None) == 4:
+            step = -1
+        elif getattr(event, "num", None) == 5:
+            step = 1
+        elif sys.platform.startswith("darwin"):
+            step = -event.delta
+        else:
+            step = -(event.delta // 120) or (-1 if event.delta > 0 else 1)
+        self.first_row += step
+        self._render_rows()
+        return "break"
+
+    def _scroll_rows(self, *args):
+        # Called by the scrollbar as ("moveto", fraction) or ("scroll", number, "units"/"pages")
+        page = max(1, len(self.widgets) - 1)
+        if args[0] == "moveto":
+            self.first_row = int(float(args[1]) * len(self.visible))
+        elif args[0] == "scroll":
+            self.first_row += int(args[1]) * (page if args[2] == "pages" else 1)
+        self._render_rows()
+
+    def _render_rows(self):
+        # Show the visible values from first_row and on in the pool of buttons
+        n_rows = len(self.widgets)
+        n_shown = n_rows - 1
+        self.first_row = max(0, min(self.first_row, len(self.visible) - n_shown))
+        n_packed = min(n_rows, len(self.visible) - self.first_row)
+
+        for row in range(n_packed):
+            key = self.visible[self.first_row + row]
+            if self.row_values[row] != key:
+                self.widgets[row].configure(text=self.values[key],
+                                            image=self.image_values[key] if self.image_values is not None and key < len(self.image_values) else None,
+                                            command=lambda k=self.values[key]: self._attach_key_press(k))
+                self.row_values[row] = key
+        # The packed buttons are always the first n_packed in the pool, so they stay in order
+        for row in range(self.n_packed, n_packed):
+            self.widgets[row].pack(fill="x", pady=2, padx=(self.padding, 0))
+        for row in range(n_packed, self.n_packed):
+            self.widgets[row].pack_forget()
+        self.n_packed = n_packed
+
+        if len(self.visible) > 0:
+            self.scrollbar.set(self.first_row / len(self.visible), min(1.0, (self.first_row + n_shown) / len(self.visible)))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def _show(self, visible):
+        # Show the buttons of the values with the given ids. Buttons are only repacked if the ids change
+        if self.virtual:
+            self.visible = visible
+            self.first_row = 0
+            self._render_rows()
+            return
+        if visible != self.visible:
+            for key in self.visible:
+                self.widgets[key].pack_forget()
+            for key in visible:
+                self.widgets[key].pack(fill="x", pady=2, padx=(self.padding, 0))
+            self.visible = visible
             
     def destroy_popup(self):
         self.destroy()
@@ -211,6 +345,9 @@ class CTkScrollableDropdown(customtkinter.CTkToplevel):
             if self.height_new>self.height:
                 self.height_new = self.height
 
+        if self.virtual:
+            self._resize_rows(self.height_new)
+
         self.geometry('{}x{}+{}+{}'.format(self.width_new, self.height_new,
                                            self.x_pos, self.y_pos))
         self.fade_in()
@@ -249,18 +386,11 @@ class CTkScrollableDropdown(customtkinter.CTkToplevel):
         if self.disable: return
         if self.fade: return
         if string:
-            string = string.lower()
             self._deiconify()
-            i=1
-            for key in self.widgets.keys():
-                s = self.widgets[key].cget("text").lower()
-                text_similarity = difflib.SequenceMatcher(None, s[0:len(string)], string).ratio()
-                similar = s.startswith(string) or text_similarity > 0.75
-                if not similar:
-                    self.widgets[key].pack_forget()
-                else:
-                    self.widgets[key].pack(fill="x", pady=2, padx=(self.padding, 0))
-                    i+=1
+            # Values starting with, or similar to, the string
+            visible = self.search_index.search(string)
+            self._show(visible)
+            i = len(visible) + 1
                     
             if i==1:
                 self.no_match.pack(fill="x", pady=2, padx=(self.padding, 0))
@@ -272,15 +402,23 @@ class CTkScrollableDropdown(customtkinter.CTkToplevel):
         else:
             self.no_match.pack_forget()
             self.button_num = len(self.values)
-            for key in self.widgets.keys():
-                self.widgets[key].destroy()
-            self._init_buttons()
+            # Show all values again, without making new buttons
+            self._show(list(range(len(self.values))))
+            self.hide = False
             self.place_dropdown()
             
-        self.frame._parent_canvas.yview_moveto(0.0)
+        if not self.virtual:
+            self.frame._parent_canvas.yview_moveto(0.0)
         self.appear = False
         
     def insert(self, value, **kwargs):
+        if self.virtual:
+            self.values.append(value)
+            self.search_index.add(value)
+            self.visible.append(self.i)
+            self.i+=1
+            self._render_rows()
+            return
         self.widgets[self.i] = customtkinter.CTkButton(self.frame,
                                                        text=value,
                                                        height=self.button_height,
@@ -289,8 +427,10 @@ class CTkScrollableDropdown(customtkinter.CTkToplevel):
                                                        anchor=self.justify,
                                                        command=lambda k=value: self._attach_key_press(k), **kwargs)
         self.widgets[self.i].pack(fill="x", pady=2, padx=(self.padding, 0))
+        self.visible.append(self.i)
         self.i+=1
         self.values.append(value)
+        self.search_index.add(value)
         
     def _deiconify(self):
         if len(self.values)>0:
@@ -306,6 +446,8 @@ class CTkScrollableDropdown(customtkinter.CTkToplevel):
         if "height" in kwargs:
             self.height = kwargs.pop("height")
             self.height_new = self.height
+            if self.virtual:
+                self._resize_rows(self.height)
             
         if "alpha" in kwargs:
             self.alpha = kwargs.pop("alpha")
@@ -318,16 +460,25 @@ class CTkScrollableDropdown(customtkinter.CTkToplevel):
             
         if "values" in kwargs:
             self.values = kwargs.pop("values")
+            self.search_index = SearchIndex(self.values)
             self.image_values = None
             self.button_num = len(self.values)
-            for key in self.widgets.keys():
-                self.widgets[key].destroy()
-            self._init_buttons()
+            if self.virtual:
+                self.i = len(self.values)
+                self.row_values = [None] * len(self.widgets)
+                self._show(list(range(len(self.values))))
+            else:
+                for key in self.widgets.keys():
+                    self.widgets[key].destroy()
+                self._init_buttons()
  
         if "image_values" in kwargs:
             self.image_values = kwargs.pop("image_values")
             self.image_values = None if len(self.image_values)!=len(self.values) else self.image_values
-            if self.image_values is not None:
+            if self.virtual:
+                self.row_values = [None] * len(self.widgets)
+                self._render_rows()
+            elif self.image_values is not None:
                 i=0
                 for key in self.widgets.keys():
                     self.widgets[key].configure(image=self.image_values[i])
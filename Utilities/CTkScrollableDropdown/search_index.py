@@ -0,0 +1,93 @@
+'''
+Search index for filtering the values of the scrollable dropdown while typing
+'''
+
+import difflib
+from bisect import bisect_left
+
+class SearchIndex:
+    """Index of the values in a dropdown menu.
+
+    A value matches a search string if, ignoring case, it starts with the string,
+    or if its first len(string) characters are similar to the string (difflib ratio above threshold).
+    Values starting with the string are found in a prefix trie. For the similarity, an index of the
+    positions of every character gives an upper bound of the difflib ratio (as SequenceMatcher.quick_ratio),
+    so difflib is only run for values that can pass the threshold.
+    The result is the same as comparing the search string with every value.
+    """
+    def __init__(self, values=(), threshold=0.75, cache_size=1000):
+        self.threshold = threshold
+        self.cache_size = cache_size
+        self.values = []
+        # Trie node: [children, ids of the values that start with the prefix of the node]
+        self.trie = [{}, []]
+        # Character -> {id of value: positions of the character in the value}
+        self.positions = {}
+        # Results of earlier searches
+        self.results = {}
+        for value in values:
+            self.add(value)
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, value):
+        "Add a value to the end of the index"
+        i = len(self.values)
+        value = str(value).lower()
+        self.values.append(value)
+        self.results = {}
+
+        node = self.trie
+        node[1].append(i)
+        for character in value:
+            node = node[0].setdefault(character, [{}, []])
+            node[1].append(i)
+
+        for position, character in enumerate(value):
+            self.positions.setdefault(character, {}).setdefault(i, []).append(position)
+
+    def starting_with(self, string):
+        "Ids of the values that start with the string"
+        node = self.trie
+        for character in string:
+            node = node[0].get(character)
+            if node is None:
+                return []
+        return node[1]
+
+    def similar(self, string, skip=()):
+        "Ids of the values where the first len(string) characters are similar to the string"
+        n = len(string)
+
+        # Upper bound of the number of matching characters between string and the start of each value
+        counts = {}
+        for character in set(string):
+            n_character = string.count(character)
+            for i, positions in self.positions.get(character, {}).items():
+                n_start = bisect_left(positions, n)
+                if n_start:
+                    counts[i] = counts.get(i, 0) + min(n_start, n_character)
+
+        ids = []
+        for i, count in counts.items():
+            if i in skip:
+                continue
+            start = self.values[i][0:n]
+            if 2.0 * count / (len(start) + n) <= self.threshold:
+                continue
+            if difflib.SequenceMatcher(None, start, string).ratio() > self.threshold:
+                ids.append(i)
+        return ids
+
+    def search(self, string):
+        "Ids, in the order of the values, of all values that match the string"
+        string = string.lower()
+        ids = self.results.get(string)
+        if ids is None:
+            prefix_ids = self.starting_with(string)
+            ids = sorted(set(prefix_ids).union(self.similar(string, skip=set(prefix_ids))))
+            if len(self.results) >= self.cache_size:
+                self.results = {}
+            self.results[string] = ids
+        return ids
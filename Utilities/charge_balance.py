@@ -0,0 +1,194 @@
+"""
+Stoichiometry and charge balance of many perovskite compositions at once
+
+The charges of the ions are read from the column Molecular_formula in the reference tables
+(e.g. Cs+, Pb+2, I-), and the compositions are taken as CompositionArrays (see composition_arrays.py),
+so that the sums of the coefficients of every site and the net charge are computed with NumPy for
+all compositions at once, instead of one PerovskiteToJson object at a time.
+
+The expected stoichiometry depends on the dimensionality of the composition: ABX3 for 3D perovskites
+and A2BX4 for 2D perovskites. Other dimensionalities are checked against the stoichiometry given by
+default (ABX3), or not checked if default is None.
+
+    balance = ChargeBalance(CompositionArrays.from_documents(documents))
+    report = balance.check(normalise="b")
+    report[~report["valid"]]
+"""
+import numpy as np
+import pandas as pd
+
+try:
+    import chemical_formula
+    import composition_arrays
+    import reference_data
+except:
+    from Utilities import chemical_formula
+    from Utilities import composition_arrays
+    from Utilities import reference_data
+
+# Coefficients of the A, B, and X sites for the dimensionalities
+STOICHIOMETRY = {
+    "3D": (1.0, 1.0, 3.0),
+    "2D": (2.0, 1.0, 4.0),
+    }
+
+
+def site_charges(table):
+    "Dictionary from the abbreviation of an ion to its charge, for the ions in a reference table with a known charge"
+    charges = {}
+    for abbreviation, record in reference_data.get_index(table).records.items():
+        charge = chemical_formula.formula_charge(record["Molecular_formula"])
+        if charge is not None:
+            charges[abbreviation] = charge
+    return charges
+
+def get_charges(origin="local"):
+    "The charges of the ions in the A-, B-, and X-ion reference tables, as a dictionary from the site to site_charges"
+    tables = reference_data.get_reference_tables(origin)
+    return {site: site_charges(table) for site, table in zip(composition_arrays.ION_SITES, tables)}
+
+
+class ChargeBalance:
+    """Site sums, net charge, and stoichiometry checks for CompositionArrays.
+
+    charges: dictionary from the site ('a', 'b', 'x') to a dictionary from the abbreviation to the charge.
+             Read from the reference data given by path_to_reference_data if None.
+    default: the stoichiometry (key in STOICHIOMETRY) for compositions with another dimensionality than 2D or 3D,
+             or None to not check them
+    """
+    def __init__(self, arrays, charges=None, path_to_reference_data="local", default="3D"):
+        if default is not None and default not in STOICHIOMETRY:
+            raise ValueError(f"Unknown stoichiometry '{default}'. Options are: {', '.join(STOICHIOMETRY)}")
+        self.arrays = arrays
+        self.charges = get_charges(path_to_reference_data) if charges is None else charges
+        self.default = default
+        self._charge_codes = {}
+
+    def __len__(self):
+        return len(self.arrays)
+
+    def charge_codes(self, site):
+        "The charge of every ion code in the ion table in a site, nan for ions with an unknown charge"
+        values = self._charge_codes.get(site)
+        if values is None:
+            charges = self.charges.get(site, {})
+            ions = self.arrays.ions
+            values = np.array([charges.get(ions[code], np.nan) for code in range(len(ions))], dtype=np.float64)
+            self._charge_codes[site] = values
+        return values
+
+    def _sum(self, site, values):
+        "Sum of values with one value per ion over the ions of every composition. nan if any of the values is nan"
+        site_arrays = self.arrays.sites[site]
+        return np.bincount(site_arrays.rows, weights=values, minlength=len(site_arrays))
+
+    def site_sums(self, coefficients=None):
+        "Dictionary from the site to the sum of the coefficients in every composition"
+        coefficients = coefficients or {}
+        return {site: self._sum(site, coefficients.get(site, self.arrays.sites[site].coefficients))
+                for site in composition_arrays.ION_SITES}
+
+    def site_charge(self, coefficients=None):
+        "Dictionary from the site to the charge of the site in every composition. nan if a charge or coefficient is not known"
+        coefficients = coefficients or {}
+        charges = {}
+        for site in composition_arrays.ION_SITES:
+            site_arrays = self.arrays.sites[site]
+            values = coefficients.get(site, site_arrays.coefficients) * self.charge_codes(site)[site_arrays.codes]
+            charges[site] = self._sum(site, values)
+        return charges
+
+    def net_charge(self, coefficients=None):
+        "The net charge of every composition"
+        charges = self.site_charge(coefficients)
+        return charges["a"] + charges["b"] + charges["x"]
+
+    def expected(self):
+        "The expected coefficients of the A, B, and X sites of every composition as an (n, 3) array. nan if not checked"
+        expected = np.full((len(self), 3), np.nan)
+        if self.default is not None:
+            expected[:] = STOICHIOMETRY[self.default]
+        table = self.arrays.strings["dimensionality"]
+        dimensionality = self.arrays.columns["dimensionality"]
+        for name, stoichiometry in STOICHIOMETRY.items():
+            code = table.code(name)
+            if code >= 0:
+                expected[dimensionality == code] = stoichiometry
+        return expected
+
+    def normalisation(self, to="b"):
+        """Factor for every composition that scales the B site to the expected coefficient (1), with to='b',
+        or the X site to the expected coefficient (3 for 3D, 4 for 2D), with to='x'. nan where it cannot be scaled"""
+        column = {"b": 1, "x": 2}.get(to)
+        if column is None:
+            raise ValueError("Normalisation can be to 'b' or 'x'")
+        sums = self.site_sums()[to]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            factor = self.expected()[:, column] / sums
+        factor[~np.isfinite(factor)] = np.nan
+        return factor
+
+    def normalised_coefficients(self, to="b"):
+        "Dictionary from the site to the coefficients of the ions scaled with normalisation, with one value per ion"
+        factor = self.normalisation(to)
+        return {site: self.arrays.sites[site].coefficients * factor[self.arrays.sites[site].rows]
+                for site in composition_arrays.ION_SITES}
+
+    def normalised(self, to="b"):
+        "CompositionArrays with the coefficients of the A, B, and X sites scaled with normalisation"
+        sites = dict(self.arrays.sites)
+        for site, coefficients in self.normalised_coefficients(to).items():
+            site_arrays = sites[site]
+            sites[site] = composition_arrays.SiteArrays(site_arrays.offsets, site_arrays.codes, coefficients,
+                                                        site_arrays.concentrations)
+        return composition_arrays.CompositionArrays(self.arrays.ions, sites, self.arrays.band_gap,
+                                                    self.arrays.strings, self.arrays.columns)
+
+    def check(self, normalise=None, stoichiometry_tolerance=0.01, charge_tolerance=0.01):
+        """Check the stoichiometry and the charge balance of all compositions. Returns a DataFrame with one row per composition:
+
+        a, b, x: the sums of the coefficients of the sites (after normalisation)
+        expected_a, expected_b, expected_x: the expected coefficients for the dimensionality
+        net_charge: the net charge (after normalisation)
+        known: False if a coefficient or a charge is not known, or if the stoichiometry is not checked
+        stoichiometry_ok: all sites within stoichiometry_tolerance of the expected coefficients
+        charge_ok: the absolute net charge is at most charge_tolerance
+        valid: known, stoichiometry_ok, and charge_ok
+
+        normalise: None, or 'b' or 'x' to scale the coefficients before the check (see normalisation)
+        """
+        coefficients = None if normalise is None else self.normalised_coefficients(normalise)
+        sums = self.site_sums(coefficients)
+        net_charge = self.net_charge(coefficients)
+        expected = self.expected()
+        actual = np.column_stack([sums["a"], sums["b"], sums["x"]])
+
+        known = ~np.isnan(actual).any(axis=1) & ~np.isnan(expected).any(axis=1) & ~np.isnan(net_charge)
+        with np.errstate(invalid="ignore"):
+            stoichiometry_ok = (np.abs(actual - expected) <= stoichiometry_tolerance).all(axis=1)
+            charge_ok = np.abs(net_charge) <= charge_tolerance
+
+        return pd.DataFrame({
+            "a": sums["a"],
+            "b": sums["b"],
+            "x": sums["x"],
+            "expected_a": expected[:, 0],
+            "expected_b": expected[:, 1],
+            "expected_x": expected[:, 2],
+            "net_charge": net_charge,
+            "known": known,
+            "stoichiometry_ok": stoichiometry_ok,
+            "charge_ok": charge_ok,
+            "valid": known & stoichiometry_ok & charge_ok,
+            })
+
+    def violations(self, **kwargs):
+        "Positions of the compositions that are known and fail the stoichiometry or the charge check. See check for the arguments"
+        report = self.check(**kwargs)
+        return np.flatnonzero(report["known"].to_numpy() & ~report["valid"].to_numpy())
+
+
+def check_charge_balance(documents, path_to_reference_data="local", **kwargs):
+    "Check documents ({'data': {...}}) from PerovskiteToJson or BatchConverter. See ChargeBalance.check for the arguments"
+    arrays = composition_arrays.CompositionArrays.from_documents(documents)
+    return ChargeBalance(arrays, path_to_reference_data=path_to_reference_data).check(**kwargs)
@@ -0,0 +1,118 @@
+"""
+Reading of the molecular formulas in the reference data of the ions
+
+The formulas in the column Molecular_formula are written with the charge last, as a sign
+followed by the size of the charge, e.g. Cs+, Pb+2, O-2, C7H20N2+2. Some formulas repeat the
+sign instead (C8H14N2++), and some have blank spaces or line breaks around them.
+
+Formulas are parsed into the number of atoms of every element, with groups in parentheses
+or brackets, e.g. (CH3NH3)2PbI4. Parsed formulas are cached, as the same formulas are used
+for every composition with the ion. Formulas that cannot be read, e.g. polymers as (C2H5N)n,
+raise FormulaError, and get a molar mass of nan.
+"""
+import math
+import re
+from functools import lru_cache
+
+# The charge at the end of a formula: a sign followed by digits, or a repeated sign
+_CHARGE = re.compile(r"(\++|-+)([0-9]*)$")
+# The parts of a formula: an element, the start or end of a group, and a number of atoms
+_TOKEN = re.compile(r"([A-Z][a-z]?)|([(\[])|([)\]])|([0-9]+(?:\.[0-9]+)?)|(.)")
+_CLOSING = {"(": ")", "[": "]"}
+
+# Standard atomic weights (g/mol), as the conventional values from IUPAC,
+# and the mass number of the most stable isotope for elements without a standard atomic weight
+ATOMIC_MASSES = {
+    "H": 1.008, "He": 4.0026, "Li": 6.94, "Be": 9.0122, "B": 10.81, "C": 12.011, "N": 14.007, "O": 15.999,
+    "F": 18.998, "Ne": 20.180, "Na": 22.990, "Mg": 24.305, "Al": 26.982, "Si": 28.085, "P": 30.974, "S": 32.06,
+    "Cl": 35.45, "Ar": 39.95, "K": 39.098, "Ca": 40.078, "Sc": 44.956, "Ti": 47.867, "V": 50.942, "Cr": 51.996,
+    "Mn": 54.938, "Fe": 55.845, "Co": 58.933, "Ni": 58.693, "Cu": 63.546, "Zn": 65.38, "Ga": 69.723, "Ge": 72.630,
+    "As": 74.922, "Se": 78.971, "Br": 79.904, "Kr": 83.798, "Rb": 85.468, "Sr": 87.62, "Y": 88.906, "Zr": 91.224,
+    "Nb": 92.906, "Mo": 95.95, "Tc": 97.0, "Ru": 101.07, "Rh": 102.91, "Pd": 106.42, "Ag": 107.87, "Cd": 112.41,
+    "In": 114.82, "Sn": 118.71, "Sb": 121.76, "Te": 127.60, "I": 126.90, "Xe": 131.29, "Cs": 132.91, "Ba": 137.33,
+    "La": 138.91, "Ce": 140.12, "Pr": 140.91, "Nd": 144.24, "Pm": 145.0, "Sm": 150.36, "Eu": 151.96, "Gd": 157.25,
+    "Tb": 158.93, "Dy": 162.50, "Ho": 164.93, "Er": 167.26, "Tm": 168.93, "Yb": 173.05, "Lu": 174.97, "Hf": 178.49,
+    "Ta": 180.95, "W": 183.84, "Re": 186.21, "Os": 190.23, "Ir": 192.22, "Pt": 195.08, "Au": 196.97, "Hg": 200.59,
+    "Tl": 204.38, "Pb": 207.2, "Bi": 208.98, "Po": 209.0, "At": 210.0, "Rn": 222.0, "Fr": 223.0, "Ra": 226.0,
+    "Ac": 227.0, "Th": 232.04, "Pa": 231.04, "U": 238.03, "Np": 237.0, "Pu": 244.0,
+    }
+
+
+class FormulaError(ValueError):
+    "A formula that cannot be read"
+
+
+def split_charge(formula):
+    """A formula split into the neutral formula and the charge, e.g. 'Pb+2' -> ('Pb', 2).
+    The charge is None if the formula has no charge"""
+    formula = str(formula).strip()
+    match = _CHARGE.search(formula)
+    if match is None:
+        return formula, None
+    signs, digits = match.groups()
+    charge = int(digits) if digits else len(signs)
+    if signs[0] == "-":
+        charge = -charge
+    return formula[:match.start()].strip(), charge
+
+def formula_charge(formula):
+    "The charge of a formula as an integer, e.g. 'Pb+2' -> 2, 'I-' -> -1. None if the formula has no charge"
+    return split_charge(formula)[1]
+
+
+@lru_cache(maxsize=None)
+def parse_formula(formula):
+    """The number of atoms of every element in a formula, as a tuple of (element, number) in the order the
+    elements are first found, e.g. 'CH6N+' -> (('C', 1), ('H', 6), ('N', 1)). The charge is ignored"""
+    text = split_charge(formula)[0]
+    if text == "" or text == "nan":
+        raise FormulaError(f"No formula given: '{formula}'")
+
+    # One dictionary of counts per open group
+    stack = [{}]
+    openings = []
+    last = None
+    for element, opening, closing, number, other in _TOKEN.findall(text):
+        if element:
+            if element not in ATOMIC_MASSES:
+                raise FormulaError(f"Unknown element '{element}' in '{formula}'")
+            counts = stack[-1]
+            counts[element] = counts.get(element, 0) + 1
+            last = ("element", element)
+        elif opening:
+            stack.append({})
+            openings.append(opening)
+            last = None
+        elif closing:
+            if not openings or _CLOSING[openings.pop()] != closing:
+                raise FormulaError(f"Unbalanced parentheses in '{formula}'")
+            group = stack.pop()
+            counts = stack[-1]
+            for key, value in group.items():
+                counts[key] = counts.get(key, 0) + value
+            last = ("group", group)
+        elif number:
+            if last is None:
+                raise FormulaError(f"Misplaced number in '{formula}'")
+            # The element or group before the number is counted once already
+            counts = stack[-1]
+            factor = float(number) if "." in number else int(number)
+            if last[0] == "element":
+                counts[last[1]] += factor - 1
+            else:
+                for key, value in last[1].items():
+                    counts[key] += value * (factor - 1)
+            last = None
+        elif not other.isspace():
+            raise FormulaError(f"Cannot read '{other}' in '{formula}'")
+    if openings:
+        raise FormulaError(f"Unbalanced parentheses in '{formula}'")
+    return tuple(stack[0].items())
+
+def molar_mass(formula):
+    "The molar mass of a formula in g/mol. nan if the formula cannot be read"
+    try:
+        counts = parse_formula(formula)
+    except FormulaError:
+        return math.nan
+    return math.fsum(ATOMIC_MASSES[element] * number for element, number in counts)
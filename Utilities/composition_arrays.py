@@ -0,0 +1,213 @@
+"""
+Columnar arrays for many perovskite compositions
+
+The compositions are stored site by site in compressed sparse row (CSR) form: for every site
+(A, B, X, additives, impurities) there is one array with the code of every ion, one with its
+coefficient, and an array of offsets so that the ions of composition i are found at
+offsets[i]:offsets[i + 1]. The codes refer to one table of abbreviations shared by all sites.
+The single values of the compositions (band gap, dimensionality, etc.) are stored as one
+array each, with the strings as codes in tables of their own.
+
+This makes it possible to handle questions about many compositions at once with NumPy,
+e.g. which compositions contain an ion, or the coefficient of an ion in every composition.
+CompositionArrays.from_documents builds the arrays from documents with the same structure as
+the Json files written by PerovskiteToJson, i.e. {"data": {...}}.
+"""
+import math
+from array import array
+from functools import cached_property
+
+import numpy as np
+
+# The sites, and the keys for the sites in the Json files
+SITES = ("a", "b", "x", "additives", "impurities")
+SITE_KEYS = {
+    "a": "ions_a_site",
+    "b": "ions_b_site",
+    "x": "ions_x_site",
+    "additives": "additives",
+    "impurities": "impurities",
+    }
+# Sites of ions with coefficients. The other sites have a mass fraction and a concentration
+ION_SITES = ("a", "b", "x")
+# Empty array of compositions
+_NO_ROWS = np.zeros(0, dtype=np.int64)
+# Single string values of a composition that are stored as codes
+STRING_COLUMNS = ("long_form", "short_form", "composition_estimate", "sample_type", "dimensionality")
+
+
+def parse_number(value):
+    "A coefficient, band gap, etc. as a float. Missing values and values that are not numbers, e.g. x, are nan"
+    if value is None:
+        return math.nan
+    if isinstance(value, str):
+        value = value.strip().replace(",", ".")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+class StringTable:
+    "Strings stored once, with the position in the table as the code of every string"
+    def __init__(self, strings=()):
+        self.strings = []
+        self.codes = {}
+        for string in strings:
+            self.add(string)
+
+    def __len__(self):
+        return len(self.strings)
+
+    def __getitem__(self, code):
+        return self.strings[code]
+
+    def __contains__(self, string):
+        return string in self.codes
+
+    def add(self, string):
+        "The code of a string, adding it to the table if it is new"
+        code = self.codes.get(string)
+        if code is None:
+            code = len(self.strings)
+            self.codes[string] = code
+            self.strings.append(string)
+        return code
+
+    def code(self, string):
+        "The code of a string, or -1 if it is not in the table"
+        return self.codes.get(string, -1)
+
+
+class SiteArrays:
+    """The ions of one site of many compositions in CSR form.
+
+    offsets: int64 array with n + 1 entries. The ions of composition i are at offsets[i]:offsets[i + 1]
+    codes: int32 array with the code of every ion
+    coefficients: float64 array with the coefficient (or mass fraction for additives and impurities) of every ion
+    concentrations: float64 array with the concentration of every additive or impurity, None for ion sites
+    """
+    def __init__(self, offsets, codes, coefficients, concentrations=None):
+        self.offsets = offsets
+        self.codes = codes
+        self.coefficients = coefficients
+        self.concentrations = concentrations
+
+    def __len__(self):
+        "Number of compositions"
+        return len(self.offsets) - 1
+
+    @cached_property
+    def rows(self):
+        "The composition of every ion"
+        return np.repeat(np.arange(len(self), dtype=np.int64), np.diff(self.offsets))
+
+    @cached_property
+    def postings(self):
+        "Dictionary from the code of an ion to a sorted array of the compositions where it is found"
+        order = np.argsort(self.codes, kind="stable")
+        codes = self.codes[order]
+        rows = self.rows[order]
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if len(codes) else np.zeros(0, dtype=np.int64)
+        ends = np.r_[starts[1:], len(codes)]
+        return {int(codes[start]): np.unique(rows[start:end]) for start, end in zip(starts, ends)}
+
+    def count(self):
+        "Number of ions in every composition"
+        return np.diff(self.offsets)
+
+    def contains(self, code):
+        "Boolean array, True for the compositions that contain the ion"
+        found = np.zeros(len(self), dtype=bool)
+        found[self.postings.get(code, _NO_ROWS)] = True
+        return found
+
+    def coefficient(self, code, values=None):
+        """The coefficient of an ion in every composition. 0 where the ion is not found, and nan where the coefficient
+        is not known. values can be another array with one value per ion, e.g. concentrations"""
+        values = self.coefficients if values is None else values
+        selected = self.codes == code
+        return np.bincount(self.rows[selected], weights=values[selected], minlength=len(self))
+
+    def ions(self, i):
+        "Codes and coefficients of the ions of composition i"
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.codes[start:end], self.coefficients[start:end]
+
+
+class SiteArraysBuilder:
+    "Collects the ions of one site, one composition at a time, and builds a SiteArrays"
+    def __init__(self, with_concentrations=False):
+        self.offsets = array("q", [0])
+        self.codes = array("i")
+        self.coefficients = array("d")
+        self.concentrations = array("d") if with_concentrations else None
+
+    def append(self, codes, coefficients, concentrations=None):
+        "Add the ions of the next composition"
+        self.codes.extend(codes)
+        self.coefficients.extend(coefficients)
+        if self.concentrations is not None:
+            self.concentrations.extend(concentrations)
+        self.offsets.append(len(self.codes))
+
+    def build(self):
+        return SiteArrays(np.frombuffer(self.offsets, dtype=np.int64).copy(),
+                          np.frombuffer(self.codes, dtype=np.int32).copy(),
+                          np.frombuffer(self.coefficients, dtype=np.float64).copy(),
+                          None if self.concentrations is None else np.frombuffer(self.concentrations, dtype=np.float64).copy())
+
+
+class CompositionArrays:
+    """Many compositions as columnar arrays.
+
+    ions: StringTable with the abbreviations of the ions, additives, and impurities in all sites
+    sites: dictionary from the site (see SITES) to its SiteArrays
+    band_gap: float64 array, nan where the band gap is not given
+    strings: dictionary from the name of a string value (see STRING_COLUMNS) to a StringTable, and
+    columns: dictionary from the name of a string value to an int32 array with the code of the value of every composition
+    """
+    def __init__(self, ions, sites, band_gap, strings, columns):
+        self.ions = ions
+        self.sites = sites
+        self.band_gap = band_gap
+        self.strings = strings
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.band_gap)
+
+    @classmethod
+    def from_documents(cls, documents):
+        "Build the arrays from Json documents ({'data': {...}}) or their 'data' dictionaries"
+        ions = StringTable()
+        builders = {site: SiteArraysBuilder(with_concentrations=site not in ION_SITES) for site in SITES}
+        band_gap = array("d")
+        strings = {column: StringTable([""]) for column in STRING_COLUMNS}
+        columns = {column: array("i") for column in STRING_COLUMNS}
+
+        for document in documents:
+            data = document.get("data", document)
+            for site in SITES:
+                entries = data.get(SITE_KEYS[site], [])
+                codes = [ions.add(str(entry.get("abbreviation", ""))) for entry in entries]
+                if site in ION_SITES:
+                    builders[site].append(codes, [parse_number(entry.get("coefficient")) for entry in entries])
+                else:
+                    builders[site].append(codes,
+                                          [parse_number(entry.get("mass_fraction")) for entry in entries],
+                                          [parse_number(entry.get("concentration")) for entry in entries])
+            band_gap.append(parse_number(data.get("band_gap")))
+            for column in STRING_COLUMNS:
+                columns[column].append(strings[column].add(str(data.get(column, ""))))
+
+        return cls(ions,
+                   {site: builder.build() for site, builder in builders.items()},
+                   np.frombuffer(band_gap, dtype=np.float64).copy(),
+                   strings,
+                   {column: np.frombuffer(codes, dtype=np.int32).copy() for column, codes in columns.items()})
+
+    def string_values(self, column):
+        "The values of a string column as a list of strings"
+        table = self.strings[column]
+        return [table[code] for code in self.columns[column]]
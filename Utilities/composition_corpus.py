@@ -0,0 +1,237 @@
+"""
+Queries over a corpus of perovskite composition Json files
+
+CompositionCorpus reads Json files written by PerovskiteToJson (e.g. the files in
+'Perovskite composition files'), or JSON Lines files written by BatchConverter, once, and keeps
+the compositions as columnar arrays (see composition_arrays.py). Questions about the corpus are then
+answered with NumPy operations on the arrays instead of reading the files again, e.g.
+
+    corpus = CompositionCorpus.from_files("Perovskite composition files")
+    found = corpus.query(contains={"b": "Sn"}, coefficients={("x", "Br"): (0.3, None)}, band_gap=(1.6, 1.8))
+    corpus.long_forms(found)
+
+Large corpora can be written once to a memory-mapped store (see composition_store.py) and opened with
+CompositionCorpus.from_store, which does not read the compositions again.
+
+The filters can also be combined by hand, as they are boolean arrays with one value per composition:
+
+    found = corpus.select(corpus.contains("Sn", site="b") & (corpus.coefficient("Br", site="x") > 0.3))
+"""
+import glob
+import json
+import os
+
+import numpy as np
+
+try:
+    import composition_arrays
+    import composition_store
+    import json_lines
+except:
+    from Utilities import composition_arrays
+    from Utilities import composition_store
+    from Utilities import json_lines
+
+
+def iter_files(paths):
+    """Json and JSON Lines files from a folder, a glob pattern, a file, or a list of these.
+    In folders, only the files written for compositions are used: .archive.json files, and JSON Lines files (.jsonl, .jsonl.gz)"""
+    if isinstance(paths, (str, os.PathLike)):
+        paths = [paths]
+    for path in paths:
+        path = os.fspath(path)
+        if os.path.isdir(path):
+            for root, folders, files in os.walk(path):
+                folders.sort()
+                for file_name in sorted(files):
+                    if file_name.endswith((".archive.json", ".jsonl", ".jsonl.gz")):
+                        yield os.path.join(root, file_name)
+        elif os.path.isfile(path):
+            yield path
+        else:
+            yield from sorted(glob.glob(path, recursive=True))
+
+def is_composition(document):
+    "True for a document ({'data': {...}} or the data dictionary) with ions, additives, or impurities"
+    if not isinstance(document, dict):
+        return False
+    data = document.get("data", document)
+    if not isinstance(data, dict):
+        return False
+    return any(key in data for key in composition_arrays.SITE_KEYS.values())
+
+def iter_documents(paths, skipped=None):
+    """The documents in Json and JSON Lines files, as (source, document).
+    Documents that are not compositions (see is_composition) are left out, and their sources added to the list skipped"""
+    for source, document in _iter_all_documents(paths):
+        if is_composition(document):
+            yield source, document
+        elif skipped is not None:
+            skipped.append(source)
+
+def _iter_all_documents(paths):
+    for path in iter_files(paths):
+        if path.endswith((".jsonl", ".jsonl.gz")):
+            for line, document in enumerate(json_lines.read_json_lines(path)):
+                yield f"{path}:{line + 1}", document
+        else:
+            with open(path, "r") as infile:
+                yield path, json.load(infile)
+
+
+class CompositionCorpus:
+    """Compositions with columnar arrays and filters for queries.
+
+    Every filter returns a NumPy array with one value per composition. Filters on numbers are False where the
+    value is not known (nan). The coefficient of an ion that is not in a composition is 0.
+    """
+    def __init__(self, arrays, sources=None, skipped=None):
+        self.arrays = arrays
+        self.sources = list(sources) if sources is not None else [None] * len(arrays)
+        # Sources of documents that were not read because they are not compositions
+        self.skipped = [] if skipped is None else skipped
+
+    def __len__(self):
+        return len(self.arrays)
+
+    @classmethod
+    def from_documents(cls, documents, sources=None):
+        "Corpus from Json documents ({'data': {...}})"
+        return cls(composition_arrays.CompositionArrays.from_documents(documents), sources=sources)
+
+    @classmethod
+    def from_files(cls, paths):
+        """Corpus from Json and JSON Lines files in a folder, a glob pattern, a file, or a list of these.
+        Documents that are not compositions are listed in the attribute skipped"""
+        sources = []
+        skipped = []
+        def documents():
+            for source, document in iter_documents(paths, skipped=skipped):
+                sources.append(source)
+                yield document
+        arrays = composition_arrays.CompositionArrays.from_documents(documents())
+        return cls(arrays, sources=sources, skipped=skipped)
+
+    @classmethod
+    def from_store(cls, path):
+        "Corpus on the memory-mapped arrays of a store written by composition_store.write_store"
+        store = composition_store.CompositionStore(path)
+        return cls(store.arrays, sources=[f"{store.path}:{i}" for i in range(len(store))])
+
+    # Filters
+
+    def _sites(self, site):
+        if site is None:
+            return composition_arrays.ION_SITES
+        if site not in composition_arrays.SITES:
+            raise ValueError(f"Unknown site '{site}'. Options are: {', '.join(composition_arrays.SITES)}")
+        return (site,)
+
+    def contains(self, ion, site=None):
+        "True for the compositions with the ion in the site. site=None means any of the A, B, and X sites"
+        code = self.arrays.ions.code(ion)
+        found = np.zeros(len(self), dtype=bool)
+        if code < 0:
+            return found
+        for site in self._sites(site):
+            found |= self.arrays.sites[site].contains(code)
+        return found
+
+    def coefficient(self, ion, site=None):
+        "The coefficient of the ion in every composition, summed over the A, B, and X sites if site is None"
+        code = self.arrays.ions.code(ion)
+        values = np.zeros(len(self))
+        if code < 0:
+            return values
+        for site in self._sites(site):
+            values += self.arrays.sites[site].coefficient(code)
+        return values
+
+    def mass_fraction(self, additive, site="additives"):
+        "The mass fraction of an additive (or impurity with site='impurities') in every composition"
+        return self.coefficient(additive, site=site)
+
+    def concentration(self, additive, site="additives"):
+        "The concentration of an additive (or impurity with site='impurities') in every composition"
+        code = self.arrays.ions.code(additive)
+        if code < 0:
+            return np.zeros(len(self))
+        arrays = self.arrays.sites[site]
+        return arrays.coefficient(code, values=arrays.concentrations)
+
+    @staticmethod
+    def between(values, low=None, high=None):
+        "True where low <= values <= high. None means no limit. False for nan"
+        found = ~np.isnan(values)
+        if low is not None:
+            found &= values >= low
+        if high is not None:
+            found &= values <= high
+        return found
+
+    def band_gap_between(self, low=None, high=None):
+        return self.between(self.arrays.band_gap, low, high)
+
+    def equals(self, column, values):
+        "True for the compositions where a string value (e.g. dimensionality) is one of the values"
+        if isinstance(values, str):
+            values = [values]
+        table = self.arrays.strings[column]
+        codes = [table.code(value) for value in values]
+        return np.isin(self.arrays.columns[column], [code for code in codes if code >= 0])
+
+    # Queries
+
+    def query(self, contains=(), excludes=(), coefficients=None, band_gap=None,
+              dimensionality=None, sample_type=None, composition_estimate=None):
+        """Positions of the compositions that match all the given filters.
+
+        contains / excludes: ions that must / must not be in the composition, as a list of ions (any site),
+                             or as a dictionary from the site to an ion or a list of ions, e.g. {"b": "Sn"}
+        coefficients: dictionary from an ion, or (site, ion), to (low, high), e.g. {("x", "Br"): (0.3, None)}
+        band_gap: (low, high)
+        dimensionality, sample_type, composition_estimate: a value or a list of values
+        """
+        found = np.ones(len(self), dtype=bool)
+        for site, ion in _ions_by_site(contains):
+            found &= self.contains(ion, site=site)
+        for site, ion in _ions_by_site(excludes):
+            found &= ~self.contains(ion, site=site)
+        for ion, (low, high) in (coefficients or {}).items():
+            site, ion = ion if isinstance(ion, tuple) else (None, ion)
+            found &= self.between(self.coefficient(ion, site=site), low, high)
+        if band_gap is not None:
+            found &= self.band_gap_between(*band_gap)
+        for column, values in (("dimensionality", dimensionality), ("sample_type", sample_type),
+                               ("composition_estimate", composition_estimate)):
+            if values is not None:
+                found &= self.equals(column, values)
+        return self.select(found)
+
+    def select(self, found):
+        "Positions of the compositions where a filter is True"
+        return np.flatnonzero(found)
+
+    def long_forms(self, positions=None):
+        "The long forms of the compositions at the positions (all if None)"
+        long_forms = self.arrays.string_values("long_form")
+        if positions is None:
+            return long_forms
+        return [long_forms[i] for i in positions]
+
+    def sources_of(self, positions):
+        "The files (file:line for JSON Lines files) of the compositions at the positions"
+        return [self.sources[i] for i in positions]
+
+
+def _ions_by_site(ions):
+    "(site, ion) for ions given as a list or as a dictionary from site to ions"
+    if isinstance(ions, str):
+        ions = [ions]
+    if isinstance(ions, dict):
+        for site, site_ions in ions.items():
+            for ion in [site_ions] if isinstance(site_ions, str) else site_ions:
+                yield site, ion
+    else:
+        for ion in ions:
+            yield None, ion
@@ -0,0 +1,227 @@
+"""
+Canonical keys for perovskite compositions, and deduplication of large data sets
+
+The same composition can be written in many ways: the ions in another order, 0,5 or 0.5 or 0.50,
+1 or no coefficient, with or without parentheses around the ions, etc.
+The canonical key is a string that is the same for all these spellings. It is built from
+the ions and coefficients of the A, B, and X sites and from the additives and impurities, with
+
+- ions as strings without surrounding blank spaces and enclosing parentheses
+- coefficients as numbers with 12 significant digits, where a missing coefficient is 1 and
+  coefficients that are not numbers (e.g. x) are nan
+- the ions in every site, and the additives and impurities, sorted
+
+The key does not include the band gap, dimensionality, sample type, or composition estimate.
+The hash of the key (blake2b with 64 or 128 bits) can be used as a compact key.
+
+DedupIndex groups compositions by their hash in one pass over the data. It keeps one hash per group
+and one group id per composition, so the memory does not depend on the size of the compositions.
+"""
+import hashlib
+import json
+import math
+from array import array
+from collections.abc import Mapping
+
+# The lists that make up a composition, as named in the arguments to PerovskiteToJson
+SITE_ARGUMENTS = (
+    ("a_ions_abbreviations", "a_coefficients"),
+    ("b_ions_abbreviations", "b_coefficients"),
+    ("x_ions_abbreviations", "x_coefficients"),
+    )
+ADDITIVE_ARGUMENTS = (
+    ("additives_abbreviations", "additives_concentrations", "additives_mass_fractions", "additives"),
+    ("impurities_abbreviations", "impurities_concentrations", "impurities_mass_fractions", "impurities"),
+    )
+
+# Attributes of PerovskiteToJson objects with the given arguments, where the name differs from the argument
+_ATTRIBUTES = {"additives": "additives_given", "impurities": "impurities_given"}
+
+
+def normalise_number(value, default="nan"):
+    "A number as a string with 12 significant digits, e.g. 0.5, 1, 1e+13. Empty values give default, and other values nan"
+    if value is None:
+        return default
+    if isinstance(value, str):
+        value = value.strip().replace(",", ".")
+        if value == "":
+            return default
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return "nan"
+    if math.isnan(number):
+        return "nan"
+    if number == 0:
+        number = 0.0
+    return "%.12g" % number
+
+def normalise_ion(ion):
+    "An ion without surrounding blank spaces and enclosing parentheses, as in PerovskiteToJson.clean_ions"
+    ion = str(ion).strip()
+    if len(ion) > 1 and ion[0] == "(" and ion[-1] == ")":
+        ion = ion[1:-1]
+    return ion
+
+
+class CompositionKey:
+    """Canonical keys and hashes of compositions.
+
+    A composition is a PerovskiteToJson object, or a record (dictionary) with the arguments to PerovskiteToJson.
+    The arguments are read as by BatchConverter (see batch_perovskite_to_json.get_list_arguments): column_mapping
+    maps argument names to other names in the records, and list arguments can be given as strings separated by
+    separator, e.g. "Cs; FA; MA".
+    """
+    def __init__(self, column_mapping=None, separator=";", bits=64):
+        if bits not in (64, 128):
+            raise ValueError("bits must be 64 or 128")
+        self.column_mapping = {} if column_mapping is None else dict(column_mapping)
+        self.separator = separator
+        self.bits = bits
+
+    def arguments(self, composition):
+        """The list arguments to PerovskiteToJson of a composition, read as by BatchConverter,
+        with empty abbreviations dropped together with their coefficients, concentrations, and mass fractions"""
+        # Imported here, as batch_perovskite_to_json imports the Utilities
+        import batch_perovskite_to_json as batch
+        if isinstance(composition, Mapping):
+            return batch.get_list_arguments(composition, self.column_mapping, self.separator)
+        arguments = {name: batch.to_list(getattr(composition, _ATTRIBUTES.get(name, name), None), self.separator)
+                     for name in batch.LIST_ARGUMENTS}
+        return batch.drop_empty_abbreviations(arguments)
+
+    def sites(self, composition):
+        "The normalised sites as tuples of (ion, coefficient), sorted"
+        return self._sites(self.arguments(composition))
+
+    def additives(self, composition):
+        "The normalised additives and impurities as tuples of (abbreviation, concentration, mass fraction), sorted"
+        return self._additives(self.arguments(composition))
+
+    def _sites(self, arguments):
+        sites = []
+        for ions_name, coefficients_name in SITE_ARGUMENTS:
+            ions = [normalise_ion(ion) for ion in arguments[ions_name]]
+            coefficients = arguments[coefficients_name]
+            # Coefficients missing at the end of the list are unknown, as in PerovskiteToJson.sort_ions
+            site = [(ion, normalise_number(coefficients[i], default="1") if i < len(coefficients) else "nan")
+                    for i, ion in enumerate(ions)]
+            sites.append(tuple(sorted(site)))
+        return tuple(sites)
+
+    def _additives(self, arguments):
+        groups = []
+        for abbreviations_name, concentrations_name, mass_fractions_name, given_name in ADDITIVE_ARGUMENTS:
+            abbreviations = [normalise_ion(abbreviation) for abbreviation in arguments[abbreviations_name]]
+            concentrations = arguments[concentrations_name]
+            mass_fractions = arguments[mass_fractions_name]
+            group = []
+            for i, abbreviation in enumerate(abbreviations):
+                concentration = normalise_number(concentrations[i]) if i < len(concentrations) else "nan"
+                mass_fraction = normalise_number(mass_fractions[i]) if i < len(mass_fractions) else "nan"
+                group.append((abbreviation, concentration, mass_fraction))
+
+            # Additives given as already formatted dictionaries are compared as they are
+            for given in arguments[given_name]:
+                group.append((json.dumps(given, sort_keys=True, default=str),))
+            groups.append(tuple(sorted(group)))
+        return tuple(groups)
+
+    def key(self, composition):
+        "The canonical key of a composition, as a string"
+        arguments = self.arguments(composition)
+        return json.dumps([self._sites(arguments), self._additives(arguments)], separators=(",", ":"))
+
+    def digest(self, composition):
+        "Hash of the canonical key as bytes (8 or 16 bytes depending on bits)"
+        return hashlib.blake2b(self.key(composition).encode("utf-8"), digest_size=self.bits // 8).digest()
+
+    def hash(self, composition):
+        "Hash of the canonical key as an integer with 64 or 128 bits"
+        return int.from_bytes(self.digest(composition), "big")
+
+
+_default_key = CompositionKey()
+
+def canonical_key(composition):
+    "The canonical key of a composition (PerovskiteToJson object or record with the arguments to PerovskiteToJson)"
+    return _default_key.key(composition)
+
+def composition_hash(composition, bits=64):
+    "Hash of the canonical key of a composition, as an integer with 64 or 128 bits"
+    if bits == 64:
+        return _default_key.hash(composition)
+    return CompositionKey(bits=bits).hash(composition)
+
+
+class DedupIndex:
+    """Group compositions with the same canonical key in one pass over the data.
+
+    Every added composition gets a group id, starting from 0 in the order the groups are first seen.
+    The index keeps a dictionary from the hash to the group id, and arrays with the group id of every
+    composition and the position of the first composition in every group. With 64 bits, two different
+    compositions get the same hash with a probability of about n**2 / 2**65 for n groups; use bits=128
+    if that is too high for the size of the data.
+    """
+    def __init__(self, column_mapping=None, separator=";", bits=64):
+        self.composition_key = CompositionKey(column_mapping=column_mapping, separator=separator, bits=bits)
+        self.groups = {}
+        # Group id of every added composition, and position of the first composition in every group
+        self.group_ids = array("q")
+        self.first = array("q")
+        self.sizes = array("q")
+
+    def __len__(self):
+        "Number of added compositions"
+        return len(self.group_ids)
+
+    @property
+    def n_groups(self):
+        return len(self.first)
+
+    def add(self, composition):
+        "Add a composition. Returns its group id and True if it is the first composition in the group"
+        digest = self.composition_key.digest(composition)
+        group = self.groups.get(digest)
+        is_new = group is None
+        if is_new:
+            group = len(self.first)
+            self.groups[digest] = group
+            self.first.append(len(self.group_ids))
+            self.sizes.append(0)
+        self.sizes[group] += 1
+        self.group_ids.append(group)
+        return group, is_new
+
+    def add_many(self, compositions):
+        "Add compositions from an iterable, or the rows of a DataFrame. Returns the number of compositions added"
+        n = 0
+        for composition in _iter_records(compositions):
+            self.add(composition)
+            n += 1
+        return n
+
+    def unique(self, compositions):
+        "Add compositions and yield the ones that are the first in their group"
+        for composition in _iter_records(compositions):
+            if self.add(composition)[1]:
+                yield composition
+
+    def duplicates(self):
+        "Positions of the compositions that are not the first in their group"
+        return [position for position, group in enumerate(self.group_ids) if self.first[group] != position]
+
+    def members(self, group):
+        "Positions of the compositions in a group"
+        return [position for position, member in enumerate(self.group_ids) if member == group]
+
+
+def _iter_records(compositions):
+    "Iterate over the rows of a DataFrame as dictionaries, or over an iterable of compositions, as in BatchConverter"
+    # Imported here, as batch_perovskite_to_json imports the Utilities
+    from batch_perovskite_to_json import iter_records
+    return iter_records(compositions)
+
+def deduplicate(compositions, column_mapping=None, separator=";", bits=64):
+    "Yield the compositions that are the first with their canonical key, in one pass over the data"
+    return DedupIndex(column_mapping=column_mapping, separator=separator, bits=bits).unique(compositions)
@@ -0,0 +1,389 @@
+"""
+On-disk columnar store for large numbers of perovskite compositions
+
+A store is a folder of NumPy .npy files that are opened memory-mapped (numpy.memmap through
+numpy.load(mmap_mode="r")), so opening a store is instant, and only the parts of the files that are
+used are read from disk. The layout follows composition_arrays.py:
+
+- per site (A, B, X, additives, impurities), in CSR form:
+    <site>.offsets.npy       int64, the ions of composition i are at offsets[i]:offsets[i + 1]
+    <site>.codes.npy         int32, code of the abbreviation in the string table 'ions'
+    <site>.coefficients.npy  float64, coefficient (mass fraction for additives and impurities)
+    <site>.values.npy        int32, code of the coefficient (mass fraction) as written, in the string table 'values'
+    <site>.records.npy       int32, code of the rest of the entry (names, SMILES, etc.) in the string table 'records'
+  and for additives and impurities also
+    <site>.concentrations.npy       float64
+    <site>.concentration_values.npy int32
+- per composition:
+    band_gap.npy             float64, nan where the band gap is not a number
+    layout.npy               int32, code of the keys of the composition, in order, in the string table 'layouts'
+    column.<key>.npy         int32, code of the value of a single value (long_form, band_gap, etc.)
+                             in the string table 'column.<key>', -1 if the composition does not have the key
+- string tables, as the utf-8 encoded strings after each other:
+    <table>.bytes.npy        uint8
+    <table>.offsets.npy      int64, string i is bytes[offsets[i]:offsets[i + 1]]
+- metadata.json with the version of the format, the number of compositions and the single value keys
+
+Values are stored as their Json text, so a composition read back from the store is identical to the
+one that was written, including the types of the values and the order of the keys.
+
+    write_store(BatchConverter().iter_convert(records), "corpus_store")
+    store = CompositionStore("corpus_store")
+    store.document(0)                                  # {"data": {...}}
+    corpus = CompositionCorpus.from_store("corpus_store")
+"""
+import json
+import os
+import shutil
+import tempfile
+from array import array
+from functools import cached_property
+
+import numpy as np
+
+try:
+    import composition_arrays
+except:
+    from Utilities import composition_arrays
+
+STORE_FORMAT = "perovskite-composition-store"
+STORE_VERSION = 1
+
+# Keys in the entries of the sites with numbers that are stored in float arrays
+COEFFICIENT_KEYS = {
+    "a": ("coefficient", None),
+    "b": ("coefficient", None),
+    "x": ("coefficient", None),
+    "additives": ("mass_fraction", "concentration"),
+    "impurities": ("mass_fraction", "concentration"),
+    }
+# Placeholder in the record of an entry for the number stored in the arrays
+_NUMBER = "\0number"
+# The site of the key of a site in the Json files
+_KEY_SITES = {key: site for site, key in composition_arrays.SITE_KEYS.items()}
+
+
+def _to_json(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+class MappedStringTable:
+    """String table stored as utf-8 bytes and offsets, e.g. memory-mapped from a store.
+    The strings are decoded when they are used, and the lookup from string to code is built the first time it is needed"""
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+        self._decoded = {}
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, code):
+        string = self._decoded.get(code)
+        if string is None:
+            string = bytes(self.data[self.offsets[code]:self.offsets[code + 1]]).decode("utf-8")
+            self._decoded[code] = string
+        return string
+
+    def __iter__(self):
+        for code in range(len(self)):
+            yield self[code]
+
+    def __contains__(self, string):
+        return string in self.codes
+
+    @cached_property
+    def codes(self):
+        return {string: code for code, string in enumerate(self)}
+
+    def code(self, string):
+        "The code of a string, or -1 if it is not in the table"
+        return self.codes.get(string, -1)
+
+
+def _save_strings(folder, name, strings):
+    "Save a list of strings as a string table"
+    encoded = [string.encode("utf-8") for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(item) for item in encoded], out=offsets[1:])
+    np.save(os.path.join(folder, f"{name}.offsets.npy"), offsets)
+    np.save(os.path.join(folder, f"{name}.bytes.npy"), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+
+def _save_array(folder, name, values, dtype):
+    np.save(os.path.join(folder, f"{name}.npy"), np.frombuffer(values, dtype=dtype) if len(values) else np.zeros(0, dtype=dtype))
+
+
+class _SiteWriter:
+    "Collects the entries of one site"
+    def __init__(self, site, store):
+        self.site = site
+        self.store = store
+        self.value_key, self.concentration_key = COEFFICIENT_KEYS[site]
+        self.offsets = array("q", [0])
+        self.codes = array("i")
+        self.coefficients = array("d")
+        self.values = array("i")
+        self.records = array("i")
+        self.concentrations = array("d")
+        self.concentration_values = array("i")
+
+    def _number(self, entry, key, numbers, codes):
+        if key is not None and key in entry:
+            numbers.append(composition_arrays.parse_number(entry[key]))
+            codes.append(self.store.values.add(_to_json(entry[key])))
+        else:
+            numbers.append(np.nan)
+            codes.append(-1)
+
+    def append(self, entries):
+        store = self.store
+        for entry in entries:
+            self.codes.append(store.ions.add(str(entry.get("abbreviation", ""))))
+            self._number(entry, self.value_key, self.coefficients, self.values)
+            if self.concentration_key is not None:
+                self._number(entry, self.concentration_key, self.concentrations, self.concentration_values)
+            # The rest of the entry, in order, with placeholders for the numbers
+            record = [[key, _NUMBER if key in (self.value_key, self.concentration_key) else value] for key, value in entry.items()]
+            self.records.append(store.records.add(_to_json(record)))
+        self.offsets.append(len(self.codes))
+
+    def save(self, folder):
+        site = self.site
+        _save_array(folder, f"{site}.offsets", self.offsets, np.int64)
+        _save_array(folder, f"{site}.codes", self.codes, np.int32)
+        _save_array(folder, f"{site}.coefficients", self.coefficients, np.float64)
+        _save_array(folder, f"{site}.values", self.values, np.int32)
+        _save_array(folder, f"{site}.records", self.records, np.int32)
+        if self.concentration_key is not None:
+            _save_array(folder, f"{site}.concentrations", self.concentrations, np.float64)
+            _save_array(folder, f"{site}.concentration_values", self.concentration_values, np.int32)
+
+
+class StoreWriter:
+    """Write compositions to a store, one at a time.
+    The compositions can be the dictionaries from PerovskiteToJson.to_dict or BatchConverter ({'data': {...}}),
+    their 'data' dictionaries, Json strings, or PerovskiteToJson objects.
+    The store is written to a temporary folder and moved in place when the writer is closed"""
+    def __init__(self, path, overwrite=False):
+        self.path = os.fspath(path)
+        if os.path.exists(self.path) and not overwrite:
+            raise FileExistsError(f"{self.path} already exists")
+        self.overwrite = overwrite
+        self.count = 0
+        self.ions = composition_arrays.StringTable()
+        self.values = composition_arrays.StringTable()
+        self.records = composition_arrays.StringTable()
+        self.layouts = composition_arrays.StringTable()
+        self.sites = {site: _SiteWriter(site, self) for site in composition_arrays.SITES}
+        self.band_gap = array("d")
+        self.layout = array("i")
+        # Single value columns. Compositions written before a key was first seen do not have it
+        self.columns = {}
+        self.column_tables = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, *args):
+        if error_type is None:
+            self.close()
+
+    def write(self, document):
+        "Add one composition"
+        if hasattr(document, "to_dict"):
+            document = document.to_dict()
+        elif isinstance(document, str):
+            document = json.loads(document)
+        data = document.get("data", document)
+
+        layout = []
+        present = set()
+        for key, value in data.items():
+            layout.append(key)
+            if key in _KEY_SITES:
+                continue
+            present.add(key)
+            if key not in self.columns:
+                self.columns[key] = array("i", [-1] * self.count)
+                self.column_tables[key] = composition_arrays.StringTable()
+            self.columns[key].append(self.column_tables[key].add(_to_json(value)))
+        for key, codes in self.columns.items():
+            if key not in present:
+                codes.append(-1)
+
+        for site, key in composition_arrays.SITE_KEYS.items():
+            self.sites[site].append(data.get(key, []))
+        self.band_gap.append(composition_arrays.parse_number(data.get("band_gap")))
+        self.layout.append(self.layouts.add(_to_json(layout)))
+        self.count += 1
+
+    def write_many(self, documents):
+        for document in documents:
+            self.write(document)
+        return self.count
+
+    def close(self):
+        "Save the arrays and move the store in place"
+        parent = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(parent, exist_ok=True)
+        folder = tempfile.mkdtemp(dir=parent, prefix=".store-")
+        try:
+            for writer in self.sites.values():
+                writer.save(folder)
+            _save_array(folder, "band_gap", self.band_gap, np.float64)
+            _save_array(folder, "layout", self.layout, np.int32)
+            keys = list(self.columns)
+            for i, key in enumerate(keys):
+                _save_array(folder, f"column.{i}", self.columns[key], np.int32)
+                _save_strings(folder, f"column.{i}", self.column_tables[key].strings)
+            for name in ("ions", "values", "records", "layouts"):
+                _save_strings(folder, name, getattr(self, name).strings)
+            with open(os.path.join(folder, "metadata.json"), "w") as outfile:
+                json.dump({"format": STORE_FORMAT, "version": STORE_VERSION, "count": self.count, "columns": keys}, outfile, indent=4)
+
+            if os.path.exists(self.path) and self.overwrite:
+                shutil.rmtree(self.path)
+            os.replace(folder, self.path)
+        except BaseException:
+            shutil.rmtree(folder, ignore_errors=True)
+            raise
+
+
+def write_store(documents, path, overwrite=False):
+    "Write compositions from an iterable to a store. Returns the number of compositions written"
+    with StoreWriter(path, overwrite=overwrite) as writer:
+        return writer.write_many(documents)
+
+
+class CompositionStore:
+    "A store opened memory-mapped. Arrays and string tables are opened the first time they are used"
+    def __init__(self, path):
+        self.path = os.fspath(path)
+        with open(os.path.join(self.path, "metadata.json"), "r") as infile:
+            self.metadata = json.load(infile)
+        if self.metadata.get("format") != STORE_FORMAT or self.metadata.get("version") != STORE_VERSION:
+            raise ValueError(f"{self.path} is not a composition store of version {STORE_VERSION}")
+        self.keys = self.metadata["columns"]
+        self._arrays = {}
+        self._tables = {}
+        self._records = {}
+
+    def __len__(self):
+        return self.metadata["count"]
+
+    def array(self, name):
+        "A memory-mapped array of the store, e.g. 'a.codes' or 'band_gap'"
+        values = self._arrays.get(name)
+        if values is None:
+            values = np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r")
+            self._arrays[name] = values
+        return values
+
+    def table(self, name):
+        "A string table of the store, e.g. 'ions'"
+        table = self._tables.get(name)
+        if table is None:
+            table = MappedStringTable(self.array(f"{name}.offsets"), self.array(f"{name}.bytes"))
+            self._tables[name] = table
+        return table
+
+    def column(self, key):
+        "Codes of a single value column, and its string table with the values as Json text"
+        i = self.keys.index(key)
+        return self.array(f"column.{i}"), self.table(f"column.{i}")
+
+    def site(self, site):
+        "The SiteArrays of a site, on the memory-mapped arrays"
+        concentrations = None if site in composition_arrays.ION_SITES else self.array(f"{site}.concentrations")
+        return composition_arrays.SiteArrays(self.array(f"{site}.offsets"), self.array(f"{site}.codes"),
+                                             self.array(f"{site}.coefficients"), concentrations)
+
+    @cached_property
+    def arrays(self):
+        "The store as CompositionArrays, e.g. for CompositionCorpus"
+        return MappedCompositionArrays(self)
+
+    def _record(self, code):
+        record = self._records.get(code)
+        if record is None:
+            record = json.loads(self.table("records")[code])
+            self._records[code] = record
+        return record
+
+    def _entries(self, site, i):
+        offsets = self.array(f"{site}.offsets")
+        start, end = int(offsets[i]), int(offsets[i + 1])
+        value_key, concentration_key = COEFFICIENT_KEYS[site]
+        records = self.array(f"{site}.records")[start:end]
+        values = self.array(f"{site}.values")[start:end]
+        if concentration_key is not None:
+            concentration_values = self.array(f"{site}.concentration_values")[start:end]
+        table = self.table("values")
+
+        entries = []
+        for k in range(end - start):
+            entry = {}
+            for key, value in self._record(int(records[k])):
+                if value == _NUMBER:
+                    code = values[k] if key == value_key else concentration_values[k]
+                    value = json.loads(table[int(code)])
+                entry[key] = value
+            entries.append(entry)
+        return entries
+
+    def data(self, i):
+        "The data dictionary of composition i, as written"
+        data = {}
+        for key in json.loads(self.table("layouts")[int(self.array("layout")[i])]):
+            if key in _KEY_SITES:
+                data[key] = self._entries(_KEY_SITES[key], i)
+            else:
+                codes, table = self.column(key)
+                data[key] = json.loads(table[int(codes[i])])
+        return data
+
+    def document(self, i):
+        "Composition i as {'data': {...}}, as from PerovskiteToJson.to_dict"
+        return {"data": self.data(i)}
+
+    def iter_documents(self, positions=None):
+        "The compositions at the positions (all if None) as documents"
+        for i in range(len(self)) if positions is None else positions:
+            yield self.document(int(i))
+
+
+class MappedCompositionArrays(composition_arrays.CompositionArrays):
+    """CompositionArrays on the memory-mapped arrays of a store.
+    The string columns are decoded the first time they are used"""
+    def __init__(self, store):
+        self.store = store
+        self.ions = store.table("ions")
+        self.sites = {site: store.site(site) for site in composition_arrays.SITES}
+        self.band_gap = store.array("band_gap")
+
+    def __len__(self):
+        return len(self.store)
+
+    def _string_column(self, key):
+        "Plain strings and codes of a column, with '' for compositions that do not have the key"
+        table = composition_arrays.StringTable([""])
+        if key not in self.store.keys:
+            return table, np.zeros(len(self.store), dtype=np.int32)
+        codes, json_table = self.store.column(key)
+        # Code in the plain table for every value in the Json table, and for missing values (-1) at position 0
+        mapping = np.zeros(len(json_table) + 1, dtype=np.int32)
+        for code, text in enumerate(json_table):
+            mapping[code + 1] = table.add(str(json.loads(text)))
+        return table, mapping[np.asarray(codes) + 1]
+
+    @cached_property
+    def _string_columns(self):
+        return {column: self._string_column(column) for column in composition_arrays.STRING_COLUMNS}
+
+    @property
+    def strings(self):
+        return {column: table for column, (table, codes) in self._string_columns.items()}
+
+    @property
+    def columns(self):
+        return {column: codes for column, (table, codes) in self._string_columns.items()}
@@ -4,12 +4,17 @@ lists of values to be used in drop down menus in the graphical interface
 Written by:
 T. Jesper Jacobsson 2024 06
 """
+import json
+import os
+
 import pandas as pd
 
 try:
     import filepaths
+    import reference_data
 except:
     from Utilities import filepaths
+    from Utilities import reference_data
     
 def collect_all_default_values():
     """Collects all default values defined here. 
@@ -80,9 +85,10 @@ def additive_concentration_metrics():
 
 
 def getIonAbbreviationsFromDatabase(file_path):
-    """Get the abbreviations for all ions we have data on"""
-    ion_data = pd.read_excel(file_path)
-    ions = ion_data["Abbreviation"].values
+    """Get the abbreviations for all ions we have data on. 
+    The table is read through the process-wide cache in reference_data.py, i.e. it is shared with PerovskiteToJson"""
+    ion_data = reference_data.get_table(file_path, origin=filepaths.config["origin"])
+    ions = ion_data["Abbreviation"].to_numpy()
     ions = ions.astype(str)
     ions.sort()
     return list(ions) 
@@ -110,4 +116,61 @@ def get_additives():
     path_a_ions, path_b_ions, path_x_ions, path_additives = filepaths.paths_to_data(origin=filepaths.config["origin"])
     additives_from_database = getIonAbbreviationsFromDatabase(path_additives)
     return additives_from_database
-    
\ No newline at end of file
+    
+
+# The lists of abbreviations used in the dropdown menus of the GUI
+DROPDOWN_KEYS = ("a_ions", "b_ions", "x_ions", "additives")
+
+def get_dropdown_values():
+    "All lists of abbreviations used in the dropdown menus of the GUI"
+    dropdown_values = {
+        "a_ions": get_a_ions(),
+        "b_ions": get_b_ions(),
+        "x_ions": get_x_ions(),
+        "additives": get_additives(),
+        }
+    return dropdown_values
+
+def path_to_dropdown_cache():
+    "File where the dropdown values are stored between sessions of the GUI"
+    return os.path.join(filepaths.path_to_cache_folder(), "dropdown_values.json")
+
+def load_cached_dropdown_values(origin=None):
+    """Dropdown values stored by an earlier session for the same origin of the reference data.
+    Returns None if there are no stored values, or if the file is not as written by save_cached_dropdown_values,
+    in which case the values are read in again from the reference data"""
+    origin = filepaths.config["origin"] if origin is None else origin
+    try:
+        with open(path_to_dropdown_cache(), "r") as infile:
+            cached = json.load(infile)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached, dict):
+        return None
+    dropdown_values = cached.get(origin)
+    if not isinstance(dropdown_values, dict) or set(dropdown_values) != set(DROPDOWN_KEYS):
+        return None
+    for values in dropdown_values.values():
+        if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+            return None
+    return dropdown_values
+
+def save_cached_dropdown_values(dropdown_values, origin=None):
+    "Store the dropdown values to be used at the start of the next session"
+    origin = filepaths.config["origin"] if origin is None else origin
+    path = path_to_dropdown_cache()
+    try:
+        with open(path, "r") as infile:
+            cached = json.load(infile)
+    except (OSError, ValueError):
+        cached = {}
+    cached[origin] = dropdown_values
+    
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as outfile:
+            json.dump(cached, outfile)
+        os.replace(temp_path, path)
+    except OSError:
+        pass
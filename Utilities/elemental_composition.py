@@ -0,0 +1,174 @@
+"""
+The number of atoms of every element in perovskite compositions
+
+Every ion is expanded into its elements with the column Molecular_formula of the reference tables,
+which is parsed once per table (see reference_data.get_element_counts). The element counts of a
+composition are the counts of its ions times their coefficients, summed over the A, B, and X sites,
+e.g. Cs0.05FA0.79MA0.16PbBr0.5I2.5 -> C0.95H4.91N1.74Br0.5Cs0.05I2.5Pb.
+
+For many compositions at once (CompositionArrays, see composition_arrays.py), the ions are expanded
+into their elements with NumPy and summed with one bincount, which gives a dense matrix with one row
+per composition and one column per element:
+
+    expansion = ElementalComposition(CompositionArrays.from_documents(documents))
+    matrix, elements = expansion.matrix()   # or expansion.matrix(ELEMENTS) for all elements
+    expansion.formulas()                 # Hill formulas, e.g. ['CH6I3NPb', ...]
+"""
+import numpy as np
+
+try:
+    import chemical_formula
+    import composition_arrays
+    import reference_data
+except:
+    from Utilities import chemical_formula
+    from Utilities import composition_arrays
+    from Utilities import reference_data
+
+# All elements, in the order of the columns of the full element matrix
+ELEMENTS = tuple(chemical_formula.ATOMIC_MASSES)
+_ELEMENT_COLUMNS = {element: column for column, element in enumerate(ELEMENTS)}
+
+
+def hill_order(elements):
+    "Elements in Hill order: C first and H second if there is carbon, then the rest alphabetically"
+    elements = sorted(elements)
+    if "C" not in elements:
+        return elements
+    return ["C"] + (["H"] if "H" in elements else []) + [element for element in elements if element not in ("C", "H")]
+
+def format_count(count):
+    "A number of atoms in a formula: nothing for 1, otherwise the number with 12 significant digits"
+    text = "%.12g" % count
+    return "" if text == "1" else text
+
+def hill_formula(counts):
+    "A formula in Hill order from a dictionary from the element to the number of atoms, leaving out elements with no atoms"
+    return "".join(element + format_count(counts[element]) for element in hill_order(counts) if counts[element] != 0)
+
+def get_element_counts(origin="local"):
+    "The element counts of the ions in the A-, B-, and X-ion reference tables, as a dictionary from the site to the counts"
+    tables = reference_data.get_reference_tables(origin)
+    return {site: reference_data.get_element_counts(table) for site, table in zip(composition_arrays.ION_SITES, tables)}
+
+
+class ElementalComposition:
+    """Element counts of many compositions.
+
+    arrays: CompositionArrays
+    element_counts: dictionary from the site to a dictionary from the abbreviation to a tuple of (element, number).
+                    Read from the reference data given by path_to_reference_data if None
+    A composition is complete if all its ions have known formulas and coefficients. The element counts of
+    incomplete compositions are nan, and their formulas None.
+    """
+    def __init__(self, arrays, element_counts=None, path_to_reference_data="local"):
+        self.arrays = arrays
+        self.element_counts = get_element_counts(path_to_reference_data) if element_counts is None else element_counts
+        self._vectors = {}
+
+    def __len__(self):
+        return len(self.arrays)
+
+    def vectors(self, site):
+        """The element counts of every ion code in the ion table in a site, in CSR form:
+        offsets (the elements of code i are at offsets[i]:offsets[i + 1]), element columns (see ELEMENTS), counts,
+        and a boolean array that is True for the codes with known counts"""
+        vectors = self._vectors.get(site)
+        if vectors is None:
+            counts = self.element_counts.get(site, {})
+            ions = self.arrays.ions
+            offsets = np.zeros(len(ions) + 1, dtype=np.int64)
+            columns = []
+            numbers = []
+            known = np.zeros(len(ions), dtype=bool)
+            for code in range(len(ions)):
+                ion = counts.get(ions[code])
+                if ion is not None:
+                    known[code] = True
+                    for element, number in ion:
+                        columns.append(_ELEMENT_COLUMNS[element])
+                        numbers.append(number)
+                offsets[code + 1] = len(columns)
+            vectors = (offsets, np.array(columns, dtype=np.int64), np.array(numbers, dtype=np.float64), known)
+            self._vectors[site] = vectors
+        return vectors
+
+    def complete(self):
+        "True for the compositions where all ions have known formulas and coefficients"
+        incomplete = np.zeros(len(self), dtype=bool)
+        for site in composition_arrays.ION_SITES:
+            site_arrays = self.arrays.sites[site]
+            known = self.vectors(site)[3][site_arrays.codes] & ~np.isnan(site_arrays.coefficients)
+            incomplete[site_arrays.rows[~known]] = True
+        return ~incomplete
+
+    def expand(self, site):
+        """Every ion in a site expanded into its elements: the composition, the element column (see ELEMENTS),
+        and the number of atoms times the coefficient, with one value per element of every ion"""
+        site_arrays = self.arrays.sites[site]
+        offsets, columns, numbers, known = self.vectors(site)
+        codes = np.asarray(site_arrays.codes)
+        # Every ion in the site repeated once per element in the ion
+        sizes = offsets[codes + 1] - offsets[codes]
+        ion = np.repeat(np.arange(len(codes)), sizes)
+        position = offsets[codes][ion] + (np.arange(len(ion)) - np.repeat(np.cumsum(sizes) - sizes, sizes))
+        return site_arrays.rows[ion], columns[position], numbers[position] * site_arrays.coefficients[ion]
+
+    def matrix(self, elements=None):
+        """Dense (n, number of elements) array with the number of atoms of the elements in every composition, and
+        the elements of the columns. If elements is None, the elements found in the compositions, in Hill order.
+        Use elements=ELEMENTS for the same columns for all batches"""
+        expanded = [self.expand(site) for site in composition_arrays.ION_SITES]
+        if elements is None:
+            found = np.unique(np.concatenate([columns for rows, columns, weights in expanded]))
+            elements = hill_order([ELEMENTS[column] for column in found])
+        elements = list(elements)
+
+        # Column in the matrix of every element, -1 for elements that are not in the matrix
+        output = np.full(len(ELEMENTS), -1, dtype=np.int64)
+        output[[_ELEMENT_COLUMNS[element] for element in elements]] = np.arange(len(elements))
+        n_columns = len(elements)
+        total = np.zeros(len(self) * n_columns)
+        for rows, columns, weights in expanded:
+            columns = output[columns]
+            selected = columns >= 0
+            total += np.bincount(rows[selected] * n_columns + columns[selected], weights=weights[selected],
+                                 minlength=len(total))
+        matrix = total.reshape(len(self), n_columns)
+        matrix[~self.complete()] = np.nan
+        return matrix, elements
+
+    def formulas(self):
+        "The Hill formula of every composition. None for incomplete compositions"
+        matrix, elements = self.matrix()
+        formulas = []
+        for row in matrix:
+            if np.isnan(row).any():
+                formulas.append(None)
+                continue
+            # Every formula in its own Hill order, which depends on whether the composition has carbon
+            formulas.append(hill_formula({element: count for element, count in zip(elements, row.tolist()) if count != 0}))
+        return formulas
+
+
+def elemental_formula(document, path_to_reference_data="local"):
+    "The Hill formula of one composition ({'data': {...}}), e.g. from PerovskiteToJson.to_dict. None if it is incomplete"
+    arrays = composition_arrays.CompositionArrays.from_documents([document])
+    return ElementalComposition(arrays, path_to_reference_data=path_to_reference_data).formulas()[0]
+
+
+# Basic check
+if __name__ == "__main__":
+    # Carbon free and carbon containing compositions in the same batch
+    documents = [
+        {"data": {"ions_a_site": [{"abbreviation": "NH4", "coefficient": "1"}],
+                  "ions_b_site": [{"abbreviation": "Pb", "coefficient": "1"}],
+                  "ions_x_site": [{"abbreviation": "Br", "coefficient": "3"}]}},
+        {"data": {"ions_a_site": [{"abbreviation": "MA", "coefficient": "1"}],
+                  "ions_b_site": [{"abbreviation": "Pb", "coefficient": "1"}],
+                  "ions_x_site": [{"abbreviation": "I", "coefficient": "3"}]}},
+        ]
+    formulas = ElementalComposition(composition_arrays.CompositionArrays.from_documents(documents)).formulas()
+    print(formulas)
+    assert formulas == ["Br3H4NPb", "CH6I3NPb"]
+    assert formulas == [elemental_formula(document) for document in documents]
@@ -11,32 +11,63 @@ config is a dictionary that could be read in to simplify where to get the data
 The key-word origin has two values in the initial release
 local: which means that data for ions are fetch from data files supplied with hte original release
 online: which means that updated datafiles are fetch online
+
+The remaining key-words are settings for the online data (see online_data.py)
+online_url: the folder online where the data files are found
+cache_folder: local folder where downloaded data files are cached. None gives a folder in the user's home directory
+cache_ttl: time in seconds before a cached data file is checked against the online version again
+timeout: time in seconds to wait for the online server before falling back on cached or local data
 """
-config = {"origin": "local"}
-# config = {"origin": "online"}
+config = {
+    "origin": "local",
+    # "origin": "online",
+    "online_url": "https://github.com/FAIRmat-NFDI/nomad-perovskite-solar-cells-database/raw/main/src/perovskite_solar_cell_database/schema_sections/ions/",
+    "cache_folder": None,
+    "cache_ttl": 24 * 3600,
+    "timeout": 10,
+    }
+
+# Names of the data files for A-ions, B-ions, X-ions, and additives and impurities
+local_file_names = ("A-ion_data.xlsx", "B-ion_data.xlsx", "X-ion_data.xlsx", "additives_and_impurities.xlsx")
+online_file_names = ("A-ion_data.xlsx", "B-ion_data.xlsx", "C-ion_data.xlsx", "additives_and_impurities.xlsx")
 
 
 def paths_to_data(origin="local"):
     "file paths to resources. Options are: 'local' and 'online'"
-    
-    # Locally stored files (not updated after release) 
+
+    # Locally stored files (not updated after release)
     if origin == "local":
         # path to locally stored data files
         path_data_ion_folder = os.path.join(os.getcwd(), "Data_ions")
-        path_a_ions = os.path.join(path_data_ion_folder, "A-ion_data.xlsx")
-        path_b_ions = os.path.join(path_data_ion_folder, "B-ion_data.xlsx")
-        path_x_ions = os.path.join(path_data_ion_folder, "X-ion_data.xlsx")
-        path_additives_and_impurities = os.path.join(path_data_ion_folder, "additives_and_impurities.xlsx")
-        
+        path_a_ions = os.path.join(path_data_ion_folder, local_file_names[0])
+        path_b_ions = os.path.join(path_data_ion_folder, local_file_names[1])
+        path_x_ions = os.path.join(path_data_ion_folder, local_file_names[2])
+        path_additives_and_impurities = os.path.join(path_data_ion_folder, local_file_names[3])
+
         return path_a_ions, path_b_ions, path_x_ions, path_additives_and_impurities
-    
-    
-    # Updated data stored in a Github repository
+
+
+    # Updated data stored in a Github repository.
+    # The files are downloaded to a local cache, and the paths to the cached files are returned
     if origin == "online":
-        path_a_ions = "https://github.com/FAIRmat-NFDI/nomad-perovskite-solar-cells-database/raw/main/src/perovskite_solar_cell_database/schema_sections/ions/A-ion_data.xlsx"
-        path_b_ions = "https://github.com/FAIRmat-NFDI/nomad-perovskite-solar-cells-database/raw/main/src/perovskite_solar_cell_database/schema_sections/ions/B-ion_data.xlsx"
-        path_x_ions = "https://github.com/FAIRmat-NFDI/nomad-perovskite-solar-cells-database/raw/main/src/perovskite_solar_cell_database/schema_sections/ions/C-ion_data.xlsx"
-    
-        return path_a_ions, path_b_ions, path_x_ions
-        
-    
\ No newline at end of file
+        try:
+            import online_data
+        except:
+            from Utilities import online_data
+
+        return online_data.paths_to_data()
+
+def urls_to_data():
+    "urls to the online resources for A-ions, B-ions, X-ions, and additives and impurities"
+    return tuple(config["online_url"] + file_name for file_name in online_file_names)
+
+def path_to_cache_folder():
+    "folder where data downloaded from online resources is cached"
+    if config["cache_folder"] is not None:
+        return config["cache_folder"]
+    cache_home = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(cache_home, "perovskite_composition")
+
+def path_to_snapshot(path_data_folder):
+    "file path to the compiled snapshot of the reference tables in a data folder. See reference_snapshot.py"
+    return os.path.join(path_data_folder, "reference_data_snapshot.pkl")
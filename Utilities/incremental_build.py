@@ -0,0 +1,184 @@
+"""
+Incremental conversion of many perovskite compositions to a folder of .json files
+
+A manifest in the output folder maps every output file to a hash of its input (the arguments to
+PerovskiteToJson for the row) and stores the version of the reference data (see reference_data.data_version)
+and the formatting of the files. When the conversion is run again:
+
+- rows with the same input hash as in the manifest are skipped
+- new and changed rows are converted and their files written
+- files in the manifest whose rows are no longer in the input are removed
+- everything is converted again if the reference data or the formatting has changed
+
+The rows are only hashed, not converted, so the time of a run depends mainly on the number of changed rows.
+Files in the folder that are not in the manifest are never touched.
+
+The name of the file of a row is taken from a column with a unique key for every row (key="ID"), or, without a key,
+from the input hash, in which case a changed row gets a new file and the old file is removed:
+
+    builder = IncrementalBuilder("Perovskite composition files", key="ID")
+    report = builder.build(pd.read_excel("compositions.xlsx"))   # {"converted": 12, "unchanged": 48810, "removed": 1, ...}
+"""
+import hashlib
+import json
+import os
+import re
+from collections import deque
+
+try:
+    import reference_data
+    import serializers
+except:
+    from Utilities import reference_data
+    from Utilities import serializers
+
+# Increase when the way the files are made changes, which forces a full rebuild of old folders
+MANIFEST_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+# Characters in keys that are kept in file names
+_UNSAFE = re.compile(r"[^A-Za-z0-9()._+-]")
+
+
+def input_hash(arguments):
+    "Hash of the arguments to PerovskiteToJson for a row, as a hex string"
+    text = json.dumps(arguments, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+def _write_atomically(path, write):
+    "Write a text file through a temporary file, so that the file is never left half written"
+    temp_path = path + ".partial"
+    try:
+        with open(temp_path, "w") as outfile:
+            write(outfile)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class IncrementalBuilder:
+    """Convert rows to .json files in a folder, converting only new and changed rows.
+
+    folder: the output folder, with the manifest
+    converter: BatchConverter that reads the rows (column mapping, separator, reference data). Default BatchConverter()
+    parallel: optional ParallelConverter (with the same settings as converter) that converts the changed rows
+    key: column with a unique key of every row, used for the file names. None to name the files by their input hash.
+         A key that gives the name of the manifest is an error
+    serializer: Serializer for the files, see Utilities/serializers.py
+    checkpoint: the manifest is saved after every checkpoint written files, so that an interrupted run can be continued
+    """
+    def __init__(self, folder, converter=None, parallel=None, key=None, serializer=None, checkpoint=1000):
+        if converter is None:
+            # Imported here, as batch_perovskite_to_json imports the Utilities
+            from batch_perovskite_to_json import BatchConverter
+            converter = BatchConverter()
+        self.folder = os.fspath(folder)
+        self.converter = converter
+        self.parallel = parallel
+        self.key = key
+        self.serializer = serializers.get_serializer(serializer)
+        self.checkpoint = checkpoint
+        self.manifest_path = os.path.join(self.folder, MANIFEST_NAME)
+
+    def settings(self):
+        "What the files depend on, except for the input of the rows"
+        return {
+            "version": MANIFEST_VERSION,
+            "reference_data": reference_data.data_version(self.converter.path_to_reference_data),
+            "serializer": repr(self.serializer),
+            }
+
+    def load_manifest(self):
+        "The manifest of the folder. Empty if there is none"
+        try:
+            with open(self.manifest_path, "r") as infile:
+                manifest = json.load(infile)
+        except (OSError, ValueError):
+            return {"settings": None, "files": {}}
+        if not isinstance(manifest, dict) or not isinstance(manifest.get("files"), dict):
+            return {"settings": None, "files": {}}
+        return manifest
+
+    def save_manifest(self, settings, files):
+        manifest = {"settings": settings, "files": dict(sorted(files.items()))}
+        _write_atomically(self.manifest_path, lambda outfile: json.dump(manifest, outfile, indent=1))
+
+    def file_name(self, record, hash_value):
+        "File name of the output of a row"
+        if self.key is None:
+            return f"composition_{hash_value}.json"
+        value = record.get(self.key)
+        if value is None or str(value).strip() == "":
+            raise ValueError(f"Row without a value in the key column '{self.key}'")
+        name = _UNSAFE.sub("_", str(value).strip()) + ".json"
+        if name == MANIFEST_NAME:
+            raise ValueError(f"The key '{value}' gives the file name of the manifest, {MANIFEST_NAME}")
+        return name
+
+    def plan(self, records, manifest_files, files):
+        """Hash every row and compare with the manifest, one row at a time.
+        Adds the input hash of every file to files, and yields the rows that need to be converted as (file name, record)"""
+        for record in records:
+            hash_value = input_hash(self.converter.get_arguments(record))
+            name = self.file_name(record, hash_value)
+            if name in files:
+                if self.key is None:
+                    # The same input twice gives the same file
+                    continue
+                raise ValueError(f"The key '{name[:-5]}' is used by more than one row")
+            files[name] = hash_value
+            if manifest_files.get(name) != hash_value or not os.path.isfile(os.path.join(self.folder, name)):
+                yield name, record
+
+    def build(self, records):
+        """Convert the new and changed rows (DataFrame or iterable of dictionaries) and remove the files of removed rows.
+        The rows are converted as they are read, so only the names and hashes of the rows are kept in memory.
+        Returns the number of converted, unchanged, and removed files, and whether it was a full rebuild"""
+        # Imported here, as batch_perovskite_to_json imports the Utilities
+        from batch_perovskite_to_json import iter_records
+
+        os.makedirs(self.folder, exist_ok=True)
+        settings = self.settings()
+        manifest = self.load_manifest()
+        full_rebuild = manifest.get("settings") != settings
+        old_files = manifest["files"]
+
+        # The manifest during the run: the old files, with an empty hash for all of them in a full rebuild,
+        # and the files written so far. Changed rows have another hash than in the manifest until they are written
+        current = {name: "" if full_rebuild else hash_value for name, hash_value in old_files.items()}
+        files = {}
+        # Names of the rows passed on to the converter, in the order their documents come back
+        names = deque()
+        def stale_records():
+            for name, record in self.plan(iter_records(records), {} if full_rebuild else old_files, files):
+                names.append(name)
+                yield record
+
+        converter = self.converter if self.parallel is None else self.parallel
+        written = 0
+        for document in converter.iter_convert(stale_records()):
+            name = names.popleft()
+            _write_atomically(os.path.join(self.folder, name), lambda outfile: self.serializer.dump(document, outfile))
+            current[name] = files[name]
+            written += 1
+            if self.checkpoint and written % self.checkpoint == 0:
+                self.save_manifest(settings, current)
+
+        # Remove the files of rows that are gone. Only files made by the builder are removed
+        removed = 0
+        for name in old_files:
+            if name not in files:
+                path = os.path.join(self.folder, name)
+                if os.path.isfile(path):
+                    os.remove(path)
+                removed += 1
+
+        self.save_manifest(settings, files)
+        return {
+            "converted": written,
+            "unchanged": len(files) - written,
+            "removed": removed,
+            "total": len(files),
+            "full_rebuild": full_rebuild,
+            }
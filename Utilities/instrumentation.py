@@ -0,0 +1,90 @@
+"""
+Timing of the stages in the conversion of perovskite compositions to .Json
+
+A StageTimer is given to PerovskiteToJson or BatchConverter (timer=StageTimer()) and sums the
+wall time and number of calls of every stage over all objects that use it. The stages are
+
+clean_input: cleaning of the ions, coefficients, additives and impurities given as input
+sort: sorting of the ions, additives and impurities
+formulas: the long and short formula
+format_values: the single values (dimensionality, sample type, composition estimate, band gap)
+reference_data: getting the reference tables
+format_ions: complementing the ions with reference data
+format_additives: complementing the additives and impurities with reference data
+convert_to_json: serializing the data to a Json string
+save_data: writing the Json file, including the serialization if the Json string was not made before
+
+Stages that are evaluated lazily, e.g. format_ions, are timed when they are first used.
+Without a timer, the stages are entered through a shared context that does nothing.
+"""
+import contextlib
+import time
+
+# Context used for the stages when there is no timer
+NULL_STAGE = contextlib.nullcontext()
+
+
+class _Stage:
+    "Context that adds the time spent inside it to a stage of a StageTimer"
+    __slots__ = ("timer", "name", "start")
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.timer.record(self.name, time.perf_counter() - self.start)
+
+
+class StageTimer:
+    """Total wall time and number of calls per stage.
+
+    callback is an optional function called as callback(stage, seconds) every time a stage is done,
+    e.g. for logging or for sending the timings to a profiler
+    """
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.totals = {}
+        self.counts = {}
+
+    def stage(self, name):
+        "Context for timing one call of a stage"
+        return _Stage(self, name)
+
+    def record(self, name, seconds, count=1):
+        "Add the time of a stage"
+        self.totals[name] = self.totals.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + count
+        if self.callback is not None:
+            self.callback(name, seconds)
+
+    def merge(self, timings):
+        "Add timings from another StageTimer, or from the dictionary given by as_dict, e.g. from another process"
+        if isinstance(timings, StageTimer):
+            timings = timings.as_dict()
+        for name, stage in timings.items():
+            self.totals[name] = self.totals.get(name, 0.0) + stage["total"]
+            self.counts[name] = self.counts.get(name, 0) + stage["count"]
+
+    def reset(self):
+        "Remove all timings"
+        self.totals = {}
+        self.counts = {}
+
+    def as_dict(self):
+        "The timings as {stage: {'total': seconds, 'count': calls, 'mean': seconds per call}}"
+        return {name: {"total": total,
+                       "count": self.counts[name],
+                       "mean": total / self.counts[name] if self.counts[name] else 0.0}
+                for name, total in self.totals.items()}
+
+    def report(self):
+        "The timings as a table, with the slowest stage first"
+        lines = [f"{'stage':<20} {'total (s)':>12} {'calls':>10} {'mean (us)':>12}"]
+        for name, stage in sorted(self.as_dict().items(), key=lambda item: -item[1]["total"]):
+            lines.append(f"{name:<20} {stage['total']:>12.4f} {stage['count']:>10} {1e6 * stage['mean']:>12.2f}")
+        return "\n".join(lines)
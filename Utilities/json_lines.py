@@ -0,0 +1,105 @@
+"""
+Streaming of perovskite compositions to and from JSON Lines files
+
+In a JSON Lines file (.jsonl) every line is one compact Json document, here one
+perovskite composition with the same structure as the files written by PerovskiteToJson,
+i.e. {"data": {...}}. Files ending with .gz are gzip compressed.
+
+JsonLinesWriter writes the documents through a buffer of bounded size, so bulk runs
+only keep the current record and the buffer in memory, and read_json_lines reads the
+documents back one at a time. The lines are written with a compact Serializer (see serializers.py),
+by default with the standard library, or with e.g. serializer="orjson".
+"""
+import gzip
+import json
+
+try:
+    import serializers
+except:
+    from Utilities import serializers
+
+
+def _is_compressed(file_path, compress):
+    "Use gzip compression if asked for, or if the file name ends with .gz"
+    if compress is None:
+        return str(file_path).endswith(".gz")
+    return compress
+
+def _open(file_path, mode, compress):
+    "Open a plain or gzip compressed file in binary mode"
+    if compress:
+        return gzip.open(file_path, mode)
+    return open(file_path, mode)
+
+
+class JsonLinesWriter:
+    """Write perovskite compositions as one compact Json document per line.
+
+    The documents can be dictionaries, e.g. from PerovskiteToJson.to_dict or BatchConverter,
+    or PerovskiteToJson objects. The lines are collected in a buffer that is written to file
+    when it exceeds buffer_size bytes. With append=True, the documents are added to the end of an existing file.
+    serializer is a compact Serializer, or a backend name.
+    """
+    def __init__(self, file_path, compress=None, buffer_size=1 << 20, append=False, serializer=None):
+        self.serializer = serializers.get_serializer(serializer, compact=True)
+        if not self.serializer.compact:
+            raise ValueError("JSON Lines files need a compact serializer")
+        self.file_path = file_path
+        self.compress = _is_compressed(file_path, compress)
+        self.buffer_size = buffer_size
+        self.count = 0
+        self._buffer = []
+        self._buffered = 0
+        self._file = _open(file_path, "ab" if append else "wb", self.compress)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, document):
+        "Add one document to the file"
+        if hasattr(document, "to_dict"):
+            document = document.to_dict()
+        line = self.serializer.dumps_bytes(document) + b"\n"
+        self._buffer.append(line)
+        self._buffered += len(line)
+        self.count += 1
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def write_many(self, documents):
+        "Add documents from an iterable, one at a time"
+        for document in documents:
+            self.write(document)
+        return self.count
+
+    def flush(self):
+        "Write the buffer to file"
+        if self._buffer:
+            self._file.write(b"".join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+        self._file.flush()
+
+    def close(self):
+        "Write what is left in the buffer and close the file"
+        if self._file is None:
+            return
+        self.flush()
+        self._file.close()
+        self._file = None
+
+
+def write_json_lines(documents, file_path, compress=None, buffer_size=1 << 20, append=False, serializer=None):
+    "Write documents from an iterable to a JSON Lines file. Returns the number of documents written"
+    with JsonLinesWriter(file_path, compress=compress, buffer_size=buffer_size, append=append, serializer=serializer) as writer:
+        return writer.write_many(documents)
+
+def read_json_lines(file_path, compress=None):
+    "Read the documents in a JSON Lines file one at a time"
+    with _open(file_path, "rb", _is_compressed(file_path, compress)) as infile:
+        for line in infile:
+            if line.strip():
+                yield json.loads(line)
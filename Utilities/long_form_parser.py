@@ -0,0 +1,287 @@
+"""
+Parser from perovskite long forms, e.g. Cs0.05FA0.79MA0.16PbBr0.5I2.5 or (PEA)2PbI4,
+back to the ions and coefficients of the A, B, and X sites
+
+This is the inverse of PerovskiteToJson.get_long_formula. The string is split into ions with a
+trie of all abbreviations in the A-, B-, and X-ion reference tables. Ions can be written with or
+without enclosing parentheses, a missing coefficient means 1, and the coefficient x means
+that the coefficient is not known. The ions are then assigned to the sites in the order A, B, X.
+
+A string can sometimes be read in more than one way, e.g. when an abbreviation ends with
+the same characters as the next one starts with, or when an ion is found in the reference data for
+more than one site. All readings are ranked, with readings that look like the output of
+get_long_formula first: all three sites given, the ions in alphabetic order within the sites,
+and parentheses around ions with more than two characters only.
+LongFormParser.parse_all returns all readings, and LongFormParser.parse returns the best one,
+or raises AmbiguousFormulaError if several readings are equally good.
+
+The readings are given as dictionaries with the arguments to PerovskiteToJson, e.g.
+    PerovskiteToJson(**parser.parse("(PEA)2PbI4"), save=False)
+"""
+import re
+
+try:
+    import reference_data
+except:
+    from Utilities import reference_data
+
+SITES = ("a", "b", "x")
+
+# The sites where an ion is found, as bits
+_A, _B, _X = 1, 2, 4
+_SITE_BITS = {"a": _A, "b": _B, "x": _X}
+
+# Marker in the trie for the end of an abbreviation
+_END = None
+# The characters where a coefficient can start, and a complete coefficient
+_COEFFICIENT_RUN = re.compile(r"x|[0-9.]+(?:[eE][-+]?[0-9]+)?")
+_COEFFICIENT_START = frozenset("0123456789.x")
+_NUMBER = re.compile(r"(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?")
+# Coefficients as given to PerovskiteToJson. No coefficient means 1, and x an unknown coefficient
+_COEFFICIENTS = {"": "1", "x": "nan"}
+
+
+class FormulaParseError(ValueError):
+    "A long form that cannot be read with the known ions"
+
+
+class AmbiguousFormulaError(FormulaParseError):
+    "A long form that can be read in several, equally good, ways. The readings are in the attribute interpretations"
+    def __init__(self, message, interpretations):
+        super().__init__(message)
+        self.interpretations = interpretations
+
+
+class LongFormParser:
+    """Parse perovskite long forms using the abbreviations of the ions in the reference data.
+
+    The abbreviations are read from the reference data given by path_to_reference_data ('local' or 'online'),
+    or given directly as lists in a_ions, b_ions and x_ions.
+    Parsed strings are cached, up to cache_size strings, as long forms are often repeated in large data sets.
+    The steps of the parsing are cached too (the coefficients, the ends of long forms, and the site splits of the ions),
+    up to cache_size entries each, so that new long forms that share parts with earlier ones are parsed faster.
+    """
+    def __init__(self, path_to_reference_data="local", a_ions=None, b_ions=None, x_ions=None,
+                 cache_size=100000, max_interpretations=1000):
+        if a_ions is None or b_ions is None or x_ions is None:
+            tables = reference_data.get_reference_tables(path_to_reference_data)
+            a_ions = _abbreviations(tables[0]) if a_ions is None else a_ions
+            b_ions = _abbreviations(tables[1]) if b_ions is None else b_ions
+            x_ions = _abbreviations(tables[2]) if x_ions is None else x_ions
+
+        self.cache_size = cache_size
+        self.max_interpretations = max_interpretations
+        self.cache = {}
+        # Caches of the steps of the parsing, see _coefficient_options, tokenize, and _site_splits
+        self.coefficient_options = {}
+        self.suffixes = {}
+        self.splits = {}
+
+        # The sites where every abbreviation is found, as bits (see _SITE_BITS)
+        self.sites = {}
+        for site, ions in zip(SITES, (a_ions, b_ions, x_ions)):
+            for ion in ions:
+                ion = str(ion).strip()
+                if ion:
+                    self.sites[ion] = self.sites.get(ion, 0) | _SITE_BITS[site]
+
+        # Trie of all abbreviations, with and without parentheses.
+        # At the end of an abbreviation: (abbreviation, written as by get_long_formula)
+        self.trie = {}
+        for ion in self.sites:
+            self._add(ion, (ion, len(ion) <= 2))
+            self._add("(" + ion + ")", (ion, len(ion) > 2))
+        # Characters that an abbreviation can start with. Only used to decide where a coefficient can end
+        self.starts = frozenset(self.trie)
+
+    def _add(self, text, ion):
+        node = self.trie
+        for character in text:
+            node = node.setdefault(character, {})
+        node[_END] = ion
+
+    def _coefficient_options(self, text):
+        """Possible coefficients in a run of digits (or x) after an ion, as (length, coefficient), longest first.
+        A coefficient can only be shorter than the run if the rest of the run can be the start of the next ion, e.g. 4T.
+        Cached, as the same coefficients are found in many long forms"""
+        options = self.coefficient_options.get(text)
+        if options is None:
+            if text == "x":
+                options = ((1, "x"),)
+            else:
+                options = []
+                if _NUMBER.fullmatch(text):
+                    options.append((len(text), text))
+                for k in range(len(text) - 1, 0, -1):
+                    if text[k] in self.starts and _NUMBER.fullmatch(text, 0, k):
+                        options.append((k, text[:k]))
+                if text[0] in self.starts:
+                    options.append((0, ""))
+                options = tuple(options)
+            if len(self.coefficient_options) >= self.cache_size:
+                self.coefficient_options.clear()
+            self.coefficient_options[text] = options
+        return options
+
+    def tokenize(self, long_form):
+        """All ways to split the long form into ions and coefficients.
+        Every split is a tuple of (abbreviation, coefficient as written, written as by get_long_formula).
+        The splits of the end of a long form only depend on that end, so they are cached by the end, as long forms
+        often end in the same way, e.g. with the same B- and X-ions"""
+        trie = self.trie
+        suffixes = self.suffixes
+        n = len(long_form)
+        limit = self.max_interpretations
+        memo = {n: ((),)}
+
+        def tokens_from(start):
+            results = memo.get(start)
+            if results is not None:
+                return results
+            suffix = long_form[start:]
+            results = suffixes.get(suffix)
+            if results is not None:
+                memo[start] = results
+                return results
+            results = []
+            node = trie
+            position = start
+            while position < n and len(results) < limit:
+                node = node.get(long_form[position])
+                if node is None:
+                    break
+                position += 1
+                ion = node.get(_END)
+                if ion is None:
+                    continue
+                if position == n or long_form[position] not in _COEFFICIENT_START:
+                    options = ((0, ""),)
+                else:
+                    match = _COEFFICIENT_RUN.match(long_form, position)
+                    options = ((0, ""),) if match is None else self._coefficient_options(match.group())
+                for length, coefficient in options:
+                    token = (ion[0], coefficient, ion[1])
+                    for rest in tokens_from(position + length):
+                        results.append((token,) + rest)
+            # Tuples, which the garbage collector stops tracking, as the cache can be large
+            results = tuple(results)
+            memo[start] = results
+            if len(suffixes) >= self.cache_size:
+                suffixes.clear()
+            suffixes[suffix] = results
+            return results
+
+        return list(tokens_from(0)[:limit])
+
+    def _site_splits(self, ions):
+        """The ways to split the ions into the A, B, and X sites, in that order, as (i, j, empty, unsorted):
+        the A-ions are ions[:i], the B-ions ions[i:j], and the X-ions ions[j:], and empty and unsorted are the number
+        of empty sites and of sites where the ions are not in alphabetic order. Cached, as the same ions are
+        found with many different coefficients"""
+        splits = self.splits.get(ions)
+        if splits is None:
+            n = len(ions)
+            masks = [self.sites[ion] for ion in ions]
+            # The A-ions are among the first a_end ions, and the X-ions among the ions from x_start
+            a_end = 0
+            while a_end < n and masks[a_end] & _A:
+                a_end += 1
+            x_start = n
+            while x_start > 0 and masks[x_start - 1] & _X:
+                x_start -= 1
+            # The ions from k to b_end[k] can be B-ions
+            b_end = list(range(n + 1))
+            for k in range(n - 1, -1, -1):
+                if masks[k] & _B:
+                    b_end[k] = b_end[k + 1]
+
+            splits = []
+            for i in range(a_end + 1):
+                for j in range(max(i, x_start), b_end[i] + 1):
+                    empty = (i == 0) + (j == i) + (j == n)
+                    unsorted = _unsorted(ions, 0, i) + _unsorted(ions, i, j) + _unsorted(ions, j, n)
+                    splits.append((i, j, empty, unsorted))
+            splits = tuple(splits)
+            if len(self.splits) >= self.cache_size:
+                self.splits.clear()
+            self.splits[ions] = splits
+        return splits
+
+    def _assign_sites(self, tokens):
+        """All ways to assign the ions to the A, B, and X sites, in that order.
+        Returns a list of (rank, (a_site, b_site, x_site)), where a site is a tuple of (ions, coefficients)"""
+        ions, written, canonical = zip(*tokens) if tokens else ((), (), ())
+        coefficients = tuple([_COEFFICIENTS.get(coefficient, coefficient) for coefficient in written])
+        not_canonical = len(tokens) - sum(canonical)
+        return [((empty, unsorted, not_canonical), ((ions[:i], coefficients[:i]),
+                                                    (ions[i:j], coefficients[i:j]),
+                                                    (ions[j:], coefficients[j:])))
+                for i, j, empty, unsorted in self._site_splits(ions)]
+
+    def _interpretations(self, long_form):
+        "Ranked readings of a long form as tuples of (rank, sites). Cached"
+        readings = self.cache.get(long_form)
+        if readings is None:
+            readings = [reading for tokens in self.tokenize(long_form) for reading in self._assign_sites(tokens)]
+            # Most long forms can only be read in one way, and need no ranking
+            if len(readings) > 1:
+                found = {}
+                for rank, sites in readings:
+                    if sites not in found or rank < found[sites]:
+                        found[sites] = rank
+                readings = sorted(((rank, sites) for sites, rank in found.items()), key=lambda reading: reading[0])
+            readings = tuple(readings)
+            if len(self.cache) >= self.cache_size:
+                self.cache.clear()
+            self.cache[long_form] = readings
+        return readings
+
+    def parse_all(self, long_form):
+        "All readings of the long form as arguments to PerovskiteToJson, best first. Empty if it cannot be read"
+        return [_arguments(sites) for rank, sites in self._interpretations(str(long_form).strip())]
+
+    def parse(self, long_form, strict=True):
+        """The best reading of the long form as arguments to PerovskiteToJson.
+        Raises FormulaParseError if the long form cannot be read, and, if strict is True,
+        AmbiguousFormulaError if there are several equally good readings"""
+        long_form = str(long_form).strip()
+        readings = self._interpretations(long_form)
+        if not readings:
+            raise FormulaParseError(f"Cannot read the long form '{long_form}' with the known ions")
+        if strict and len(readings) > 1 and readings[0][0] == readings[1][0]:
+            best = [_arguments(sites) for rank, sites in readings if rank == readings[0][0]]
+            raise AmbiguousFormulaError(f"The long form '{long_form}' can be read in {len(best)} ways", best)
+        return _arguments(readings[0][1])
+
+    def parse_many(self, long_forms, strict=False):
+        """Parse long forms one at a time. Yields the best reading,
+        or None for long forms that cannot be read (or are ambiguous if strict is True)"""
+        for long_form in long_forms:
+            try:
+                yield self.parse(long_form, strict=strict)
+            except FormulaParseError:
+                yield None
+
+
+def _unsorted(ions, start, end):
+    "1 if the ions from start to end are not in alphabetic order, otherwise 0"
+    for k in range(start + 1, end):
+        if ions[k - 1] > ions[k]:
+            return 1
+    return 0
+
+def _abbreviations(table):
+    "The abbreviations in a reference table"
+    return [ion for ion in table["Abbreviation"].to_numpy() if isinstance(ion, str)]
+
+def _arguments(sites):
+    "Arguments to PerovskiteToJson for the ions and coefficients of the sites"
+    (a_ions, a_coefficients), (b_ions, b_coefficients), (x_ions, x_coefficients) = sites
+    return {
+        "a_ions_abbreviations": list(a_ions),
+        "a_coefficients": list(a_coefficients),
+        "b_ions_abbreviations": list(b_ions),
+        "b_coefficients": list(b_coefficients),
+        "x_ions_abbreviations": list(x_ions),
+        "x_coefficients": list(x_coefficients),
+        }
@@ -0,0 +1,175 @@
+"""
+Packaging of perovskite compositions as zip archives for upload to NOMAD
+
+Every composition is written as one .archive.json file, with the same content as the files written
+by PerovskiteToJson.save_data, directly into a zip archive, without writing the files to disk first.
+When an archive reaches max_size bytes, it is closed and the next composition starts a new archive,
+so a large batch gives a set of archives that can be uploaded one at a time:
+
+    with NomadArchiveWriter("uploads", prefix="perovskites", max_size=1 << 30) as writer:
+        writer.write_many(BatchConverter().iter_convert(records))
+    writer.archives                     # ["uploads/perovskites_0001.zip", ...]
+
+The archives are deterministic: the same compositions give byte for byte the same archives.
+The files in the archives are named from the position of the composition, e.g. composition_000001.archive.json,
+or from the long form with naming=long_form_name, and have a fixed date and permissions.
+
+An archive is never larger than max_size, unless a single composition is larger than max_size.
+The size of a file in the archive is not known before it is compressed, so the check uses the size before
+compression, which means that an archive is closed a bit before it is full. The archives are written to a
+temporary name and renamed when they are complete.
+"""
+import os
+import re
+import zipfile
+
+try:
+    import serializers
+except:
+    from Utilities import serializers
+
+# Date of all files in the archives (the earliest date in the zip format), and permissions rw-r--r--
+ZIP_DATE = (1980, 1, 1, 0, 0, 0)
+ZIP_PERMISSIONS = 0o644 << 16
+# Size in the archive of a file, except for the content and the name:
+# local header (30), entry in the central directory (46), and room for zip64 extra fields
+_ENTRY_OVERHEAD = 30 + 46 + 40
+# End of the central directory, with zip64 records
+_END_OVERHEAD = 22 + 56 + 20
+# Characters in the long form that are kept in file names
+_UNSAFE = re.compile(r"[^A-Za-z0-9()._+-]")
+
+
+def index_name(document, index):
+    "File name from the position of the composition in the batch, e.g. composition_000001"
+    return f"composition_{index:06d}"
+
+def long_form_name(document, index):
+    "File name from the long form of the composition, e.g. composition_(PEA)2PbI4. The position if there is no long form"
+    data = document.get("data", document)
+    long_form = _UNSAFE.sub("_", str(data.get("long_form", "")))
+    if not long_form:
+        return index_name(document, index)
+    return f"composition_{long_form}"
+
+def _max_compressed_size(size):
+    "Upper limit of the size of data of a size after compression with deflate"
+    return size + 5 * (size // 16383 + 1)
+
+
+class NomadArchiveWriter:
+    """Write perovskite compositions as .archive.json files into zip archives of at most max_size bytes.
+
+    folder: the folder of the archives, which are named <prefix>_0001.zip, <prefix>_0002.zip, ...
+    compresslevel: deflate compression level, 0 (fastest) to 9 (smallest)
+    naming: function (document, index) -> file name without .archive.json, see index_name and long_form_name.
+            Repeated names get _2, _3, ... added
+    serializer: Serializer for the files (see serializers.py), by default indented as the files from PerovskiteToJson
+    The documents can be dictionaries from PerovskiteToJson.to_dict or BatchConverter, or PerovskiteToJson objects.
+    """
+    def __init__(self, folder, prefix="upload", max_size=1 << 30, compresslevel=6, naming=index_name, serializer=None):
+        if max_size <= _END_OVERHEAD:
+            raise ValueError("max_size is too small for a zip archive")
+        self.folder = os.fspath(folder)
+        self.prefix = prefix
+        self.max_size = max_size
+        self.compresslevel = compresslevel
+        self.naming = naming
+        self.serializer = serializers.get_serializer(serializer)
+        self.count = 0
+        self.archives = []
+        self._names = {}
+        self._zip = None
+        self._path = None
+        self._file = None
+        self._directory_size = 0
+        os.makedirs(self.folder, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, *args):
+        if error_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _name(self, document, index):
+        "Unique file name of a composition in the batch"
+        name = self.naming(document, index)
+        n = self._names.get(name, 0) + 1
+        self._names[name] = n
+        if n > 1:
+            name = f"{name}_{n}"
+        return name + ".archive.json"
+
+    def _open_archive(self):
+        self._path = os.path.join(self.folder, f"{self.prefix}_{len(self.archives) + 1:04d}.zip")
+        self._file = open(self._path + ".partial", "wb")
+        self._zip = zipfile.ZipFile(self._file, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=self.compresslevel)
+        self._directory_size = _END_OVERHEAD
+        self.archives.append(self._path)
+
+    def _close_archive(self):
+        if self._zip is None:
+            return
+        self._zip.close()
+        self._file.close()
+        os.replace(self._path + ".partial", self._path)
+        self._zip = None
+        self._file = None
+
+    def write(self, document):
+        "Add one composition. Returns the name of its file in the archive"
+        if hasattr(document, "to_dict"):
+            document = document.to_dict()
+        name = self._name(document, self.count)
+        content = self.serializer.dumps_bytes(document)
+        encoded_name = len(name.encode("utf-8"))
+
+        # Start a new archive if the file might not fit in the current one
+        size = _ENTRY_OVERHEAD + 2 * encoded_name + _max_compressed_size(len(content))
+        if self._zip is not None and self._file.tell() + self._directory_size + size > self.max_size and self._zip.filelist:
+            self._close_archive()
+        if self._zip is None:
+            self._open_archive()
+
+        info = zipfile.ZipInfo(name, date_time=ZIP_DATE)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.create_system = 3
+        info.external_attr = ZIP_PERMISSIONS
+        self._zip.writestr(info, content, compresslevel=self.compresslevel)
+        self._directory_size += 46 + 40 + encoded_name
+        self.count += 1
+        return name
+
+    def write_many(self, documents):
+        "Add compositions from an iterable, one at a time. Returns the number of compositions written"
+        for document in documents:
+            self.write(document)
+        return self.count
+
+    def close(self):
+        "Close the last archive. Returns the paths to all archives"
+        self._close_archive()
+        return self.archives
+
+    def abort(self):
+        "Close and remove the archive that is being written"
+        if self._zip is None:
+            return
+        self._zip.close()
+        self._file.close()
+        os.remove(self._path + ".partial")
+        self.archives.pop()
+        self._zip = None
+        self._file = None
+
+
+def write_nomad_archives(documents, folder, prefix="upload", max_size=1 << 30, compresslevel=6, naming=index_name,
+                         serializer=None):
+    "Write compositions from an iterable into zip archives for NOMAD. Returns the paths to the archives"
+    with NomadArchiveWriter(folder, prefix=prefix, max_size=max_size, compresslevel=compresslevel, naming=naming,
+                            serializer=serializer) as writer:
+        writer.write_many(documents)
+    return writer.archives
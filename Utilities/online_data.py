@@ -0,0 +1,126 @@
+"""
+Download and caching of the online reference data for the perovskite ions
+
+The data files given by filepaths.urls_to_data are downloaded to a local cache folder
+(filepaths.path_to_cache_folder) and the cached copies are used until they are older
+than the time to live, config["cache_ttl"]. After that, the server is asked with a
+conditional request (ETag / If-Modified-Since) and the file is only downloaded again if it
+has changed. If the server cannot be reached, the last downloaded copy is used, and if
+there is none, the data files distributed with the code (the local origin) are used.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+try:
+    import filepaths
+except:
+    from Utilities import filepaths
+
+_lock = threading.Lock()
+
+
+def _path_to_metadata(cache_path):
+    "file path to the information stored about a cached file"
+    return cache_path + ".meta.json"
+
+def _read_metadata(cache_path):
+    try:
+        with open(_path_to_metadata(cache_path), "r") as infile:
+            return json.load(infile)
+    except (OSError, ValueError):
+        return {}
+
+def _write_atomically(path, data, mode="wb"):
+    "Write to a temporary file and move it in place, so that a partially written file is never used"
+    handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".download-", suffix=".tmp")
+    try:
+        with os.fdopen(handle, mode) as outfile:
+            outfile.write(data)
+        # mkstemp creates the file readable by the owner only
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+def _write_metadata(cache_path, metadata):
+    _write_atomically(_path_to_metadata(cache_path), json.dumps(metadata, indent=4), mode="w")
+
+def fetch(url, cache_path, fallback_path=None, ttl=None, timeout=None, force=False):
+    """Get a local copy of an online file.
+    Returns the path to the cached copy, or fallback_path if the file cannot be downloaded and there is no cached copy"""
+    ttl = filepaths.config["cache_ttl"] if ttl is None else ttl
+    timeout = filepaths.config["timeout"] if timeout is None else timeout
+
+    with _lock:
+        metadata = _read_metadata(cache_path)
+        is_cached = os.path.isfile(cache_path) and metadata.get("url") == url
+
+        # Use the cached copy as long as it is fresh
+        if is_cached and not force and time.time() - metadata.get("checked", 0) < ttl:
+            return cache_path
+
+        # Ask the server, conditionally if there is a cached copy
+        headers = {}
+        if is_cached:
+            if metadata.get("etag"):
+                headers["If-None-Match"] = metadata["etag"]
+            if metadata.get("last_modified"):
+                headers["If-Modified-Since"] = metadata["last_modified"]
+
+        try:
+            request = urllib.request.Request(url, headers=headers)
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                data = response.read()
+                etag = response.headers.get("ETag")
+                last_modified = response.headers.get("Last-Modified")
+
+            # The data files are excel files, i.e. zip archives. Anything else, e.g. an error page, is not used
+            if not data.startswith(b"PK"):
+                raise ValueError(f"{url} did not return an excel file")
+
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            _write_atomically(cache_path, data)
+            _write_metadata(cache_path, {
+                "url": url,
+                "etag": etag,
+                "last_modified": last_modified,
+                "checked": time.time(),
+                })
+            return cache_path
+
+        except urllib.error.HTTPError as error:
+            # Not modified. The cached copy is still valid
+            if error.code == 304 and is_cached:
+                metadata["checked"] = time.time()
+                try:
+                    _write_metadata(cache_path, metadata)
+                except OSError:
+                    pass
+                return cache_path
+
+        except (urllib.error.URLError, OSError, ValueError):
+            pass
+
+        # Offline, or the server did not give a usable file. Use the last good copy or the fallback
+        if is_cached:
+            return cache_path
+        return fallback_path
+
+def paths_to_data(force=False):
+    """Local paths to the online data for A-ions, B-ions, X-ions, and additives and impurities.
+    Files that cannot be downloaded are replaced by the data files distributed with the code"""
+    cache_folder = filepaths.path_to_cache_folder()
+    fallback_paths = filepaths.paths_to_data(origin="local")
+
+    paths = []
+    for url, file_name, fallback_path in zip(filepaths.urls_to_data(), filepaths.online_file_names, fallback_paths):
+        cache_path = os.path.join(cache_folder, file_name)
+        paths.append(fetch(url, cache_path, fallback_path=fallback_path, force=force))
+
+    return tuple(paths)
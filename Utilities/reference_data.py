@@ -0,0 +1,284 @@
+"""
+Process-wide cache for the reference data of the perovskite ions
+
+The reference tables (A-ions, B-ions, X-ions, and additives and impurities) are read
+once per process and shared between all PerovskiteToJson objects and the GUI.
+A cached table is keyed by the origin of the data and the resolved path to the file,
+and is read in again if the file changes on disk (modification time or size).
+
+When a table is read, it is also compiled into an IonIndex, a dictionary from the 
+abbreviation of an ion to all its complementary data, so that looking up an ion 
+is a single dictionary lookup instead of one scan of the table per column.
+
+The molecular formulas of a table are also parsed once into the number of atoms of every
+element (see get_element_counts), and the optional radii of the ions (see RADIUS_COLUMNS and
+get_radii) are collected once, and both are kept as long as the table.
+
+Local excel files are read through the compiled snapshot in reference_snapshot.py.
+
+The paths to the data files of an origin are kept for config["cache_ttl"] seconds (see get_paths),
+so that the online data is not checked on every table access, but new online data is still found
+by processes that run for a long time. Online paths that fell back on the local data files, e.g.
+when offline, are not kept, so the online data is used as soon as it can be downloaded.
+
+The cached tables are shared, so they should be treated as read only.
+"""
+import hashlib
+import os
+import threading
+import time
+import weakref
+
+import pandas as pd
+
+try:
+    import chemical_formula
+    import filepaths
+    import reference_snapshot
+except:
+    from Utilities import chemical_formula
+    from Utilities import filepaths
+    from Utilities import reference_snapshot
+
+# Columns with complementary data about the ions that are collected in the index
+INDEX_COLUMNS = (
+    "Molecular_formula", 
+    "SMILE", 
+    "Common_name", 
+    "IUPAC_name", 
+    "CAS", 
+    "Parent_SMILE", 
+    "Parent_IUPAC", 
+    "Parent_CAS",
+    )
+
+# Optional columns with the radii of the ions in Ångström, in order of preference
+RADIUS_COLUMNS = (
+    "Ionic_radius",
+    "Effective_radius",
+    )
+
+# Cached tables. Key: (origin, resolved path). Value: {"table": DataFrame, "index": IonIndex, "signature": file signature}
+_cache = {}
+# Indexes of tables. Key: id of the table. Value: (weak reference to the table, IonIndex)
+_indexes = {}
+# Element counts of the ions in tables. Key: id of the table. Value: (weak reference to the table, element counts)
+_element_counts = {}
+# Radii of the ions in tables. Key: id of the table. Value: (weak reference to the table, radii)
+_radii = {}
+# Paths to the data files. Key: (origin, working directory). Value: (tuple of paths from filepaths.paths_to_data, time)
+_paths = {}
+_lock = threading.RLock()
+
+
+class IonIndex:
+    """Lookup from the abbreviation of an ion to its complementary data in a reference table.
+    Every record holds the columns in INDEX_COLUMNS as stripped strings, with "nan" for missing data.
+    If an abbreviation occurs several times in the table, the first row is used
+    and the abbreviation is reported in the attribute duplicates"""
+    def __init__(self, table):
+        self.records = {}
+        self.duplicates = {}
+        self.missing = dict.fromkeys(INDEX_COLUMNS, "nan")
+        
+        # The values of the columns. Columns not in the table are treated as missing data
+        columns = {}
+        for column in INDEX_COLUMNS:
+            if column in table.columns:
+                columns[column] = table[column].to_numpy()
+        
+        for row, abbreviation in enumerate(table["Abbreviation"].to_numpy()):
+            # Only string abbreviations can match the abbreviations of the ions
+            if not isinstance(abbreviation, str):
+                continue
+            
+            # If not unique, keep the first one and note the rows of the duplicates
+            if abbreviation in self.records:
+                self.duplicates.setdefault(abbreviation, [self.records[abbreviation]["row"]]).append(row)
+                continue
+            
+            record = {"row": row}
+            for column in INDEX_COLUMNS:
+                if column in columns:
+                    record[column] = str(columns[column][row]).strip()
+                else:
+                    record[column] = "nan"
+            self.records[abbreviation] = record
+    
+    def __contains__(self, abbreviation):
+        return abbreviation in self.records
+    
+    def __len__(self):
+        return len(self.records)
+    
+    def get(self, abbreviation):
+        "The complementary data of an ion. Every value is 'nan' if the ion is not in the table"
+        return self.records.get(abbreviation, self.missing)
+
+
+def _is_url(path):
+    "Check if a path points to an online resource"
+    return str(path).startswith(("http://", "https://"))
+
+def _resolve(path):
+    "Absolute path to a local file. Urls are kept as they are"
+    path = str(path)
+    if _is_url(path):
+        return path
+    return os.path.realpath(path)
+
+def _signature(path):
+    "Modification time and size of a file. Used to detect if the file has changed"
+    if _is_url(path):
+        return None
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+def _read_tables(paths):
+    """Read tables from file. Local excel files are read through the compiled snapshot in reference_snapshot.py,
+    all at once, so that the snapshot is written at most once"""
+    snapshot_paths = [path for path in paths if not _is_url(path) and path.endswith(".xlsx")]
+    tables = dict(zip(snapshot_paths, reference_snapshot.read_tables(snapshot_paths)))
+    return [tables[path] if path in tables else pd.read_excel(path) for path in paths]
+
+def get_table(path, origin="local"):
+    "Get a reference table. The file is only read if it is not cached or if it has changed since it was read"
+    return get_tables([path], origin=origin)[0]
+
+def get_tables(paths, origin="local"):
+    "Get several reference tables as get_table. The tables that are not cached or have changed are read together"
+    keys = [(origin, _resolve(path)) for path in paths]
+    signatures = [_signature(key[1]) for key in keys]
+
+    with _lock:
+        stale = {}
+        for key, signature in zip(keys, signatures):
+            entry = _cache.get(key)
+            if entry is None or entry["signature"] != signature:
+                stale[key] = signature
+        if stale:
+            tables = _read_tables([key[1] for key in stale])
+            for (key, signature), table in zip(stale.items(), tables):
+                _cache[key] = {"table": table, "index": get_index(table), "signature": signature}
+        return tuple(_cache[key]["table"] for key in keys)
+
+def _for_table(cache, table, build):
+    "Data derived from a table, built the first time it is asked for and then reused as long as the table exists"
+    key = id(table)
+    with _lock:
+        item = cache.get(key)
+        if item is not None and item[0]() is table:
+            return item[1]
+        
+        # Remove the data together with the table
+        reference = weakref.ref(table, lambda _, key=key: cache.pop(key, None))
+        value = build(table)
+        cache[key] = (reference, value)
+        return value
+
+def get_index(table):
+    "The IonIndex of a reference table. The index is built the first time it is asked for and then reused"
+    return _for_table(_indexes, table, IonIndex)
+
+def _parse_formulas(table):
+    counts = {}
+    for abbreviation, record in get_index(table).records.items():
+        try:
+            counts[abbreviation] = chemical_formula.parse_formula(record["Molecular_formula"])
+        except chemical_formula.FormulaError:
+            continue
+    return counts
+
+def get_element_counts(table):
+    """The number of atoms of every element in the ions of a reference table, parsed from the column Molecular_formula.
+    Dictionary from the abbreviation to a tuple of (element, number). Ions with formulas that cannot be read are left out"""
+    return _for_table(_element_counts, table, _parse_formulas)
+
+def _radius(value):
+    "A radius as a positive float, or None"
+    try:
+        radius = float(str(value).strip().replace(",", "."))
+    except ValueError:
+        return None
+    return radius if radius > 0 else None
+
+def _collect_radii(table):
+    columns = [table[column].to_numpy() for column in RADIUS_COLUMNS if column in table.columns]
+    radii = {}
+    seen = set()
+    for row, abbreviation in enumerate(table["Abbreviation"].to_numpy()):
+        # As in IonIndex, the first row of an abbreviation is used
+        if not isinstance(abbreviation, str) or abbreviation in seen:
+            continue
+        seen.add(abbreviation)
+        for values in columns:
+            radius = _radius(values[row])
+            if radius is not None:
+                radii[abbreviation] = radius
+                break
+    return radii
+
+def get_radii(table):
+    """The radii of the ions in a reference table, from the first of the columns in RADIUS_COLUMNS with a value.
+    Dictionary from the abbreviation to the radius. Empty if the table has none of the columns"""
+    return _for_table(_radii, table, _collect_radii)
+
+def get_paths(origin="local"):
+    """The paths to the data files of an origin from filepaths.paths_to_data. The paths are resolved again
+    after config["cache_ttl"] seconds, and online paths are resolved on every call as long as any of them is
+    a local fallback. The local paths depend on the working directory, which is part of the key"""
+    key = (origin, os.getcwd())
+    entry = _paths.get(key)
+    if entry is None or time.monotonic() - entry[1] >= filepaths.config["cache_ttl"]:
+        with _lock:
+            entry = _paths.get(key)
+            if entry is None or time.monotonic() - entry[1] >= filepaths.config["cache_ttl"]:
+                paths = tuple(filepaths.paths_to_data(origin=origin))
+                entry = (paths, time.monotonic())
+                if origin == "local" or not set(paths) & set(filepaths.paths_to_data(origin="local")):
+                    _paths[key] = entry
+                else:
+                    _paths.pop(key, None)
+    return entry[0]
+
+def get_reference_tables(origin="local"):
+    "Reference tables in the same order as the paths given by filepaths.paths_to_data"
+    return get_tables(get_paths(origin), origin=origin)
+
+def data_version(origin="local"):
+    "Hash of the content of the reference data files for an origin. Changes when any of the files changes"
+    digest = hashlib.sha256()
+    for path in get_paths(origin):
+        resolved_path = _resolve(path)
+        digest.update(os.path.basename(resolved_path).encode("utf-8"))
+        digest.update(reference_snapshot.file_hash(resolved_path).encode("utf-8"))
+    return digest.hexdigest()
+
+def duplicate_abbreviations(origin="local"):
+    "Abbreviations that occur more than once in the reference tables. Key: file path. Value: {abbreviation: rows}"
+    duplicates = {}
+    for path, table in zip(get_paths(origin), get_reference_tables(origin=origin)):
+        index = get_index(table)
+        if index.duplicates:
+            duplicates[path] = index.duplicates
+    return duplicates
+
+def clear(origin=None):
+    """Empty the cache and the resolved paths. If an origin is given, only the tables and paths of that origin are removed.
+    The snapshots read in by reference_snapshot are always forgotten"""
+    with _lock:
+        reference_snapshot.clear()
+        if origin is None:
+            _cache.clear()
+            _paths.clear()
+        else:
+            for key in [key for key in _cache if key[0] == origin]:
+                del _cache[key]
+            for key in [key for key in _paths if key[0] == origin]:
+                del _paths[key]
+
+def reload(origin="local"):
+    "Remove the cached tables and paths for an origin and read them in again"
+    with _lock:
+        clear(origin)
+        return get_reference_tables(origin)
@@ -0,0 +1,210 @@
+"""
+Compiled snapshot of the reference tables for the perovskite ions
+
+Reading the excel files through openpyxl is slow, so the tables are compiled into a
+pickled snapshot stored next to the excel files (see filepaths.path_to_snapshot).
+The snapshot stores the size, modification time, and sha256 hash of every source file.
+A table is taken from the snapshot as long as its source file is unchanged,
+otherwise it is read from the excel file again and the snapshot is rebuilt.
+
+The snapshot can be compiled explicitly with:
+    python -m Utilities.reference_snapshot
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+
+import pandas as pd
+
+try:
+    import filepaths
+except:
+    from Utilities import filepaths
+
+# Increase when the content of the snapshot changes, which forces a rebuild of old snapshots
+SNAPSHOT_VERSION = 1
+
+# Snapshots read in by this process. Key: path to the snapshot. Value: (signature of the snapshot file, snapshot)
+_loaded = {}
+_lock = threading.RLock()
+
+
+def _stat(path):
+    "Size and modification time of a file"
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+def file_hash(path):
+    "sha256 hash of the content of a file"
+    digest = hashlib.sha256()
+    with open(path, "rb") as infile:
+        for block in iter(lambda: infile.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _source_info(path):
+    "The information about a source file stored in the snapshot"
+    size, mtime_ns = _stat(path)
+    return {"size": size, "mtime_ns": mtime_ns, "sha256": file_hash(path)}
+
+def _empty_snapshot():
+    return {
+        "version": SNAPSHOT_VERSION,
+        "pandas_version": pd.__version__,
+        "sources": {},
+        "tables": {},
+        }
+
+def _check_source(source, path):
+    """Check if a source file is unchanged since the snapshot was made.
+    Returns None if it has changed, otherwise the information about the source, which is a new dictionary
+    with the new modification time if the file has only been touched. The snapshot itself is not changed, as it is shared.
+    The hash is only computed if the size is the same but the modification time differs"""
+    size, mtime_ns = _stat(path)
+    if size != source["size"]:
+        return None
+    if mtime_ns == source["mtime_ns"]:
+        return source
+    if file_hash(path) == source["sha256"]:
+        # Same content, the file has only been touched
+        return {**source, "mtime_ns": mtime_ns}
+    return None
+
+def load_snapshot(snapshot_path):
+    "Read in a snapshot. Returns None if there is no usable snapshot"
+    try:
+        signature = _stat(snapshot_path)
+    except OSError:
+        return None
+
+    with _lock:
+        cached = _loaded.get(snapshot_path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        try:
+            with open(snapshot_path, "rb") as infile:
+                snapshot = pickle.load(infile)
+        except Exception:
+            return None
+
+        # Snapshots made by another version of the code or of pandas are rebuilt
+        if not isinstance(snapshot, dict):
+            return None
+        if snapshot.get("version") != SNAPSHOT_VERSION or snapshot.get("pandas_version") != pd.__version__:
+            return None
+
+        _loaded[snapshot_path] = (signature, snapshot)
+        return snapshot
+
+def clear():
+    "Forget the snapshots read in by this process, so that they are read from file again"
+    with _lock:
+        _loaded.clear()
+
+def save_snapshot(snapshot, snapshot_path):
+    """Write a snapshot to file. The file is replaced atomically so that other processes never see a partial file.
+    Returns False if the snapshot could not be written, e.g. if the folder is read only"""
+    folder = os.path.dirname(snapshot_path)
+    try:
+        handle, temp_path = tempfile.mkstemp(dir=folder, prefix=".snapshot-", suffix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as outfile:
+                pickle.dump(snapshot, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, snapshot_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+    except OSError:
+        return False
+
+    with _lock:
+        _loaded[snapshot_path] = (_stat(snapshot_path), snapshot)
+    return True
+
+def compile_snapshot(paths=None, snapshot_path=None):
+    """Compile a snapshot from a list of excel files.
+    By default, the local reference tables given by filepaths.paths_to_data are used"""
+    if paths is None:
+        paths = filepaths.paths_to_data(origin="local")
+    paths = [os.path.realpath(path) for path in paths]
+    if snapshot_path is None:
+        snapshot_path = filepaths.path_to_snapshot(os.path.dirname(paths[0]))
+
+    snapshot = _empty_snapshot()
+    for path in paths:
+        name = os.path.basename(path)
+        snapshot["sources"][name] = _source_info(path)
+        snapshot["tables"][name] = pd.read_excel(path)
+
+    save_snapshot(snapshot, snapshot_path)
+    return snapshot
+
+def read_table(path):
+    """Read a reference table through the snapshot in the same folder as the table.
+    If the table is not in the snapshot, or if the file has changed, the table is read from file and the snapshot is updated"""
+    return read_tables([path])[0]
+
+def read_tables(paths):
+    """Read reference tables through the snapshots in their folders, as read_table.
+    The snapshot of a folder is written at most once, however many of its tables have changed"""
+    paths = [os.path.realpath(path) for path in paths]
+    folders = {}
+    for path in paths:
+        folders.setdefault(os.path.dirname(path), []).append(os.path.basename(path))
+
+    tables = {}
+    for folder, names in folders.items():
+        for name, table in _read_folder(folder, names).items():
+            tables[os.path.join(folder, name)] = table
+    return [tables[path] for path in paths]
+
+def _read_folder(folder, names):
+    "Tables with the given file names in a folder, through the snapshot of the folder"
+    snapshot_path = filepaths.path_to_snapshot(folder)
+
+    with _lock:
+        snapshot = load_snapshot(snapshot_path)
+        if snapshot is None:
+            snapshot = _empty_snapshot()
+
+        # Check all tables in the snapshot and rebuild the ones that have changed or been added
+        new_names = [name for name in dict.fromkeys(names) if name not in snapshot["sources"]]
+        stale = list(new_names)
+        sources = {}
+        for source_name, source in snapshot["sources"].items():
+            source_path = os.path.join(folder, source_name)
+            checked = _check_source(source, source_path) if os.path.isfile(source_path) else None
+            if checked is None:
+                stale.append(source_name)
+            else:
+                sources[source_name] = checked
+        touched = any(sources[name] is not snapshot["sources"][name] for name in sources)
+
+        if not stale and not touched:
+            return {name: snapshot["tables"][name] for name in names}
+
+        # Build a new snapshot, so that a snapshot shared with other threads is never changed
+        new_snapshot = _empty_snapshot()
+        for source_name in list(snapshot["sources"]) + new_names:
+            source_path = os.path.join(folder, source_name)
+            if not os.path.isfile(source_path):
+                continue
+            if source_name in stale:
+                new_snapshot["sources"][source_name] = _source_info(source_path)
+                new_snapshot["tables"][source_name] = pd.read_excel(source_path)
+            else:
+                new_snapshot["sources"][source_name] = sources[source_name]
+                new_snapshot["tables"][source_name] = snapshot["tables"][source_name]
+
+        save_snapshot(new_snapshot, snapshot_path)
+        return {name: new_snapshot["tables"][name] for name in names}
+
+
+# Compile the snapshot of the local reference tables
+if __name__ == "__main__":
+    snapshot = compile_snapshot()
+    for name, source in snapshot["sources"].items():
+        print(f"{name}: {source['sha256']}")
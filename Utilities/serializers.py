@@ -0,0 +1,85 @@
+"""
+Serialization of perovskite compositions to Json
+
+A Serializer turns the dictionaries from PerovskiteToJson.to_dict and BatchConverter into Json,
+either as a string (dumps), as utf-8 bytes (dumps_bytes), or written directly to an open file (dump),
+so that the whole Json string never has to be kept in memory together with the dictionary.
+
+Formatting:
+    indented (default): the same output as json.dumps(data, indent=4), as in the .json files
+    compact=True:       no blank spaces or line breaks, as in JSON Lines files. About half the size and time
+
+Backends:
+    "json" (default): the standard library
+    "orjson": the optional orjson package, if it is installed
+    "auto": orjson if it is installed, otherwise the standard library
+
+The keys are written in the same order with both backends. orjson cannot indent with 4 spaces,
+so the standard library is used for indented output, and orjson writes non-ASCII characters as utf-8
+instead of escaping them, and nan as null. The output of the standard library backend is the same
+as before the serializers were added.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKENDS = ("json", "orjson", "auto")
+
+
+class Serializer:
+    "Json serialization with a backend (see BACKENDS), indented with indent spaces, or compact"
+    def __init__(self, backend="json", compact=False, indent=4):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend '{backend}'. Options are: {', '.join(BACKENDS)}")
+        if backend == "orjson" and orjson is None:
+            raise ImportError("The orjson backend needs the package orjson")
+        self.backend = backend
+        self.compact = compact
+        self.indent = None if compact else indent
+        # orjson only for compact output
+        self.use_orjson = compact and orjson is not None and backend != "json"
+
+    def __repr__(self):
+        return f"Serializer(backend={self.backend!r}, compact={self.compact!r}, indent={self.indent!r})"
+
+    def _options(self):
+        if self.compact:
+            return {"separators": (",", ":")}
+        return {"indent": self.indent}
+
+    def dumps(self, data):
+        "The data as a Json string"
+        if self.use_orjson:
+            return orjson.dumps(data).decode("utf-8")
+        return json.dumps(data, **self._options())
+
+    def dumps_bytes(self, data):
+        "The data as utf-8 encoded Json"
+        if self.use_orjson:
+            return orjson.dumps(data)
+        return json.dumps(data, **self._options()).encode("utf-8")
+
+    def dump(self, data, file):
+        """Write the data as Json to a file opened in text mode. The standard library writes the Json in pieces
+        as it is produced, while orjson produces the compact bytes at once"""
+        if self.use_orjson:
+            file.write(orjson.dumps(data).decode("utf-8"))
+        else:
+            json.dump(data, file, **self._options())
+
+
+# The formatting of the .json files written by PerovskiteToJson, and of the lines in JSON Lines files
+INDENTED = Serializer()
+COMPACT = Serializer(compact=True)
+
+
+def get_serializer(serializer=None, compact=False):
+    "A Serializer from a Serializer, a backend name, or None for the standard library"
+    if isinstance(serializer, Serializer):
+        return serializer
+    if serializer is None or serializer == "json":
+        return COMPACT if compact else INDENTED
+    return Serializer(backend=serializer, compact=compact)
@@ -0,0 +1,117 @@
+"""
+Goldschmidt tolerance factor and octahedral factor of many perovskite compositions at once
+
+    t = (r_A + r_X) / (sqrt(2) * (r_B + r_X))
+    mu = r_B / r_X
+
+The radius of a site is the mean of the radii of its ions weighted by their coefficients, e.g.
+r_A = 0.05 r_Cs + 0.79 r_FA + 0.16 r_MA for Cs0.05FA0.79MA0.16PbBr0.5I2.5.
+
+The radii are read from an optional column in the reference tables (see reference_data.RADIUS_COLUMNS),
+and can be given, or replaced, with the argument radii. The reference data in this repository does
+not have radii, so they have to be added to the tables or given with radii.
+
+A site radius is masked if the site is empty, or if the radius or coefficient of any of its ions is not
+known, and the factors are masked where a site radius is masked. The results are NumPy masked arrays:
+
+    factors = ToleranceFactors(CompositionArrays.from_documents(documents), radii={"a": {"Cs": 1.88}, ...})
+    factors.tolerance_factor()
+    factors.table()
+"""
+import numpy as np
+import pandas as pd
+
+try:
+    import composition_arrays
+    import reference_data
+except:
+    from Utilities import composition_arrays
+    from Utilities import reference_data
+
+# Ranges of the factors where perovskites are commonly found to form
+TOLERANCE_RANGE = (0.8, 1.0)
+OCTAHEDRAL_RANGE = (0.414, 0.732)
+
+
+def get_radii(origin="local"):
+    "The radii in the A-, B-, and X-ion reference tables, as a dictionary from the site to reference_data.get_radii"
+    tables = reference_data.get_reference_tables(origin)
+    return {site: reference_data.get_radii(table) for site, table in zip(composition_arrays.ION_SITES, tables)}
+
+def tolerance_factor(r_a, r_b, r_x):
+    "The Goldschmidt tolerance factor from the radii of the sites. Works element by element on (masked) arrays"
+    return (r_a + r_x) / (np.sqrt(2) * (r_b + r_x))
+
+def octahedral_factor(r_b, r_x):
+    "The octahedral factor from the radii of the B and X sites. Works element by element on (masked) arrays"
+    return r_b / r_x
+
+
+class ToleranceFactors:
+    """Site radii, tolerance factors, and octahedral factors of CompositionArrays.
+
+    radii: dictionary from the site ('a', 'b', 'x') to a dictionary from the abbreviation to the radius in Ångström.
+           These are used before the radii in the reference data given by path_to_reference_data
+    """
+    def __init__(self, arrays, radii=None, path_to_reference_data="local"):
+        self.arrays = arrays
+        self.radii = get_radii(path_to_reference_data)
+        for site, site_radii in (radii or {}).items():
+            self.radii[site] = {**self.radii.get(site, {}), **site_radii}
+        self._radius_codes = {}
+
+    def __len__(self):
+        return len(self.arrays)
+
+    def radius_codes(self, site):
+        "The radius of every ion code in the ion table in a site, nan where it is not known"
+        values = self._radius_codes.get(site)
+        if values is None:
+            radii = self.radii.get(site, {})
+            ions = self.arrays.ions
+            values = np.array([radii.get(ions[code], np.nan) for code in range(len(ions))], dtype=np.float64)
+            self._radius_codes[site] = values
+        return values
+
+    def site_radius(self, site):
+        "The coefficient weighted mean radius of a site in every composition, as a masked array"
+        site_arrays = self.arrays.sites[site]
+        radii = self.radius_codes(site)[site_arrays.codes]
+        coefficients = site_arrays.coefficients
+        weighted = np.bincount(site_arrays.rows, weights=coefficients * radii, minlength=len(site_arrays))
+        total = np.bincount(site_arrays.rows, weights=coefficients, minlength=len(site_arrays))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            radius = weighted / total
+        return np.ma.masked_invalid(radius)
+
+    def site_radii(self):
+        "Dictionary from the site to site_radius"
+        return {site: self.site_radius(site) for site in composition_arrays.ION_SITES}
+
+    def tolerance_factor(self):
+        "The Goldschmidt tolerance factor of every composition, as a masked array"
+        radii = self.site_radii()
+        return tolerance_factor(radii["a"], radii["b"], radii["x"])
+
+    def octahedral_factor(self):
+        "The octahedral factor of every composition, as a masked array"
+        radii = self.site_radii()
+        return octahedral_factor(radii["b"], radii["x"])
+
+    def formable(self, tolerance_range=TOLERANCE_RANGE, octahedral_range=OCTAHEDRAL_RANGE):
+        "True where both factors are in their ranges, as a masked array"
+        tolerance = self.tolerance_factor()
+        octahedral = self.octahedral_factor()
+        return ((tolerance >= tolerance_range[0]) & (tolerance <= tolerance_range[1]) &
+                (octahedral >= octahedral_range[0]) & (octahedral <= octahedral_range[1]))
+
+    def table(self):
+        "DataFrame with the site radii and the factors of every composition, with nan for masked values"
+        radii = self.site_radii()
+        return pd.DataFrame({
+            "r_a": radii["a"].filled(np.nan),
+            "r_b": radii["b"].filled(np.nan),
+            "r_x": radii["x"].filled(np.nan),
+            "tolerance_factor": tolerance_factor(radii["a"], radii["b"], radii["x"]).filled(np.nan),
+            "octahedral_factor": octahedral_factor(radii["b"], radii["x"]).filled(np.nan),
+            })
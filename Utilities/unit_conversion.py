@@ -0,0 +1,192 @@
+"""
+Conversion of the amounts of additives and impurities between units
+
+The amount of an additive (or impurity) is given relative to the host perovskite, as the
+mass fraction w of the additive in a mixture of the additive and the host. With the molar mass
+M_a of the additive and the molar mass M_h of one formula unit of the host (the coefficients
+of the A, B, and X sites times the molar masses of the ions), the mole fraction is
+
+    x = (w / M_a) / (w / M_a + (1 - w) / M_h)
+
+Every additive is converted on its own against the host, i.e. the other additives of the composition
+are not part of the mixture. The molar masses are computed from the column Molecular_formula in the
+reference tables, see chemical_formula.py.
+
+Units:
+    mass fraction, wt %, mole fraction, mol %
+    mol/dm^3 and cm^-3 (the concentration in the GUI), which need the density of the host in g/cm^3
+vol % needs the density of the additives as well, which is not in the reference data, and is not supported.
+
+All conversions work on NumPy arrays, with one value per additive, so that a whole batch of compositions
+(CompositionArrays, see composition_arrays.py) is converted at once:
+
+    amounts = AdditiveAmounts(CompositionArrays.from_documents(documents))
+    amounts.convert("mol %")                       # mol % of every additive
+    amounts.table()                                # DataFrame with one row per additive
+"""
+import numpy as np
+import pandas as pd
+
+try:
+    import chemical_formula
+    import composition_arrays
+    import reference_data
+except:
+    from Utilities import chemical_formula
+    from Utilities import composition_arrays
+    from Utilities import reference_data
+
+AVOGADRO = 6.02214076e23
+
+# Units of amounts, as in default_values.additive_concentration_metrics where they are the same
+MASS_FRACTION = "mass fraction"
+WEIGHT_PERCENT = "wt %"
+MOLE_FRACTION = "mole fraction"
+MOLE_PERCENT = "mol %"
+MOLARITY = "mol/dm^3"
+NUMBER_DENSITY = "cm^-3"
+UNITS = (MASS_FRACTION, WEIGHT_PERCENT, MOLE_FRACTION, MOLE_PERCENT, MOLARITY, NUMBER_DENSITY)
+# Units that need the density of the host
+_DENSITY_UNITS = (MOLARITY, NUMBER_DENSITY)
+
+
+def site_molar_masses(table):
+    "Dictionary from the abbreviation of an ion or additive to its molar mass, for the entries in a reference table"
+    masses = {}
+    for abbreviation, record in reference_data.get_index(table).records.items():
+        masses[abbreviation] = chemical_formula.molar_mass(record["Molecular_formula"])
+    return masses
+
+def get_molar_masses(origin="local"):
+    "The molar masses in the reference tables, as a dictionary from the site (see composition_arrays.SITES) to site_molar_masses"
+    a_ions, b_ions, x_ions, additives = reference_data.get_reference_tables(origin)
+    additives = site_molar_masses(additives)
+    return {
+        "a": site_molar_masses(a_ions),
+        "b": site_molar_masses(b_ions),
+        "x": site_molar_masses(x_ions),
+        "additives": additives,
+        "impurities": additives,
+        }
+
+
+def _check_unit(unit, density):
+    if unit == "vol %":
+        raise ValueError("vol % needs the density of the additives, which is not in the reference data")
+    if unit not in UNITS:
+        raise ValueError(f"Unknown unit '{unit}'. Options are: {', '.join(UNITS)}")
+    if unit in _DENSITY_UNITS and density is None:
+        raise ValueError(f"Conversion to or from {unit} needs the density of the host")
+
+def mass_to_mole_fraction(mass_fraction, additive_molar_mass, host_molar_mass):
+    "Mole fraction of additives with the mass fractions, against the host"
+    w = np.asarray(mass_fraction, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        additive = w / additive_molar_mass
+        return additive / (additive + (1 - w) / host_molar_mass)
+
+def mole_to_mass_fraction(mole_fraction, additive_molar_mass, host_molar_mass):
+    "Mass fraction of additives with the mole fractions, against the host"
+    x = np.asarray(mole_fraction, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        additive = x * additive_molar_mass
+        return additive / (additive + (1 - x) * host_molar_mass)
+
+def to_mass_fraction(values, unit, additive_molar_mass, host_molar_mass, density=None):
+    "Amounts in a unit (see UNITS) as mass fractions. density is the density of the host in g/cm^3"
+    _check_unit(unit, density)
+    values = np.asarray(values, dtype=np.float64)
+    if unit == MASS_FRACTION:
+        return values
+    if unit == WEIGHT_PERCENT:
+        return values / 100
+    if unit == MOLE_FRACTION:
+        return mole_to_mass_fraction(values, additive_molar_mass, host_molar_mass)
+    if unit == MOLE_PERCENT:
+        return mole_to_mass_fraction(values / 100, additive_molar_mass, host_molar_mass)
+    # Mass of additive per cm^3 over the mass of the host per cm^3
+    moles = values / 1000 if unit == MOLARITY else values / AVOGADRO
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return moles * additive_molar_mass / density
+
+def from_mass_fraction(mass_fraction, unit, additive_molar_mass, host_molar_mass, density=None):
+    "Mass fractions in a unit (see UNITS). density is the density of the host in g/cm^3"
+    _check_unit(unit, density)
+    w = np.asarray(mass_fraction, dtype=np.float64)
+    if unit == MASS_FRACTION:
+        return w
+    if unit == WEIGHT_PERCENT:
+        return w * 100
+    if unit == MOLE_FRACTION:
+        return mass_to_mole_fraction(w, additive_molar_mass, host_molar_mass)
+    if unit == MOLE_PERCENT:
+        return mass_to_mole_fraction(w, additive_molar_mass, host_molar_mass) * 100
+    with np.errstate(divide="ignore", invalid="ignore"):
+        moles = w * density / additive_molar_mass
+    return moles * 1000 if unit == MOLARITY else moles * AVOGADRO
+
+def convert(values, from_unit, to_unit, additive_molar_mass, host_molar_mass, density=None):
+    "Amounts converted from one unit to another (see UNITS). Works element by element on arrays"
+    mass_fraction = to_mass_fraction(values, from_unit, additive_molar_mass, host_molar_mass, density)
+    return from_mass_fraction(mass_fraction, to_unit, additive_molar_mass, host_molar_mass, density)
+
+
+class AdditiveAmounts:
+    """Amounts of the additives (or impurities) of many compositions in other units.
+
+    arrays: CompositionArrays. The mass fraction of every additive is taken from the arrays
+    molar_masses: dictionary from the site to a dictionary from the abbreviation to the molar mass.
+                  Read from the reference data given by path_to_reference_data if None
+    """
+    def __init__(self, arrays, molar_masses=None, path_to_reference_data="local"):
+        self.arrays = arrays
+        self.molar_masses = get_molar_masses(path_to_reference_data) if molar_masses is None else molar_masses
+        self._mass_codes = {}
+
+    def mass_codes(self, site):
+        "The molar mass of every ion code in the ion table in a site, nan where it is not known"
+        values = self._mass_codes.get(site)
+        if values is None:
+            masses = self.molar_masses.get(site, {})
+            ions = self.arrays.ions
+            values = np.array([masses.get(ions[code], np.nan) for code in range(len(ions))], dtype=np.float64)
+            self._mass_codes[site] = values
+        return values
+
+    def host_molar_mass(self):
+        "The molar mass of one formula unit of the host of every composition. nan if a coefficient or molar mass is not known"
+        total = np.zeros(len(self.arrays))
+        for site in composition_arrays.ION_SITES:
+            site_arrays = self.arrays.sites[site]
+            values = site_arrays.coefficients * self.mass_codes(site)[site_arrays.codes]
+            total += np.bincount(site_arrays.rows, weights=values, minlength=len(site_arrays))
+        total[total <= 0] = np.nan
+        return total
+
+    def additive_molar_mass(self, site="additives"):
+        "The molar mass of every additive (or impurity), with one value per additive"
+        return self.mass_codes(site)[self.arrays.sites[site].codes]
+
+    def convert(self, to_unit, site="additives", density=None):
+        """The amount of every additive (or impurity with site='impurities') in a unit, with one value per additive.
+        density is the density of the host in g/cm^3, one value or one value per composition"""
+        site_arrays = self.arrays.sites[site]
+        rows = site_arrays.rows
+        if density is not None and np.ndim(density) > 0:
+            density = np.asarray(density, dtype=np.float64)[rows]
+        return from_mass_fraction(site_arrays.coefficients, to_unit, self.additive_molar_mass(site),
+                                  self.host_molar_mass()[rows], density)
+
+    def table(self, site="additives", units=(MASS_FRACTION, MOLE_FRACTION), density=None):
+        "DataFrame with one row per additive: the composition, the abbreviation, the molar masses, and the amount in the units"
+        site_arrays = self.arrays.sites[site]
+        ions = self.arrays.ions
+        table = pd.DataFrame({
+            "composition": site_arrays.rows,
+            "abbreviation": [ions[code] for code in site_arrays.codes],
+            "molar_mass": self.additive_molar_mass(site),
+            "host_molar_mass": self.host_molar_mass()[site_arrays.rows],
+            })
+        for unit in units:
+            table[unit] = self.convert(unit, site=site, density=density)
+        return table
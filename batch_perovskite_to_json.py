@@ -0,0 +1,463 @@
+"""
+Functionality for converting many perovskite compositions to .Json in one go
+
+BatchConverter takes a table (pandas DataFrame) or an iterable of records (dictionaries)
+where every row holds the arguments to PerovskiteToJson for one composition.
+All rows are converted against one set of reference data, and the formatting of
+ions, formulas, and complementary ion data is cached between rows,
+so repeated ions and compositions are only formatted once per batch.
+The output is identical to constructing one PerovskiteToJson object per row.
+
+ParallelConverter splits the input into chunks and converts them in a pool of processes,
+with one BatchConverter (and one set of reference data) per worker process.
+"""
+
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+
+from perovskite_to_json import PerovskiteToJson
+from Utilities import incremental_build
+from Utilities import json_lines
+from Utilities import nomad_archive
+from Utilities import instrumentation
+from Utilities import serializers
+
+# Arguments to PerovskiteToJson that are lists
+LIST_ARGUMENTS = (
+    "additives",
+    "impurities",
+    "additives_abbreviations",
+    "additives_concentrations",
+    "additives_mass_fractions",
+    "impurities_abbreviations",
+    "impurities_concentrations",
+    "impurities_mass_fractions",
+    "a_ions_abbreviations",
+    "a_coefficients",
+    "b_ions_abbreviations",
+    "b_coefficients",
+    "x_ions_abbreviations",
+    "x_coefficients",
+    )
+
+# Arguments to PerovskiteToJson that are single values
+SINGLE_ARGUMENTS = (
+    "composition_estimate",
+    "sample_type",
+    "dimensionality",
+    "bandgap",
+    )
+
+# Lists of abbreviations, and the lists with one value for every abbreviation.
+# Empty abbreviations are dropped together with the values in the same positions
+ABBREVIATION_ARGUMENTS = {
+    "additives_abbreviations": ("additives_concentrations", "additives_mass_fractions"),
+    "impurities_abbreviations": ("impurities_concentrations", "impurities_mass_fractions"),
+    "a_ions_abbreviations": ("a_coefficients",),
+    "b_ions_abbreviations": ("b_coefficients",),
+    "x_ions_abbreviations": ("x_coefficients",),
+    }
+
+
+def to_list(value, separator=";"):
+    "Convert a cell to a list. Strings are split at separator, and missing values (None, NaN, blank strings) give an empty list"
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple, np.ndarray, pd.Series)):
+        return list(value)
+    if isinstance(value, str):
+        if value.strip() == "":
+            return []
+        return [item.strip() for item in value.split(separator)]
+    if pd.isna(value):
+        return []
+    return [value]
+
+def drop_empty_abbreviations(arguments):
+    """Remove empty abbreviations from the list arguments, and the values in the same positions in the lists
+    paired with them (see ABBREVIATION_ARGUMENTS), e.g. Cs;;MA with 0.05;0.1;0.95 gives Cs;MA with 0.05;0.95"""
+    for name, paired_names in ABBREVIATION_ARGUMENTS.items():
+        empty = {i for i, abbreviation in enumerate(arguments[name]) if str(abbreviation).strip() == ""}
+        if not empty:
+            continue
+        for list_name in (name,) + paired_names:
+            arguments[list_name] = [value for i, value in enumerate(arguments[list_name]) if i not in empty]
+    return arguments
+
+def get_list_arguments(record, column_mapping=None, separator=";"):
+    """The list arguments to PerovskiteToJson in a record, with empty abbreviations dropped.
+    column_mapping maps argument names to column names in the record, as in BatchConverter"""
+    column_mapping = {} if column_mapping is None else column_mapping
+    arguments = {name: to_list(record.get(column_mapping.get(name, name)), separator) for name in LIST_ARGUMENTS}
+    return drop_empty_abbreviations(arguments)
+
+
+
+class BatchConverter:
+    """Convert many perovskite compositions with one set of reference data.
+
+    column_mapping maps argument names of PerovskiteToJson to column names in the input,
+    e.g. {"a_ions_abbreviations": "A-ions"}. Arguments not in the mapping are looked up by their own name.
+    List arguments can be given as lists, or as strings separated by separator, e.g. "Cs; FA; MA".
+    Missing values (None, NaN, or missing columns) are treated as not given.
+    timer is an optional StageTimer (see Utilities/instrumentation.py) that sums the time of each stage over all records.
+    serializer is the Serializer (see Utilities/serializers.py) for the Json strings, or a backend name, e.g. "orjson".
+    By default the Json strings are indented as the files written by PerovskiteToJson.
+    """
+    def __init__(self, column_mapping=None, path_to_reference_data="local", separator=";", cache_size=100000, timer=None,
+                 serializer=None):
+        self.column_mapping = {} if column_mapping is None else dict(column_mapping)
+        self.path_to_reference_data = path_to_reference_data
+        self.separator = separator
+        self.cache_size = cache_size
+        self.timer = timer
+        self.serializer = serializers.get_serializer(serializer)
+
+        # One perovskite object that holds the reference data and does the formatting for all rows
+        self.perovskite = PerovskiteToJson(path_to_reference_data=self.path_to_reference_data, save=False, timer=self.timer)
+
+        # Reference data for the ions in the different sites
+        self.reference_data = {
+            "a": self.perovskite.reference_data_a_ions,
+            "b": self.perovskite.reference_data_b_ions,
+            "x": self.perovskite.reference_data_x_ions,
+            }
+
+        # Caches for formatted data shared between rows
+        self.site_cache = {}
+        self.formula_cache = {}
+        self.ion_cache = {}
+
+    def _cache_put(self, cache, key, value):
+        "Add a value to a cache. The cache is emptied when it reaches cache_size to keep memory bounded"
+        if len(cache) >= self.cache_size:
+            cache.clear()
+        cache[key] = value
+        return value
+
+    def stage(self, name):
+        "Context for timing a stage with the timer. Does nothing if there is no timer"
+        if self.timer is None:
+            return instrumentation.NULL_STAGE
+        return self.timer.stage(name)
+
+    def get_arguments(self, record):
+        "The arguments to PerovskiteToJson for one record"
+        arguments = get_list_arguments(record, self.column_mapping, self.separator)
+
+        for name in SINGLE_ARGUMENTS:
+            column = self.column_mapping.get(name, name)
+            value = record.get(column, "")
+            if value is None or (not isinstance(value, str) and pd.isna(value)):
+                value = ""
+            arguments[name] = value
+
+        return arguments
+
+    def format_site(self, ions, coefficients):
+        "Clean and sort the ions and coefficients of one site. Returns tuples"
+        key = (tuple(str(ion) for ion in ions), tuple(str(coef) for coef in coefficients))
+        site = self.site_cache.get(key)
+        if site is None:
+            perovskite = self.perovskite
+            ions = perovskite.clean_ions(ions)
+            coefficients = perovskite.clean_coefficients(coefficients)
+            ions, coefficients = perovskite.sort_ions(ions, coefficients)
+            site = self._cache_put(self.site_cache, key, (tuple(ions), tuple(coefficients)))
+        return site
+
+    def format_formulas(self, a_site, b_site, x_site):
+        "Short and long formula for formatted sites"
+        key = (a_site, b_site, x_site)
+        formulas = self.formula_cache.get(key)
+        if formulas is None:
+            perovskite = self.perovskite
+            perovskite.a_ions_abbreviations, perovskite.a_coefficients = list(a_site[0]), list(a_site[1])
+            perovskite.b_ions_abbreviations, perovskite.b_coefficients = list(b_site[0]), list(b_site[1])
+            perovskite.x_ions_abbreviations, perovskite.x_coefficients = list(x_site[0]), list(x_site[1])
+            formulas = self._cache_put(self.formula_cache, key, (perovskite.get_short_formula(), perovskite.get_long_formula()))
+        return formulas
+
+    def format_ions(self, site, formatted_site):
+        "Ions of one site complemented with reference data"
+        ions = []
+        with self.stage("format_ions"):
+            for ion, coef in zip(*formatted_site):
+                key = (site, ion, coef)
+                data_dict = self.ion_cache.get(key)
+                if data_dict is None:
+                    data_dict = self.perovskite.get_ion_complementary_data(ion, ion_data=self.reference_data[site], coef=coef)
+                    self._cache_put(self.ion_cache, key, data_dict)
+                # Every row gets its own copy so that the output of different rows are independent
+                ions.append(dict(data_dict))
+        return ions
+
+    def convert_record(self, record):
+        "Convert one record to a dictionary with the same structure as the Json file"
+        perovskite = self.perovskite
+        with self.stage("clean_input"):
+            arguments = self.get_arguments(record)
+
+        # Clean and sort the ions
+        with self.stage("sort"):
+            a_site = self.format_site(arguments["a_ions_abbreviations"], arguments["a_coefficients"])
+            b_site = self.format_site(arguments["b_ions_abbreviations"], arguments["b_coefficients"])
+            x_site = self.format_site(arguments["x_ions_abbreviations"], arguments["x_coefficients"])
+
+        # Perovskite short and long composition
+        with self.stage("formulas"):
+            short_form, long_form = self.format_formulas(a_site, b_site, x_site)
+
+        # Additives and impurities
+        with self.stage("clean_input"):
+            perovskite.additives_abbreviations = perovskite.clean_ions(arguments["additives_abbreviations"])
+            perovskite.additives_concentrations = perovskite.format_list_of_numbers(arguments["additives_concentrations"])
+            perovskite.additives_mass_fractions = perovskite.format_list_of_numbers(arguments["additives_mass_fractions"])
+            perovskite.impurities_abbreviations = perovskite.clean_ions(arguments["impurities_abbreviations"])
+            perovskite.impurities_concentrations = perovskite.format_list_of_numbers(arguments["impurities_concentrations"])
+            perovskite.impurities_mass_fractions = perovskite.format_list_of_numbers(arguments["impurities_mass_fractions"])
+        with self.stage("sort"):
+            perovskite.additives_sort()
+            perovskite.impurities_sort()
+
+        perovskite.additives = list(arguments["additives"])
+        perovskite.format_additives_with_complementary_data(perovskite.additives,
+                                                          perovskite.additives_abbreviations,
+                                                          perovskite.reference_data_additive_and_impurities,
+                                                          perovskite.additives_concentrations,
+                                                          perovskite.additives_mass_fractions,
+                                                          )
+        perovskite.impurities = list(arguments["impurities"])
+        perovskite.format_additives_with_complementary_data(perovskite.impurities,
+                                                          perovskite.impurities_abbreviations,
+                                                          perovskite.reference_data_additive_and_impurities,
+                                                          perovskite.impurities_concentrations,
+                                                          perovskite.impurities_mass_fractions,
+                                                          )
+
+        # Single values
+        with self.stage("format_values"):
+            perovskite.composition_estimate = perovskite.format_singel_string_values(arguments["composition_estimate"])
+            perovskite.sample_type = perovskite.format_singel_string_values(arguments["sample_type"])
+            perovskite.dimensionality = perovskite.format_singel_string_values(arguments["dimensionality"])
+            perovskite.bandgap = arguments["bandgap"]
+            perovskite.format_bandgap()
+
+        # Formatted ions and formulas
+        perovskite.short_form = short_form
+        perovskite.long_form = long_form
+        perovskite.a_ions = self.format_ions("a", a_site)
+        perovskite.b_ions = self.format_ions("b", b_site)
+        perovskite.x_ions = self.format_ions("x", x_site)
+
+        return perovskite.to_dict()
+
+    def iter_convert(self, records, as_json=False):
+        "Convert records one at a time. Yields dictionaries, or Json strings if as_json is True"
+        for record in iter_records(records):
+            data = self.convert_record(record)
+            if as_json:
+                with self.stage("convert_to_json"):
+                    data = self.serializer.dumps(data)
+                yield data
+            else:
+                yield data
+
+    def convert(self, records, as_json=False):
+        "Convert all records. Returns a list of dictionaries, or of Json strings if as_json is True"
+        return list(self.iter_convert(records, as_json=as_json))
+
+    def build_folder(self, records, folder, key=None, serializer=None):
+        """Convert the records to .json files in a folder, converting only new and changed records since the last run,
+        and remove the files of records that are gone (see Utilities/incremental_build.py).
+        key is a column with a unique key for every record, used for the file names"""
+        builder = incremental_build.IncrementalBuilder(folder, converter=self, key=key, serializer=serializer)
+        return builder.build(records)
+
+    def write_json_lines(self, records, file_path, compress=None, append=False, serializer=None):
+        """Convert the records and stream them to a JSON Lines file, one composition per line.
+        Files ending with .gz are gzip compressed. serializer is a compact Serializer or a backend name for the lines.
+        Returns the number of compositions written"""
+        return json_lines.write_json_lines(self.iter_convert(records), file_path, compress=compress, append=append,
+                                           serializer=serializer)
+
+    def write_nomad_archives(self, records, folder, prefix="upload", max_size=1 << 30, compresslevel=6,
+                             naming=nomad_archive.index_name, serializer=None):
+        """Convert the records and stream them as .archive.json files into zip archives of at most max_size bytes
+        for upload to NOMAD (see Utilities/nomad_archive.py). Returns the paths to the archives"""
+        return nomad_archive.write_nomad_archives(self.iter_convert(records), folder, prefix=prefix, max_size=max_size,
+                                                  compresslevel=compresslevel, naming=naming, serializer=serializer)
+
+
+def iter_records(records):
+    "Iterate over the rows of a DataFrame, or over an iterable of records, as dictionaries"
+    if isinstance(records, pd.DataFrame):
+        columns = list(records.columns)
+        for values in zip(*[records[column] for column in columns]):
+            yield dict(zip(columns, values))
+    else:
+        yield from records
+
+
+# The converter of a worker process in ParallelConverter. Created once per process by _init_worker
+_worker_converter = None
+
+def _init_worker(column_mapping, path_to_reference_data, separator, cache_size, timed=False, serializer=None):
+    "Load the reference data once in every worker process"
+    global _worker_converter
+    _worker_converter = BatchConverter(column_mapping=column_mapping, 
+                                       path_to_reference_data=path_to_reference_data, 
+                                       separator=separator,
+                                       cache_size=cache_size,
+                                       timer=instrumentation.StageTimer() if timed else None,
+                                       serializer=serializer)
+
+def _convert_chunk(records, as_json):
+    """Convert one chunk of records in a worker process.
+    Returns the results and the timings of the chunk (None if the worker is not timed)"""
+    results = _worker_converter.convert(records, as_json=as_json)
+    timer = _worker_converter.timer
+    if timer is None:
+        return results, None
+    timings = timer.as_dict()
+    timer.reset()
+    return results, timings
+
+
+class ParallelConverter:
+    """Convert many perovskite compositions in parallel in a pool of processes.
+
+    The input is split into chunks of chunk_size records that are converted by BatchConverter objects 
+    in workers processes (by default one per core). The results are returned in the same order as the input
+    and are identical to the results of BatchConverter.
+    progress is an optional function called as progress(converted, total) after every chunk,
+    where total is None if the number of records is not known in advance.
+    timer is an optional StageTimer that collects the timings from all worker processes, 
+    i.e. the total time of a stage is summed over the workers.
+    serializer is the Serializer for the Json strings, as in BatchConverter.
+    """
+    def __init__(self, column_mapping=None, path_to_reference_data="local", separator=";", cache_size=100000, 
+                 workers=None, chunk_size=1000, progress=None, timer=None, serializer=None):
+        self.column_mapping = column_mapping
+        self.path_to_reference_data = path_to_reference_data
+        self.separator = separator
+        self.cache_size = cache_size
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.timer = timer
+        self.serializer = serializers.get_serializer(serializer)
+
+    def _chunk_done(self, future, converted, total):
+        "Results of a finished chunk. Adds the timings of the chunk to the timer and reports the progress"
+        results, timings = future.result()
+        if timings is not None and self.timer is not None:
+            self.timer.merge(timings)
+        if self.progress is not None:
+            self.progress(converted + len(results), total)
+        return results
+
+    def iter_chunks(self, records):
+        "Split the records into lists of chunk_size records"
+        records = iter_records(records)
+        while True:
+            chunk = list(islice(records, self.chunk_size))
+            if not chunk:
+                break
+            yield chunk
+
+    def iter_convert(self, records, as_json=False):
+        """Convert the records and yield the results in the same order as the input.
+        At most a few chunks per worker are in flight at a time, so the input can be a long iterator"""
+        total = len(records) if hasattr(records, "__len__") else None
+        converted = 0
+        pending = deque()
+        chunks = self.iter_chunks(records)
+
+        with ProcessPoolExecutor(max_workers=self.workers, 
+                                 initializer=_init_worker, 
+                                 initargs=(self.column_mapping, self.path_to_reference_data, self.separator, self.cache_size,
+                                           self.timer is not None, self.serializer),
+                                 ) as executor:
+            for chunk in chunks:
+                pending.append(executor.submit(_convert_chunk, chunk, as_json))
+                if len(pending) < 2 * self.workers:
+                    continue
+                
+                # Wait for the oldest chunk to keep the order of the input
+                results = self._chunk_done(pending.popleft(), converted, total)
+                converted += len(results)
+                yield from results
+
+            while pending:
+                results = self._chunk_done(pending.popleft(), converted, total)
+                converted += len(results)
+                yield from results
+
+    def convert(self, records, as_json=False):
+        "Convert all records. Returns a list of dictionaries, or of Json strings if as_json is True"
+        return list(self.iter_convert(records, as_json=as_json))
+
+    def write_json_lines(self, records, file_path, compress=None, append=False, serializer=None):
+        """Convert the records and stream them to a JSON Lines file, one composition per line.
+        Files ending with .gz are gzip compressed. serializer is a compact Serializer or a backend name for the lines.
+        Returns the number of compositions written"""
+        return json_lines.write_json_lines(self.iter_convert(records), file_path, compress=compress, append=append,
+                                           serializer=serializer)
+
+    def write_nomad_archives(self, records, folder, prefix="upload", max_size=1 << 30, compresslevel=6,
+                             naming=nomad_archive.index_name, serializer=None):
+        """Convert the records and stream them as .archive.json files into zip archives of at most max_size bytes
+        for upload to NOMAD (see Utilities/nomad_archive.py). Returns the paths to the archives"""
+        return nomad_archive.write_nomad_archives(self.iter_convert(records), folder, prefix=prefix, max_size=max_size,
+                                                  compresslevel=compresslevel, naming=naming, serializer=serializer)
+
+
+# Basic check
+if __name__ == "__main__":
+    import time
+
+    # Test data
+    compositions = pd.DataFrame({
+        "A-ions": ["Cs; MA; FA", "PEA", "MA"],
+        "A-coefficients": ["0.05; 0.79; 0.16", "2", ""],
+        "B-ions": ["Pb", "Pb", "Sn; Pb"],
+        "B-coefficients": ["1", "1", "0.5; 0.5"],
+        "X-ions": ["Br; I", "I", "I"],
+        "X-coefficients": ["0.5; 2.5", "4", "3"],
+        "bandgap": [1.63, 2.38, np.nan],
+        "dimensionality": ["3D", "2D", "3D"],
+        })
+    column_mapping = {
+        "a_ions_abbreviations": "A-ions",
+        "a_coefficients": "A-coefficients",
+        "b_ions_abbreviations": "B-ions",
+        "b_coefficients": "B-coefficients",
+        "x_ions_abbreviations": "X-ions",
+        "x_coefficients": "X-coefficients",
+        }
+
+    converter = BatchConverter(column_mapping=column_mapping)
+    start = time.perf_counter()
+    results = converter.convert(pd.concat([compositions] * 1000, ignore_index=True))
+    print(f"{len(results)} compositions in {time.perf_counter() - start:.3f} s")
+    for data in results[:3]:
+        print(data["data"]["long_form"])
+
+    # An empty slot in a list of ions drops the coefficient in the same position
+    record = {"A-ions": "Cs;;MA", "A-coefficients": "0.05;0.1;0.95", "B-ions": "Pb", "X-ions": "I", "X-coefficients": "3"}
+    ions = converter.convert_record(record)["data"]["ions_a_site"]
+    assert [(ion["abbreviation"], ion["coefficient"]) for ion in ions] == [("Cs", "0.05"), ("MA", "0.95")]
+
+    # The same conversion in parallel
+    converter = ParallelConverter(column_mapping=column_mapping, chunk_size=500, 
+                                  progress=lambda converted, total: print(f"{converted}/{total}"))
+    start = time.perf_counter()
+    parallel_results = converter.convert(pd.concat([compositions] * 1000, ignore_index=True))
+    print(f"{len(parallel_results)} compositions in {time.perf_counter() - start:.3f} s")
+    print(f"Same result as serial conversion: {parallel_results == results}")
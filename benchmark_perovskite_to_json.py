@@ -0,0 +1,383 @@
+"""
+Benchmarks for the conversion of perovskite compositions to .Json
+
+Times the steps of the conversion pipeline on generated compositions:
+reading the reference tables, looking up ions in the reference tables, the long and short formula,
+convert_to_json, save_data, constructing PerovskiteToJson objects end to end, BatchConverter,
+and the filtering of the values in the dropdown menus of the GUI.
+Every step is run for each of the given number of compositions (1, 1000, and 100000 by default).
+
+The benchmarks only use the reference data distributed with the code, so they run offline.
+The results are written to a Json file, and can be compared with the results from an earlier run:
+
+    python benchmark_perovskite_to_json.py --output benchmark_results.json --compare benchmark_results_old.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from perovskite_to_json import PerovskiteToJson
+from batch_perovskite_to_json import BatchConverter
+from Utilities import reference_data
+from Utilities import filepaths
+from Utilities.CTkScrollableDropdown.search_index import SearchIndex
+
+DEFAULT_SIZES = (1, 1000, 100000)
+
+
+def make_compositions(n, seed=0):
+    "n compositions with ions, coefficients, additives and impurities drawn at random from the reference data"
+    a_table, b_table, x_table, additive_table = reference_data.get_reference_tables("local")
+    a_ions = [ion for ion in a_table["Abbreviation"] if isinstance(ion, str)]
+    b_ions = [ion for ion in b_table["Abbreviation"] if isinstance(ion, str)]
+    x_ions = [ion for ion in x_table["Abbreviation"] if isinstance(ion, str)]
+    additives = [ion for ion in additive_table["Abbreviation"] if isinstance(ion, str)]
+
+    rng = random.Random(seed)
+    compositions = []
+    for _ in range(n):
+        n_a = rng.choice((1, 1, 2, 3))
+        n_b = rng.choice((1, 1, 1, 2))
+        n_x = rng.choice((1, 2, 2, 3))
+        composition = {
+            "composition_estimate": rng.choice(("Estimated from precursor solutions", "Hard to estimate", "")),
+            "sample_type": rng.choice(("Polycrystalline film", "Single crystal", "")),
+            "dimensionality": rng.choice(("3D", "2D", "")),
+            "bandgap": rng.choice((round(rng.uniform(1.2, 3.0), 2), "")),
+            "a_ions_abbreviations": rng.sample(a_ions, n_a),
+            "a_coefficients": [round(rng.uniform(0.05, 1), 2) for _ in range(n_a)],
+            "b_ions_abbreviations": rng.sample(b_ions, n_b),
+            "b_coefficients": [round(1 / n_b, 2)] * n_b,
+            "x_ions_abbreviations": rng.sample(x_ions, n_x),
+            "x_coefficients": [round(3 / n_x, 2)] * n_x,
+            "additives": [],
+            "impurities": [],
+            }
+        if rng.random() < 0.2:
+            composition["additives_abbreviations"] = [rng.choice(additives)]
+            composition["additives_mass_fractions"] = [round(rng.uniform(0.001, 0.05), 3)]
+        if rng.random() < 0.1:
+            composition["impurities_abbreviations"] = [rng.choice(additives)]
+            composition["impurities_concentrations"] = [1e13]
+        compositions.append(composition)
+    return compositions
+
+def make_perovskites(compositions):
+    "PerovskiteToJson objects for the compositions, without saving any files"
+    return [PerovskiteToJson(save=False, **composition) for composition in compositions]
+
+def measure(function, size, repeat=3):
+    """Run function repeat times and return the timings.
+    function is called without arguments and should process size items"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return {
+        "size": size,
+        "repeat": repeat,
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "max": max(timings),
+        "per_item": min(timings) / size if size else None,
+        }
+
+def repeats_for(size):
+    "Fewer repeats for the large runs"
+    if size >= 100000:
+        return 1
+    if size >= 1000:
+        return 3
+    return 10
+
+
+# Benchmarks. Each function returns a dictionary with the name of the benchmark and its timings
+
+def benchmark_reference_tables():
+    "Reading the four reference tables, with and without the shared cache"
+    paths = filepaths.paths_to_data(origin="local")
+    results = []
+
+    def read_excel():
+        for path in paths:
+            pd.read_excel(path)
+    results.append(dict(name="reference_tables.read_excel", **measure(read_excel, len(paths), repeat=3)))
+
+    def read_cold():
+        reference_data.clear()
+        reference_data.get_reference_tables("local")
+    results.append(dict(name="reference_tables.cold", **measure(read_cold, len(paths), repeat=5)))
+
+    def read_cached():
+        reference_data.get_reference_tables("local")
+    results.append(dict(name="reference_tables.cached", **measure(read_cached, len(paths), repeat=100)))
+    return results
+
+def benchmark_lookups(perovskites, size):
+    "get_data_from_ion_datatables for all ions in the compositions, for a column in the index and one outside it"
+    perovskite = PerovskiteToJson(save=False)
+    tables = reference_data.get_reference_tables("local")
+    queries = []
+    for item in perovskites:
+        queries.extend((ion, tables[0]) for ion in item.a_ions_abbreviations)
+        queries.extend((ion, tables[1]) for ion in item.b_ions_abbreviations)
+        queries.extend((ion, tables[2]) for ion in item.x_ions_abbreviations)
+
+    results = []
+    for name, column in (("lookup.indexed_column", "IUPAC_name"), ("lookup.other_column", "Chemical_formula")):
+        # Looking up columns outside the index scans the table, so large runs are limited to the first 10000 queries
+        selected = queries if column in reference_data.INDEX_COLUMNS else queries[:10000]
+        def lookup():
+            for ion, table in selected:
+                perovskite.get_data_from_ion_datatables(ion, table, column)
+        results.append(dict(name=name, **measure(lookup, len(selected), repeat=repeats_for(size))))
+    return results
+
+def benchmark_formulas(perovskites, size):
+    "get_long_formula and get_short_formula"
+    def long_formula():
+        for perovskite in perovskites:
+            perovskite.get_long_formula()
+    def short_formula():
+        for perovskite in perovskites:
+            perovskite.get_short_formula()
+    return [
+        dict(name="formula.long", **measure(long_formula, size, repeat=repeats_for(size))),
+        dict(name="formula.short", **measure(short_formula, size, repeat=repeats_for(size))),
+        ]
+
+def benchmark_convert_to_json(perovskites, size):
+    "convert_to_json, the first time (with the lookup of the ion data) and again (only the serialization)"
+    first = make_perovskites_like(perovskites)
+    def convert_first():
+        for perovskite in first:
+            perovskite.convert_to_json()
+    def convert_again():
+        for perovskite in perovskites:
+            perovskite.convert_to_json()
+    results = [dict(name="convert_to_json.first", **measure(convert_first, size, repeat=1))]
+    convert_again()
+    results.append(dict(name="convert_to_json.again", **measure(convert_again, size, repeat=repeats_for(size))))
+    return results
+
+def make_perovskites_like(perovskites):
+    "New objects for the same compositions, where nothing has been evaluated yet"
+    return [PerovskiteToJson(save=False,
+                             composition_estimate=item.composition_estimate,
+                             sample_type=item.sample_type,
+                             dimensionality=item.dimensionality,
+                             bandgap=item.bandgap,
+                             a_ions_abbreviations=item.a_ions_abbreviations,
+                             a_coefficients=item.a_coefficients,
+                             b_ions_abbreviations=item.b_ions_abbreviations,
+                             b_coefficients=item.b_coefficients,
+                             x_ions_abbreviations=item.x_ions_abbreviations,
+                             x_coefficients=item.x_coefficients,
+                             additives_abbreviations=item.additives_abbreviations,
+                             additives_mass_fractions=item.additives_mass_fractions,
+                             additives_concentrations=item.additives_concentrations,
+                             impurities_abbreviations=item.impurities_abbreviations,
+                             impurities_mass_fractions=item.impurities_mass_fractions,
+                             impurities_concentrations=item.impurities_concentrations,
+                             additives=[],
+                             impurities=[],
+                             ) for item in perovskites]
+
+def benchmark_save_data(perovskites, size):
+    "save_data, one file per composition in a temporary folder"
+    folder = tempfile.mkdtemp(prefix="perovskite_benchmark_")
+    try:
+        for perovskite in perovskites:
+            perovskite.json
+        def save():
+            for i, perovskite in enumerate(perovskites):
+                perovskite.save_data(os.path.join(folder, f"composition_{i}.json"))
+        return [dict(name="save_data", **measure(save, size, repeat=repeats_for(size)))]
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+def benchmark_end_to_end(compositions, size):
+    "PerovskiteToJson from the arguments to the Json string, one object per composition, and BatchConverter"
+    def end_to_end():
+        for composition in compositions:
+            PerovskiteToJson(save=False, **composition).json
+    def batch():
+        BatchConverter().convert(compositions, as_json=True)
+    return [
+        dict(name="end_to_end.perovskite_to_json", **measure(end_to_end, size, repeat=repeats_for(size))),
+        dict(name="end_to_end.batch_converter", **measure(batch, size, repeat=repeats_for(size))),
+        ]
+
+def dropdown_queries(values, n_queries=200, seed=0):
+    "Strings typed into a dropdown menu: the first characters of the values, with some typing errors"
+    rng = random.Random(seed)
+    queries = []
+    for value in rng.choices(values, k=n_queries):
+        query = value[:rng.randint(1, max(1, min(len(value), 6)))]
+        if len(query) > 2 and rng.random() < 0.3:
+            position = rng.randrange(len(query))
+            query = query[:position] + rng.choice("abcdefghijklmnopqrstuvwxyz") + query[position + 1:]
+        queries.append(query)
+    return queries
+
+def benchmark_dropdown(sizes):
+    """Filtering the values of a dropdown menu while typing.
+    The search index is timed for the ion abbreviations and for generated lists of each size.
+    live_update in CTkScrollableDropdown is timed if a display is available"""
+    a_ions = [ion for ion in reference_data.get_reference_tables("local")[0]["Abbreviation"] if isinstance(ion, str)]
+    value_lists = [("a_ions", a_ions)]
+    for size in sizes:
+        values = [a_ions[i % len(a_ions)] + ("" if i < len(a_ions) else str(i)) for i in range(size)]
+        value_lists.append((str(size), values))
+
+    results = []
+    for label, values in value_lists:
+        queries = dropdown_queries(values)
+        def build():
+            SearchIndex(values)
+        results.append(dict(name="dropdown.search_index.build", values=label, **measure(build, len(values), repeat=repeats_for(len(values)))))
+        def search():
+            index = SearchIndex(values)
+            for query in queries:
+                index.search(query)
+        results.append(dict(name="dropdown.search_index.search", values=label, **measure(search, len(queries), repeat=repeats_for(len(values)))))
+    results.extend(benchmark_live_update(a_ions))
+    return results
+
+def benchmark_live_update(values):
+    "live_update in CTkScrollableDropdown, in the normal and the virtual mode"
+    try:
+        import customtkinter
+        from Utilities.CTkScrollableDropdown import CTkScrollableDropdown
+        root = customtkinter.CTk()
+    except Exception as error:
+        return [{"name": "dropdown.live_update", "skipped": f"No display available ({type(error).__name__})"}]
+
+    results = []
+    try:
+        queries = dropdown_queries(values, n_queries=50)
+        for virtual in (False, True):
+            combobox = customtkinter.CTkComboBox(root, values=[])
+            dropdown = CTkScrollableDropdown(combobox, values=list(values), autocomplete=True, virtual=virtual)
+            # Placing the dropdown includes a fade in animation of fixed length, which is not part of the filtering
+            dropdown.place_dropdown = lambda: None
+            def live_update():
+                for query in queries + [""]:
+                    dropdown.appear = True
+                    dropdown.live_update(query)
+                    root.update_idletasks()
+            name = "dropdown.live_update.virtual" if virtual else "dropdown.live_update"
+            results.append(dict(name=name, values="a_ions", **measure(live_update, len(queries) + 1, repeat=3)))
+            dropdown.destroy()
+    finally:
+        root.destroy()
+    return results
+
+
+def run(sizes, seed=0):
+    "Run all benchmarks and return the results"
+    results = benchmark_reference_tables()
+    for size in sizes:
+        compositions = make_compositions(size, seed=seed)
+        perovskites = make_perovskites(compositions)
+        size_results = []
+        size_results.extend(benchmark_lookups(perovskites, size))
+        size_results.extend(benchmark_formulas(perovskites, size))
+        size_results.extend(benchmark_convert_to_json(perovskites, size))
+        size_results.extend(benchmark_save_data(perovskites, size))
+        size_results.extend(benchmark_end_to_end(compositions, size))
+        for result in size_results:
+            result["compositions"] = size
+        results.extend(size_results)
+        print(f"Done with {size} compositions", file=sys.stderr)
+    results.extend(benchmark_dropdown(sizes))
+    return results
+
+def metadata(sizes, seed):
+    "Information about the run, so that results from different machines and versions can be told apart"
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "date": datetime.now(timezone.utc).isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "sizes": list(sizes),
+        "seed": seed,
+        }
+
+def result_key(result):
+    "Key that identifies a benchmark between runs"
+    return (result["name"], result.get("size"), result.get("compositions"), result.get("values"))
+
+def compare(results, baseline, tolerance=1.25):
+    """Compare results with the results of an earlier run.
+    Returns the benchmarks that are slower than the baseline by more than the factor tolerance"""
+    baseline_results = {result_key(result): result for result in baseline["results"] if "min" in result}
+    regressions = []
+    for result in results:
+        old = baseline_results.get(result_key(result))
+        if old is None or "min" not in result or old["min"] <= 0:
+            continue
+        ratio = result["min"] / old["min"]
+        if ratio > tolerance:
+            regressions.append({"name": result["name"], "size": result["size"], "ratio": ratio,
+                                "min": result["min"], "baseline_min": old["min"]})
+    return regressions
+
+def print_results(results):
+    for result in results:
+        label = " ".join(f"{key}={result[key]}" for key in ("compositions", "values") if key in result)
+        if "skipped" in result:
+            print(f"{result['name']:<36} {label:<18} skipped: {result['skipped']}")
+            continue
+        print(f"{result['name']:<36} {label:<18} n={result['size']:<8} min {result['min']:.4f} s, "
+              f"{1e6 * result['per_item']:.2f} us per item")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for the conversion of perovskite compositions to .Json")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="Number of compositions")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the generated compositions")
+    parser.add_argument("--output", default="benchmark_results.json", help="Json file for the results")
+    parser.add_argument("--compare", default=None, help="Json file with results from an earlier run")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="Slow down factor reported as a regression")
+    arguments = parser.parse_args()
+
+    results = run(arguments.sizes, seed=arguments.seed)
+    print_results(results)
+
+    report = {"metadata": metadata(arguments.sizes, arguments.seed), "results": results}
+    with open(arguments.output, "w") as outfile:
+        json.dump(report, outfile, indent=4)
+    print(f"Results written to {arguments.output}")
+
+    if arguments.compare is not None:
+        with open(arguments.compare, "r") as infile:
+            baseline = json.load(infile)
+        regressions = compare(results, baseline, tolerance=arguments.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression['name']} (n={regression['size']}) is {regression['ratio']:.2f} times slower")
+        if regressions:
+            sys.exit(1)
@@ -8,13 +8,15 @@ The background is described in the paper ...
 
 import math
 import os
+from functools import cached_property
 from itertools import zip_longest
 
 import pandas as pd
 import numpy as np
-import json
 
-from Utilities import filepaths
+from Utilities import reference_data
+from Utilities import instrumentation
+from Utilities import serializers
 
 class PerovskiteToJson:
     def __init__(
@@ -39,15 +41,17 @@ class PerovskiteToJson:
         x_coefficients=[],
         path_to_reference_data='local',       
         save_path="",
-        save=True):
+        save=True,
+        timer=None,
+        serializer=None):
 
         # initiate variables
         self.composition_estimate = composition_estimate
         self.sample_type = sample_type
         self.dimensionality = dimensionality
         self.bandgap = bandgap
-        self.additives = additives
-        self.impurities = impurities
+        self.additives_given = list(additives)
+        self.impurities_given = list(impurities)
         self.additives_abbreviations = additives_abbreviations
         self.additives_concentrations = additives_concentrations
         self.additives_mass_fractions = additives_mass_fractions
@@ -62,96 +66,155 @@ class PerovskiteToJson:
         self.x_coefficients = x_coefficients 
         self.path_to_reference_data = path_to_reference_data
         self.save_path = save_path
-        self.a_ions = []
-        self.b_ions = []
-        self.x_ions = []
-
-        # Enforce proper formatting of the ions
-        self.a_ions_abbreviations = self.clean_ions(self.a_ions_abbreviations)
-        self.b_ions_abbreviations = self.clean_ions(self.b_ions_abbreviations)
-        self.x_ions_abbreviations = self.clean_ions(self.x_ions_abbreviations)
-        
-        # Enforce proper formatting of the coefficients
-        self.a_coefficients = self.clean_coefficients(self.a_coefficients)
-        self.b_coefficients = self.clean_coefficients(self.b_coefficients)
-        self.x_coefficients = self.clean_coefficients(self.x_coefficients)
-        
-        # Enforce proper formatting additives and impurities
-        self.additives_abbreviations = self.clean_ions(self.additives_abbreviations)
-        self.additives_concentrations = self.format_list_of_numbers(self.additives_concentrations)
-        self.additives_mass_fractions = self.format_list_of_numbers(self.additives_mass_fractions)
-        self.impurities_abbreviations = self.clean_ions(self.impurities_abbreviations)
-        self.impurities_concentrations = self.format_list_of_numbers(self.impurities_concentrations)
-        self.impurities_mass_fractions = self.format_list_of_numbers(self.impurities_mass_fractions)       
+        # Optional StageTimer (see Utilities/instrumentation.py) that records the time of each stage
+        self.timer = timer
+        # Serializer for the Json (see Utilities/serializers.py). A backend name, e.g. "orjson", or None for the standard library
+        self.serializer = serializers.get_serializer(serializer)
+
+        with self.stage("clean_input"):
+            # Enforce proper formatting of the ions
+            self.a_ions_abbreviations = self.clean_ions(self.a_ions_abbreviations)
+            self.b_ions_abbreviations = self.clean_ions(self.b_ions_abbreviations)
+            self.x_ions_abbreviations = self.clean_ions(self.x_ions_abbreviations)
+            
+            # Enforce proper formatting of the coefficients
+            self.a_coefficients = self.clean_coefficients(self.a_coefficients)
+            self.b_coefficients = self.clean_coefficients(self.b_coefficients)
+            self.x_coefficients = self.clean_coefficients(self.x_coefficients)
+            
+            # Enforce proper formatting additives and impurities
+            self.additives_abbreviations = self.clean_ions(self.additives_abbreviations)
+            self.additives_concentrations = self.format_list_of_numbers(self.additives_concentrations)
+            self.additives_mass_fractions = self.format_list_of_numbers(self.additives_mass_fractions)
+            self.impurities_abbreviations = self.clean_ions(self.impurities_abbreviations)
+            self.impurities_concentrations = self.format_list_of_numbers(self.impurities_concentrations)
+            self.impurities_mass_fractions = self.format_list_of_numbers(self.impurities_mass_fractions)       
     
-        self.additives_sort()
-        self.impurities_sort()
-        
-        # Sort ions in alphabetic order
-        self.a_ions_abbreviations, self.a_coefficients = self.sort_ions(self.a_ions_abbreviations, self.a_coefficients)
-        self.b_ions_abbreviations, self.b_coefficients = self.sort_ions(self.b_ions_abbreviations, self.b_coefficients)
-        self.x_ions_abbreviations, self.x_coefficients = self.sort_ions(self.x_ions_abbreviations, self.x_coefficients)
-        
-        # Get perovskite short composition
-        self.short_form = self.get_short_formula()
-        
-        # Get perovskite long composition
-        self.long_form = self.get_long_formula()
-
-        # Read in file paths to reference data  
-        path_a_ions, path_b_ions, path_x_ions, path_additives = filepaths.paths_to_data(origin=self.path_to_reference_data)
-
-        # Read in reference data for the ions
-        self.reference_data_a_ions = pd.read_excel(path_a_ions)
-        self.reference_data_b_ions = pd.read_excel(path_b_ions)
-        self.reference_data_x_ions = pd.read_excel(path_x_ions)
-        self.reference_data_additive_and_impurities = pd.read_excel(path_additives)
+        with self.stage("sort"):
+            self.additives_sort()
+            self.impurities_sort()
+            
+            # Sort ions in alphabetic order
+            self.a_ions_abbreviations, self.a_coefficients = self.sort_ions(self.a_ions_abbreviations, self.a_coefficients)
+            self.b_ions_abbreviations, self.b_coefficients = self.sort_ions(self.b_ions_abbreviations, self.b_coefficients)
+            self.x_ions_abbreviations, self.x_coefficients = self.sort_ions(self.x_ions_abbreviations, self.x_coefficients)
+        
+        with self.stage("formulas"):
+            # Get perovskite short composition
+            self.short_form = self.get_short_formula()
+            
+            # Get perovskite long composition
+            self.long_form = self.get_long_formula()
 
-        # Format the dimensionality
-        self.dimensionality = self.format_singel_string_values(self.dimensionality)
-        
-        # Format the composition_estimate
-        self.composition_estimate = self.format_singel_string_values(self.composition_estimate)
-        
-        # Format the sample_type
-        self.sample_type = self.format_singel_string_values(self.sample_type)                     
+        with self.stage("format_values"):
+            # Format the dimensionality
+            self.dimensionality = self.format_singel_string_values(self.dimensionality)
+            
+            # Format the composition_estimate
+            self.composition_estimate = self.format_singel_string_values(self.composition_estimate)
+            
+            # Format the sample_type
+            self.sample_type = self.format_singel_string_values(self.sample_type)                     
+            
+            # Format the bandgap
+            self.format_bandgap()
         
-        # Format the bandgap
-        self.format_bandgap()
-        
-        # Format the data for the ions and complement with reference data
-        # A ions
-        self.format_ions_with_complementary_data(self.a_ions, self.a_ions_abbreviations, self.reference_data_a_ions, self.a_coefficients)
-
-        # B ions
-        self.format_ions_with_complementary_data(self.b_ions, self.b_ions_abbreviations, self.reference_data_b_ions, self.b_coefficients)
-
-        # X ions
-        self.format_ions_with_complementary_data(self.x_ions, self.x_ions_abbreviations, self.reference_data_x_ions, self.x_coefficients)
-    
-        # Format the additives
-        self.format_additives_with_complementary_data(self.additives, 
-                                                    self.additives_abbreviations, 
-                                                    self.reference_data_additive_and_impurities, 
-                                                    self.additives_concentrations,
-                                                    self.additives_mass_fractions,                                                     
-                                                    )
-    
-        # Format the impurities
-        self.format_additives_with_complementary_data(self.impurities, 
-                                                    self.impurities_abbreviations, 
-                                                    self.reference_data_additive_and_impurities, 
-                                                    self.impurities_concentrations, 
-                                                    self.impurities_mass_fractions,
-                                                    )
-    
-        # Convert data to a Json-file
-        self.json = self.convert_to_json()
+        # The reference data, the ions and additives complemented with reference data, and the Json string 
+        # are evaluated the first time they are used, see the properties below. 
+        # This means that e.g. the long and short form can be used without reading any reference data
         
         if save == True:
             # Save Json file
             self.save_data(file_path = self.save_path)
 
+    @cached_property
+    def reference_data_a_ions(self):
+        "Reference data for the A-ions"
+        return self.get_reference_table(0)
+
+    @cached_property
+    def reference_data_b_ions(self):
+        "Reference data for the B-ions"
+        return self.get_reference_table(1)
+
+    @cached_property
+    def reference_data_x_ions(self):
+        "Reference data for the X-ions"
+        return self.get_reference_table(2)
+
+    @cached_property
+    def reference_data_additive_and_impurities(self):
+        "Reference data for additives and impurities"
+        return self.get_reference_table(3)
+
+    @cached_property
+    def a_ions(self):
+        "A-ions complemented with reference data"
+        ions = []
+        if len(self.a_ions_abbreviations) > 0:
+            self.format_ions_with_complementary_data(ions, self.a_ions_abbreviations, self.reference_data_a_ions, self.a_coefficients)
+        return ions
+
+    @cached_property
+    def b_ions(self):
+        "B-ions complemented with reference data"
+        ions = []
+        if len(self.b_ions_abbreviations) > 0:
+            self.format_ions_with_complementary_data(ions, self.b_ions_abbreviations, self.reference_data_b_ions, self.b_coefficients)
+        return ions
+
+    @cached_property
+    def x_ions(self):
+        "X-ions complemented with reference data"
+        ions = []
+        if len(self.x_ions_abbreviations) > 0:
+            self.format_ions_with_complementary_data(ions, self.x_ions_abbreviations, self.reference_data_x_ions, self.x_coefficients)
+        return ions
+
+    @cached_property
+    def additives(self):
+        "Additives complemented with reference data"
+        additives = list(self.additives_given)
+        if len(self.additives_abbreviations) > 0:
+            self.format_additives_with_complementary_data(additives, 
+                                                        self.additives_abbreviations, 
+                                                        self.reference_data_additive_and_impurities, 
+                                                        self.additives_concentrations,
+                                                        self.additives_mass_fractions,                                                     
+                                                        )
+        return additives
+
+    @cached_property
+    def impurities(self):
+        "Impurities complemented with reference data"
+        impurities = list(self.impurities_given)
+        if len(self.impurities_abbreviations) > 0:
+            self.format_additives_with_complementary_data(impurities, 
+                                                        self.impurities_abbreviations, 
+                                                        self.reference_data_additive_and_impurities, 
+                                                        self.impurities_concentrations, 
+                                                        self.impurities_mass_fractions,
+                                                        )
+        return impurities
+
+    @cached_property
+    def json(self):
+        "The perovskite data as a Json string"
+        return self.convert_to_json()
+
+    @property
+    def timings(self):
+        "Time per stage from the timer, see StageTimer.as_dict. Empty if there is no timer"
+        if self.timer is None:
+            return {}
+        return self.timer.as_dict()
+
+    def stage(self, name):
+        "Context for timing a stage with the timer. Does nothing if there is no timer"
+        if self.timer is None:
+            return instrumentation.NULL_STAGE
+        return self.timer.stage(name)
+
     def add_parentheses(self, ions, n=2):
         # Enclose every ion with three letters or more with a parenthesis
         new_list = []
@@ -212,6 +275,16 @@ class PerovskiteToJson:
     def convert_to_json(self):
         "Convert to Json"
         
+        # The ions and additives are timed in their own stages the first time they are used
+        data = self.to_dict()
+
+        # Convert to json
+        with self.stage("convert_to_json"):
+            return self.serializer.dumps(data)
+
+    def to_dict(self):
+        "The perovskite data as a dictionary with the same structure as the Json file"
+        
         # Combine data into a dictionary
         perovskite_data = {
             "m_def":"perovskite_solar_cell_database.composition.PerovskiteComposition",     # For NOMAD compatibility
@@ -242,18 +315,18 @@ class PerovskiteToJson:
             "data": perovskite_data
         }    
         
-        # Convert to json
-        return json.dumps(data, indent=4)
+        return data
 
     def format_additives_with_complementary_data(self, additives, abbreviations, reference_data, concentration, mass_fraction):
         ""
-        for i, element in enumerate(abbreviations):
-            additives.append(self.get_additive_complementary_data(
-                element, 
-                additive_data=reference_data, 
-                additive_conc = concentration[i],
-                additive_mass_fraction = mass_fraction[i],
-                ))  
+        with self.stage("format_additives"):
+            for i, element in enumerate(abbreviations):
+                additives.append(self.get_additive_complementary_data(
+                    element, 
+                    additive_data=reference_data, 
+                    additive_conc = concentration[i],
+                    additive_mass_fraction = mass_fraction[i],
+                    ))  
 
     def format_list_of_numbers(self, num_list):
         "Ensures that the values are numbers"
@@ -289,11 +362,12 @@ class PerovskiteToJson:
 
     def format_ions_with_complementary_data(self, ions, abbreviations, reference_data, coefficients):
         ""
-        for i, ion in enumerate(abbreviations):
-            ions.append(self.get_ion_complementary_data(
-                ion, 
-                ion_data=reference_data, 
-                coef=coefficients[i]))            
+        with self.stage("format_ions"):
+            for i, ion in enumerate(abbreviations):
+                ions.append(self.get_ion_complementary_data(
+                    ion, 
+                    ion_data=reference_data, 
+                    coef=coefficients[i]))            
             
     def format_singel_string_values(self, item):
         "format a single string"
@@ -317,18 +391,21 @@ class PerovskiteToJson:
         "Get complementary data about additives and impurities from file"
         data_dict = {}
 
+        # All complementary data for the additive is found with one lookup in the index of the reference table
+        record = reference_data.get_index(additive_data).get(abbreviation)
+
         # Get data
         data_dict["abbreviation"] = abbreviation
         data_dict["concentration"] = additive_conc
         data_dict["mass_fraction"] = additive_mass_fraction
-        data_dict["molecular_formula"] = self.get_data_from_ion_datatables(abbreviation, additive_data, column="Molecular_formula")
-        data_dict["smiles"] = self.get_data_from_ion_datatables(abbreviation, additive_data, column="SMILE")
-        data_dict["common_name"] = self.get_data_from_ion_datatables(abbreviation, additive_data, column="Common_name")
-        data_dict["iupac_name"] = self.get_data_from_ion_datatables(abbreviation, additive_data, column="IUPAC_name")
-        data_dict["cas_number"] = self.get_data_from_ion_datatables(abbreviation, additive_data, column="CAS")       
-        data_dict["source_compound_smiles"] = self.get_data_from_ion_datatables(abbreviation, additive_data, column="Parent_SMILE")
-        data_dict["source_compound_iupac_name"] = self.get_data_from_ion_datatables(abbreviation, additive_data, column="Parent_IUPAC")
-        data_dict["source_compound_cas_number"] = self.get_data_from_ion_datatables(abbreviation, additive_data, column="Parent_CAS")
+        data_dict["molecular_formula"] = record["Molecular_formula"]
+        data_dict["smiles"] = record["SMILE"]
+        data_dict["common_name"] = record["Common_name"]
+        data_dict["iupac_name"] = record["IUPAC_name"]
+        data_dict["cas_number"] = record["CAS"]
+        data_dict["source_compound_smiles"] = record["Parent_SMILE"]
+        data_dict["source_compound_iupac_name"] = record["Parent_IUPAC"]
+        data_dict["source_compound_cas_number"] = record["Parent_CAS"]
     
         if not isinstance(data_dict["concentration"], str):
             if math.isnan(data_dict["concentration"]):
@@ -343,9 +420,19 @@ class PerovskiteToJson:
                 
         return data_dict
 
+    def get_reference_table(self, i):
+        "Reference table number i in the order given by reference_data.get_paths. The tables are shared between all objects in the process"
+        with self.stage("reference_data"):
+            path = reference_data.get_paths(self.path_to_reference_data)[i]
+            return reference_data.get_table(path, origin=self.path_to_reference_data)
+
     def get_data_from_ion_datatables(self, ion, ion_data, column):
         "Fetch data for ions using the abbreviation as the key"
         
+        # Columns in the index of the reference table are found with a dictionary lookup
+        if column in reference_data.INDEX_COLUMNS:
+            return reference_data.get_index(ion_data).get(ion)[column]
+
         data = ion_data.loc[ion_data["Abbreviation"] == ion, column].values
                 
         if len(data) == 0: # If not in database
@@ -364,18 +451,21 @@ class PerovskiteToJson:
         "Get complementary data about ions from file"        
         data_dict = {}
         
+        # All complementary data for the ion is found with one lookup in the index of the reference table
+        record = reference_data.get_index(ion_data).get(ion)
+
         # Get data
         data_dict["abbreviation"] = ion
         data_dict["coefficient"] = coef
         # data_dict["ion_type"] = type
-        data_dict["molecular_formula"] = self.get_data_from_ion_datatables(ion, ion_data, column="Molecular_formula")
-        data_dict["smiles"] = self.get_data_from_ion_datatables(ion, ion_data, column="SMILE")
-        data_dict["common_name"] = self.get_data_from_ion_datatables(ion, ion_data, column="Common_name")
-        data_dict["iupac_name"] = self.get_data_from_ion_datatables(ion, ion_data, column="IUPAC_name")
-        data_dict["cas_number"] = self.get_data_from_ion_datatables(ion, ion_data, column="CAS")       
-        data_dict["source_compound_smiles"] = self.get_data_from_ion_datatables(ion, ion_data, column="Parent_SMILE")
-        data_dict["source_compound_iupac_name"] = self.get_data_from_ion_datatables(ion, ion_data, column="Parent_IUPAC")
-        data_dict["source_compound_cas_number"] = self.get_data_from_ion_datatables(ion, ion_data, column="Parent_CAS")
+        data_dict["molecular_formula"] = record["Molecular_formula"]
+        data_dict["smiles"] = record["SMILE"]
+        data_dict["common_name"] = record["Common_name"]
+        data_dict["iupac_name"] = record["IUPAC_name"]
+        data_dict["cas_number"] = record["CAS"]
+        data_dict["source_compound_smiles"] = record["Parent_SMILE"]
+        data_dict["source_compound_iupac_name"] = record["Parent_IUPAC"]
+        data_dict["source_compound_cas_number"] = record["Parent_CAS"]
         
         # Remove keys with "nan" values
         data_dict = {key: value for key, value in data_dict.items() if value != "nan"}
@@ -477,11 +567,23 @@ class PerovskiteToJson:
         if file_path[-5:] != ".json":
             file_path = file_path + ".json"
         
+        # Use the Json string if it is already made. Otherwise the data is written to the file as it is 
+        # serialized, without making the string, and the serialization is timed in the save_data stage
+        if "json" in self.__dict__:
+            json_string = self.json
+        else:
+            json_string = None
+            data = self.to_dict()
+
         # Save the file    
         # with open("test.json", "w") as outfile:
         #     outfile.write(self.json)       
-        with open(file_path, "w") as outfile:
-            outfile.write(self.json)
+        with self.stage("save_data"):
+            with open(file_path, "w") as outfile:
+                if json_string is None:
+                    self.serializer.dump(data, outfile)
+                else:
+                    outfile.write(json_string)
 
 
             